@@ -5,17 +5,25 @@ import os
 parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, parent_dir)
 
-from flask import Flask, request, jsonify, render_template, send_from_directory  # 导入Flask框架及相关模块
+from flask import Flask, Response, request, jsonify, render_template, send_from_directory  # 导入Flask框架及相关模块
 from services.sleep_service import SleepService
 from services.user_service import UserService
 from utils.sleep_tracker import SleepTracker
 from utils.android_system import CrossPlatformSystem
 from utils.chart_generator import ChartGenerator
 from utils.user_tracker import UserTracker
+from utils.shared_state import SharedState
+from utils.conditional import ConditionalStats, make_etag
+from utils.moderation import ModerationFilter
 import platform  # 导入睡眠服务业务逻辑
+import datetime
+import json
+import zlib
 from services.behavior_service import BehaviorService  # 导入行为分析服务
 from services.incentive_service import IncentiveService  # 导入激励服务
-from services.chat_service import ChatService  # 导入聊天服务
+from services.chat_service import ChatService, DEFAULT_ROOM, sse_event  # 导入聊天服务
+from services.ranking_service import RankingService, parse_weights  # 导入综合排行服务
+from services.chat_search_service import ChatSearchService  # 导入聊天记录搜索服务
 from utils.error_reporter import error_reporter, auto_report_error
 from utils.error_reporter import report_generator
 from utils.scheduler import auto_scheduler
@@ -32,14 +40,59 @@ except ImportError:
 app = Flask(__name__, 
             template_folder=os.path.join(parent_dir, 'static'),
             static_folder=os.path.join(parent_dir, 'static'))  # 创建Flask应用实例
+# 多进程部署（如 gunicorn -w 4）时设置 SHARED_STATE_DB，聊天消息、在线用户、会话和待确认的微信绑定
+# 放在同一个 SQLite 库中供所有 worker 读写，用户数据默认改用 SQLite 存储
+shared_state = SharedState(os.environ['SHARED_STATE_DB']) if os.environ.get('SHARED_STATE_DB') else None
+# 设置 DATA_DIR 时用户、积分和聊天数据都放在该目录下（如测试使用临时目录），否则使用各服务的默认位置
+data_dir = os.environ.get('DATA_DIR')
 sleep_service = SleepService()
-sleep_tracker = SleepTracker()
-user_service = UserService()
+user_service = UserService(os.path.join(data_dir, 'users.json') if data_dir else 'users.json',
+                           storage_mode=os.environ.get('USER_STORAGE_MODE', 'sqlite' if shared_state else 'journal'),
+                           shared=shared_state is not None)
+sleep_tracker = SleepTracker(user_service.sleep_series)  # 睡眠趋势读取各用户自己的睡眠记录
 chart_generator = ChartGenerator()
-user_tracker = UserTracker()
+user_tracker = UserTracker(shared_state.namespace('sessions') if shared_state else None)
 behavior_service = BehaviorService()  # 实例化行为分析服务
-incentive_service = IncentiveService()  # 实例化激励服务
-chat_service = ChatService()  # 实例化聊天服务
+incentive_service = IncentiveService(data_dir or 'data', user_exists=user_service.storage.exists)  # 实例化激励服务，只为已注册用户记录行为和授予徽章
+user_service.listeners.append(incentive_service)  # 删除用户时一并清除其积分、徽章和积分记录
+# 聊天敏感词表（每行一个词），文件修改后几秒内自动生效，也可调用 /admin/moderation/reload 立即重新加载
+chat_moderation = ModerationFilter(os.environ.get('CHAT_WORDS_FILE',
+                                                  os.path.join(parent_dir, 'data', 'moderation_words.txt')))
+chat_service = ChatService(shared_state, data_dir=data_dir, moderation=chat_moderation)  # 实例化聊天服务
+chat_search_service = ChatSearchService(chat_service)  # 聊天记录全文搜索，历史消息在后台建立索引
+# 健康分数 + 积分综合排行，权重通过 LEADERBOARD_WEIGHTS（如 "health=1,points=0.1"）配置；
+# 多进程部署时定期重建以纳入其它 worker 的修改
+ranking_service = RankingService(user_service, incentive_service,
+                                 weights=parse_weights(os.environ.get('LEADERBOARD_WEIGHTS')),
+                                 rebuild_interval=30 if shared_state else None)
+pending_binds = shared_state.namespace('wechat_binds', ttl=300) if shared_state else {}  # 二维码绑定在请求之间共享
+BULK_AWARD_LIMIT = 10000  # 批量发放接口单次最多处理的操作数
+conditional_stats = ConditionalStats()  # 各轮询接口的 304 命中统计
+# 多进程部署时版本号取自共享库的接口使用共享库的标识生成 ETag，轮询落到任一 worker 都能得到 304
+shared_epoch = shared_state.epoch() if shared_state else None
+
+def conditional_json(endpoint, version, build, epoch=None):
+    """
+    带 ETag 的 JSON 响应：ETag 由接口、查询参数和数据版本生成，
+    客户端 If-None-Match 与之相同时直接返回 304，不生成也不序列化响应数据
+    :param version: 数据版本，为 None 时（如多进程部署下没有版本号）总是返回完整响应
+    :param build: 生成响应数据的函数，只在需要返回完整响应时调用
+    :param epoch: 版本号来自共享库时传入 shared_epoch；默认使用本进程的标识，只有同一个 worker 的 ETag 会匹配
+    """
+    if version is None:
+        conditional_stats.record(endpoint, False)
+        return jsonify(build())
+    etag = make_etag(endpoint, request.query_string, version, epoch=epoch)
+    if request.if_none_match.contains_weak(etag):
+        conditional_stats.record(endpoint, True)
+        response = Response(status=304)
+    else:
+        conditional_stats.record(endpoint, False)
+        response = jsonify(build())
+    response.set_etag(etag)
+    # 浏览器每次轮询都带上 If-None-Match 重新验证，而不是直接使用本地缓存
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/')
 def index():
@@ -76,6 +129,17 @@ def analyze_sleep():
     total_score = user_service.add_health_score(data['user_id'], analysis['quality_score'])
     result['total_health_score'] = total_score
     
+    # 记录到用户自己的睡眠时序数据
+    user_service.record_user_series(data['user_id'], 'sleep_data', datetime.date.today().isoformat(), {
+        'sleep_hours': data['sleep_hours'],
+        'bedtime': data['bedtime'],
+        'quality_score': analysis['quality_score']
+    })
+    
+    # 更新连续天数并检查成就
+    incentive_service.record_activity(data['user_id'], 'analyze_sleep')
+    result['new_badges'] = incentive_service.check_achievements(data['user_id'], 'analyze_sleep', result)
+    
     return jsonify(result)
 
 @app.route('/analyze-behavior', methods=['POST'])
@@ -116,6 +180,18 @@ def analyze_behavior():
     total_score = user_service.add_health_score(data['user_id'], result['behavior_score'])
     result['total_health_score'] = total_score
     
+    # 记录到用户自己的行为数据分片
+    user_service.record_user_series(data['user_id'], 'behavior_data', datetime.date.today().isoformat(), {
+        'screen_time': result.get('screen_time'),
+        'exercise_time': result.get('exercise_time'),
+        'steps': result.get('steps'),
+        'score': result['behavior_score']
+    })
+    
+    # 更新连续天数并检查成就
+    incentive_service.record_activity(data['user_id'], 'analyze_behavior')
+    result['new_badges'] = incentive_service.check_achievements(data['user_id'], 'analyze_behavior', result)
+    
     return jsonify(result)
 
 @app.route('/user/<user_id>/points', methods=['GET'])
@@ -124,6 +200,25 @@ def get_user_points(user_id):
     points = incentive_service.get_user_points(user_id)
     return jsonify({'points': points})
 
+@app.route('/user/<user_id>/points/history', methods=['GET'])
+def get_points_history(user_id):
+    """
+    获取用户最近的积分变动
+    参数：limit（默认20，最大500）；start/end（ISO 时间或日期，end 不含）指定时间段时同时返回该时间段的积分合计
+    """
+    limit = max(0, min(request.args.get('limit', 20, type=int), 500))
+    start = request.args.get('start')
+    end = request.args.get('end')
+    result = {'history': incentive_service.get_points_history(user_id, limit)}
+    if start or end:
+        result['total'] = incentive_service.sum_points(user_id, start, end)
+    return jsonify(result)
+
+@app.route('/user/<user_id>/streaks', methods=['GET'])
+def get_user_streaks(user_id):
+    """获取用户各行为（睡眠分析、行为分析）的当前和最长连续天数"""
+    return jsonify({'streaks': incentive_service.get_streaks(user_id)})
+
 @app.route('/user/<user_id>/badges', methods=['GET'])
 def get_user_badges(user_id):
     """获取用户徽章"""
@@ -178,25 +273,24 @@ def get_system_info():
 
 @app.route('/sleep-pattern', methods=['GET'])
 def get_sleep_pattern():
-    """获取睡眠模式检测"""
-    pattern = sleep_tracker.detect_sleep_pattern()
-    trends = sleep_tracker.get_sleep_trends()
-    return jsonify({
-        'pattern': pattern,
-        'trends': trends
+    """获取睡眠模式检测，user 参数指定时同时返回该用户最近 7 天的睡眠趋势"""
+    username = request.args.get('user')
+    return conditional_json('sleep-pattern', sleep_tracker.pattern_version(), lambda: {
+        'pattern': sleep_tracker.detect_sleep_pattern(),
+        'trends': sleep_tracker.get_sleep_trends(username) if username else None
     })
 
 @app.route('/register', methods=['POST'])
 def register():
     data = request.json
     result = user_service.register_user(data['username'], data['password'])
-    return jsonify(result)
+    return jsonify(result), 503 if result.get('busy') else 200
 
 @app.route('/login', methods=['POST'])
 def login():
     data = request.json
     result = user_service.login_user(data['username'], data['password'])
-    return jsonify(result)
+    return jsonify(result), 503 if result.get('busy') else 200
 
 @app.route('/user/<username>', methods=['GET'])
 def get_user(username):
@@ -207,20 +301,29 @@ def get_user(username):
 
 @app.route('/leaderboard', methods=['GET'])
 def get_leaderboard():
-    leaderboard = user_service.get_leaderboard()
-    return jsonify({'leaderboard': leaderboard})
+    """综合排行前 10 名 [[用户名, 健康分数, 积分], ...]"""
+    return conditional_json('leaderboard', ranking_service.version(),
+                            lambda: {'leaderboard': ranking_service.top()})
+
+@app.route('/user/<username>/rank', methods=['GET'])
+def get_user_rank(username):
+    """用户在综合排行中的名次，与 /leaderboard 使用同一排行"""
+    rank_info = ranking_service.rank(username)
+    if rank_info:
+        return jsonify(rank_info)
+    return jsonify({'error': '用户不存在或不参与排名'}), 404
 
 @app.route('/charts/sleep/<username>', methods=['GET'])
 def get_sleep_chart(username):
-    user_info = user_service.get_user_info(username)
-    if user_info and user_info.get('sleep_data'):
-        chart = chart_generator.create_sleep_chart(user_info['sleep_data'])
+    sleep_data = sleep_tracker.get_recent_records(username)
+    if sleep_data:
+        chart = chart_generator.create_sleep_chart(sleep_data)
         return jsonify({'chart': chart})
     return jsonify({'error': '无数据'}), 404
 
 @app.route('/charts/leaderboard', methods=['GET'])
 def get_leaderboard_chart():
-    leaderboard = user_service.get_leaderboard()
+    leaderboard = ranking_service.top()
     chart = chart_generator.create_leaderboard_chart(leaderboard)
     return jsonify({'chart': chart})
 
@@ -247,50 +350,89 @@ def step_counter():
 
 @app.route('/admin/users', methods=['GET'])
 def get_all_users():
+    """
+    分页获取普通用户列表
+    参数：limit（默认50，最大500）、cursor（上一页返回的 next_cursor）、
+    sort=score|created_at|-created_at|username、online=1、device=<设备类型>、
+    wechat=1|0、min_score、max_score
+    """
+    args = request.args
+    limit = max(1, min(args.get('limit', 50, type=int), 500))
+    wechat = args.get('wechat')
+    only = user_tracker.find_usernames(online=args.get('online') == '1', device=args.get('device'))
+    try:
+        page, next_cursor = user_service.page_users(
+            sort=args.get('sort', 'score'),
+            cursor=args.get('cursor'),
+            limit=limit,
+            min_score=args.get('min_score', type=float),
+            max_score=args.get('max_score', type=float),
+            wechat=None if wechat in (None, '') else wechat == '1',
+            only=only
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
     users_data = []
-    user_status = user_tracker.get_all_user_status()
-    
-    for username, data in user_service.users.items():
-        if not data.get('is_admin', False):
-            status = user_status.get(username, {})
-            users_data.append({
-                'username': username,
-                'health_score': data.get('health_score', 0),
-                'created_at': data.get('created_at', ''),
-                'is_online': status.get('is_online', False),
-                'last_active': status.get('last_active'),
-                'ip_address': status.get('ip_address'),
-                'device_type': status.get('device_type', 'Unknown'),
-                'wechat_openid': data.get('wechat_openid'),
-                'wechat_nickname': data.get('wechat_info', {}).get('nickname')
-            })
-    return jsonify({'users': users_data})
+    for username, data in page:
+        status = user_tracker.get_user_status(username)
+        users_data.append({
+            'username': username,
+            'health_score': data.get('health_score', 0),
+            'created_at': data.get('created_at', ''),
+            'is_online': status.get('is_online', False),
+            'last_active': status.get('last_active'),
+            'ip_address': status.get('ip_address'),
+            'device_type': status.get('device_type', 'Unknown'),
+            'wechat_openid': data.get('wechat_openid'),
+            'wechat_nickname': data.get('wechat_info', {}).get('nickname')
+        })
+    return jsonify({'users': users_data, 'next_cursor': next_cursor})
 
 @app.route('/admin/stats', methods=['GET'])
 def get_system_stats():
-    regular_users = [data for data in user_service.users.values() if not data.get('is_admin', False)]
-    total_users = len(regular_users)
-    active_users = len([u for u in regular_users if u.get('health_score', 0) > 0])
-    avg_score = sum(u.get('health_score', 0) for u in regular_users) / max(total_users, 1)
-    
-    return jsonify({
-        'total_users': total_users,
-        'active_users': active_users,
-        'avg_score': avg_score
-    })
+    stats = user_service.get_system_stats()
+    stats['online_users'] = len(user_tracker.online_usernames())
+    return jsonify(stats)
+
+@app.route('/admin/cache-stats', methods=['GET'])
+def get_cache_stats():
+    """各轮询接口的请求数、304 次数和 304 命中率"""
+    return jsonify({'endpoints': conditional_stats.snapshot()})
+
+@app.route('/admin/moderation/reload', methods=['POST'])
+def reload_moderation_words():
+    """立即重新加载聊天敏感词表"""
+    return jsonify({'success': True, 'words': chat_moderation.reload()})
 
 @app.route('/admin/clear-data', methods=['POST'])
 def clear_all_data():
     # 清除所有非管理员用户数据
-    for username, data in user_service.users.items():
-        if not data.get('is_admin', False):
-            data['health_score'] = 0
-            data['sleep_data'] = {}
-            data['behavior_data'] = {}
-    
-    user_service.save_users()
+    user_service.clear_all_data()
     return jsonify({'success': True, 'message': '数据清除成功'})
 
+@app.route('/admin/incentives/bulk', methods=['POST'])
+def bulk_award_incentives():
+    """
+    批量发放积分、徽章和更新习惯进度（活动奖励、数据补录）
+    请求体：{"operations": [{"user_id", "points", "reason", "badge", "habit", "progress"}, ...]}，
+    最多 BULK_AWARD_LIMIT 条；返回与请求一一对应的结果
+    """
+    operations = (request.get_json(silent=True) or {}).get('operations')
+    if not isinstance(operations, list):
+        return jsonify({'success': False, 'message': 'operations 必须是数组'}), 400
+    if len(operations) > BULK_AWARD_LIMIT:
+        return jsonify({'success': False, 'message': f'单次最多 {BULK_AWARD_LIMIT} 条操作'}), 400
+    results = incentive_service.bulk_award(operations)
+    failed = sum(1 for result in results if not result['success'])
+    return jsonify({'success': failed == 0, 'applied': len(results) - failed, 'failed': failed,
+                    'results': results})
+
+@app.route('/admin/achievements/stats', methods=['GET'])
+def get_achievement_stats():
+    """成就规则评估统计：各事件的评估次数、挂载规则数、平均/最大耗时（微秒）"""
+    return jsonify({'events': incentive_service.get_achievement_stats()})
+
 @app.route('/admin/reset-leaderboard', methods=['POST'])
 def reset_leaderboard():
     user_service.reset_all_scores()
@@ -377,7 +519,7 @@ def generate_wechat_qr():
     if not username:
         return jsonify({'success': False, 'message': '缺少用户名'})
     
-    qr_generator = SimpleQRGenerator()
+    qr_generator = SimpleQRGenerator(pending_binds)
     qr_data = qr_generator.generate_bind_qr(username)
     
     return jsonify({
@@ -391,7 +533,7 @@ def generate_wechat_qr():
 def check_bind_status(bind_code):
     from utils.simple_qr import SimpleQRGenerator
     
-    qr_generator = SimpleQRGenerator()
+    qr_generator = SimpleQRGenerator(pending_binds)
     status = qr_generator.check_bind_status(bind_code)
     
     if status['status'] == 'confirmed':
@@ -424,9 +566,7 @@ def get_wechat_steps(username):
 
 @app.route('/admin/delete-user/<username>', methods=['DELETE', 'POST'])
 def delete_user(username):
-    if username in user_service.users and not user_service.users[username].get('is_admin', False):
-        del user_service.users[username]
-        user_service.save_users()
+    if user_service.delete_user(username):
         return jsonify({'success': True, 'message': '用户删除成功'})
     return jsonify({'success': False, 'message': '用户不存在或无权限删除'})
 
@@ -446,22 +586,91 @@ def get_user_status():
 
 @app.route('/admin/export', methods=['GET'])
 def export_users_data():
-    export_data = {}
-    for username, data in user_service.users.items():
-        if not data.get('is_admin', False):
-            export_data[username] = {
-                'health_score': data.get('health_score', 0),
-                'created_at': data.get('created_at', ''),
-                'sleep_data': data.get('sleep_data', {}),
-                'behavior_data': data.get('behavior_data', {})
-            }
-    return jsonify(export_data)
+    """
+    流式导出用户数据
+    format=json（默认）输出 {用户名: 数据} 对象，format=ndjson 每行一个用户；
+    gzip=1 以 gzip 压缩文件下载；updated_since=<ISO时间> 只导出之后修改过的用户
+    """
+    export_format = request.args.get('format', 'json')
+    use_gzip = request.args.get('gzip') == '1'
+    updated_since = request.args.get('updated_since')
+    
+    def generate_json():
+        yield '{'
+        for index, record in enumerate(user_service.iter_export(updated_since)):
+            username = record.pop('username')
+            yield ('' if index == 0 else ',') + json.dumps(username, ensure_ascii=False) + ':' + \
+                json.dumps(record, ensure_ascii=False)
+        yield '}'
+    
+    def generate_ndjson():
+        for record in user_service.iter_export(updated_since):
+            yield json.dumps(record, ensure_ascii=False) + '\n'
+    
+    def compress(chunks):
+        compressor = zlib.compressobj(wbits=31)  # gzip 格式
+        for chunk in chunks:
+            data = compressor.compress(chunk.encode('utf-8'))
+            if data:
+                yield data
+        yield compressor.flush()
+    
+    if export_format == 'ndjson':
+        chunks, mimetype, filename = generate_ndjson(), 'application/x-ndjson', 'users_data.ndjson'
+    else:
+        chunks, mimetype, filename = generate_json(), 'application/json', 'users_data.json'
+    
+    headers = {}
+    if use_gzip:
+        chunks, mimetype, filename = compress(chunks), 'application/gzip', filename + '.gz'
+        headers['Content-Disposition'] = f'attachment; filename={filename}'
+    
+    # 生成器响应不设置 Content-Length，按分块传输逐步发送
+    return Response(chunks, mimetype=mimetype, headers=headers)
 
 @app.route('/health', methods=['GET'])
 def health_check():
     return jsonify({'status': 'healthy'})
 
 # 聊天室相关路由
+def get_chat_room(name, create=False):
+    """
+    按名称取聊天室，名称为空时为默认聊天室
+    :param create: 不存在时是否新建，只有发言和加入聊天室时新建，只读的请求不会新建
+    :return: (聊天室, 错误响应)，名称不合法、聊天室不存在或数量已达上限时聊天室为 None
+    """
+    try:
+        return chat_service.room(name or DEFAULT_ROOM, create=create), None
+    except KeyError:
+        return None, (jsonify({'success': False, 'message': '聊天室不存在'}), 404)
+    except ValueError as e:
+        return None, (jsonify({'success': False, 'message': str(e)}), 400)
+
+@app.route('/chat/rooms', methods=['GET'])
+def list_chat_rooms():
+    """全部聊天室及各自的在线人数"""
+    return jsonify({'rooms': chat_service.get_room_sizes()})
+
+@app.route('/chat/search', methods=['GET'])
+def search_chat():
+    """
+    搜索聊天记录，按时间从新到旧返回
+    q: 关键词，多个以空格分隔；room: 只搜索该聊天室；limit: 最多返回条数（默认 20，最多 100）
+    complete 为 false 时历史消息的索引仍在建立，结果可能不全
+    """
+    query = request.args.get('q', '')
+    room_name = request.args.get('room')
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    if room_name:
+        _, error = get_chat_room(room_name)
+        if error:
+            return error
+    try:
+        results = chat_search_service.search(query, room=room_name or None, limit=limit)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return jsonify({'success': True, 'results': results, 'complete': chat_search_service.backfilled.is_set()})
+
 @app.route('/chat/send', methods=['POST'])
 def send_message():
     data = request.json
@@ -470,22 +679,110 @@ def send_message():
     
     if not username or not message:
         return jsonify({'success': False, 'message': '参数不完整'})
+    room, error = get_chat_room(data.get('room'), create=True)
+    if error:
+        return error
     
-    msg = chat_service.add_message(username, message)
+    msg = room.add_message(username, message)
     return jsonify({'success': True, 'message': msg})
 
+# /chat/messages 每页的消息数
+CHAT_PAGE_SIZE = 50
+
 @app.route('/chat/messages', methods=['GET'])
 def get_messages():
-    messages = chat_service.get_recent_messages()
-    return jsonify({'messages': messages})
+    """
+    获取聊天消息
+    room: 聊天室名，默认为大厅
+    after: 返回 id 大于该值的最早 50 条新消息，供轮询取增量；不传时返回最近 50 条
+    before: 返回 id 小于该值的最近 50 条，用于向前翻阅历史
+    has_more 为 true 时还有更多消息：after 时以最后一条的 id 继续取，before 时以第一条的 id 继续翻
+    """
+    room, error = get_chat_room(request.args.get('room'))
+    if error:
+        return error
+    after = request.args.get('after', type=int)
+    before = request.args.get('before', type=int)
+    
+    def build():
+        # 多取一条判断是否还有下一页
+        if before is not None:
+            messages = room.get_messages_before(before, CHAT_PAGE_SIZE + 1)
+            has_more = len(messages) > CHAT_PAGE_SIZE
+            messages = messages[-CHAT_PAGE_SIZE:]
+        elif after is not None:
+            messages = room.get_messages_after(after, CHAT_PAGE_SIZE + 1)
+            has_more = len(messages) > CHAT_PAGE_SIZE
+            messages = messages[:CHAT_PAGE_SIZE]
+        else:
+            messages = room.get_recent_messages(CHAT_PAGE_SIZE)
+            has_more = False
+        return {'messages': messages, 'has_more': has_more}
+    
+    # 多进程部署时消息版本号是共享库中的日志 id
+    return conditional_json('chat/messages', room.message_version(), build, epoch=shared_epoch)
+
+# 推送连接在没有事件时发送注释行的间隔秒数，用于保持连接并及时发现客户端断开
+CHAT_KEEPALIVE = 15
+
+@app.route('/chat/stream', methods=['GET'])
+def chat_stream():
+    """
+    以 Server-Sent Events 推送聊天室的新消息（message 事件）和在线人数（online 事件）
+    room: 聊天室名，默认为大厅
+    after: 先补发 id 大于该值的消息；浏览器重连时自动带上的 Last-Event-ID 优先
+    """
+    room, error = get_chat_room(request.args.get('room'))
+    if error:
+        return error
+    after = request.headers.get('Last-Event-ID', type=int)
+    if after is None:
+        after = request.args.get('after', type=int)
+    # 先订阅再读取补发的消息，两者之间写入的消息不会遗漏，重复的按 id 跳过
+    subscriber = room.subscribe()
+    online = room.get_online_count()
+    
+    def generate():
+        last_id = after or 0
+        try:
+            yield 'retry: 3000\n\n'
+            # 按页补发，直到取完，不在补发的消息和推送的消息之间留下缺口
+            while after is not None:
+                backlog = room.get_messages_after(last_id, CHAT_PAGE_SIZE)
+                for msg in backlog:
+                    yield sse_event('message', msg, msg['id'])
+                    last_id = msg['id']
+                if len(backlog) < CHAT_PAGE_SIZE:
+                    break
+            yield sse_event('online', {'count': online})
+            while True:
+                item = subscriber.get(timeout=CHAT_KEEPALIVE)
+                if item is None:
+                    if subscriber.closed:
+                        return  # 消费过慢被移出，客户端重连后补齐
+                    yield ': keepalive\n\n'
+                    continue
+                event_id, chunk = item
+                if event_id is not None and event_id <= last_id:
+                    continue
+                last_id = event_id or last_id
+                yield chunk
+        finally:
+            room.unsubscribe(subscriber)
+    
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/chat/join', methods=['POST'])
 def join_chat():
     data = request.json
     username = data.get('username')
+    room, error = get_chat_room(data.get('room'), create=True)
+    if error:
+        return error
     
     if username:
-        chat_service.join_room(username)
+        chat_service.join_room(username, room.name)
         return jsonify({'success': True})
     return jsonify({'success': False})
 
@@ -493,17 +790,27 @@ def join_chat():
 def leave_chat():
     data = request.json
     username = data.get('username')
+    room, error = get_chat_room(data.get('room'))
+    if error:
+        return error
     
     if username:
-        chat_service.leave_room(username)
+        chat_service.leave_room(username, room.name)
         return jsonify({'success': True})
     return jsonify({'success': False})
 
 @app.route('/chat/online', methods=['GET'])
 def get_online_users():
-    count = chat_service.get_online_count()
-    users = chat_service.get_online_users()
-    return jsonify({'count': count, 'users': users})
+    """聊天室（room，默认为大厅）的在线用户，以及所有聊天室的去重在线人数和各聊天室人数"""
+    room, error = get_chat_room(request.args.get('room'))
+    if error:
+        return error
+    return conditional_json('chat/online', chat_service.presence_version(), lambda: {
+        'count': room.get_online_count(),
+        'users': room.get_online_users(),
+        'total': chat_service.get_online_count(None),
+        'rooms': chat_service.get_room_sizes()
+    })
 
 @app.route('/error-report', methods=['GET'])  # 错误报告接口
 def get_error_report():
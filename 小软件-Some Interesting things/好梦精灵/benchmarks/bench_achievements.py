@@ -0,0 +1,68 @@
+"""
+成就规则评估：逐条检查全部规则 与 按事件分派
+
+规则平均分布在 25 种事件上，每条规则带一个事实条件（连续天数）和一个事件字段条件。
+对比每次事件评估时遍历全部规则（按 event 过滤后检查）与只检查分派表中该事件规则的耗时。
+运行：python benchmarks/bench_achievements.py
+"""
+import os
+import sys
+import time
+
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, parent_dir)
+
+from services.achievement_engine import AchievementEngine, OPERATORS
+
+EVENTS = [f'event{i}' for i in range(25)]
+
+
+def make_rules(count):
+    return [{'badge': f'badge{i}', 'event': EVENTS[i % len(EVENTS)],
+             'when': [['streak', '>=', i % 40 + 1], ['score', '>=', i % 100]]}
+            for i in range(count)]
+
+
+def streak(user_id, event, data):
+    return 12
+
+
+def scan_all(rules, user_id, event, data, owned=()):
+    """旧做法：每个事件都遍历全部规则，条件中的事实每次重新计算"""
+    earned = []
+    for rule in rules:
+        if rule['event'] != event or rule['badge'] in owned:
+            continue
+        for field, op, expected in rule['when']:
+            value = streak(user_id, event, data) if field == 'streak' else data.get(field)
+            if not OPERATORS[op](value, expected):
+                break
+        else:
+            earned.append(rule['badge'])
+    return earned
+
+
+def timed(func, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        func(i)
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    print(f"{'规则数':>8} {'遍历全部(us)':>14} {'分派表(us)':>12}")
+    for count in (10, 100, 500, 2000):
+        rules = make_rules(count)
+        engine = AchievementEngine(rules, facts={'streak': streak})
+        data = {'score': 60}
+        for event in EVENTS:
+            assert scan_all(rules, 'alice', event, data) == engine.evaluate('alice', event, data)
+        scan_us = timed(lambda i: scan_all(rules, 'alice', EVENTS[i % 25], data), 20000)
+        engine_us = timed(lambda i: engine.evaluate('alice', EVENTS[i % 25], data), 20000)
+        print(f"{count:>8} {scan_us:>14.2f} {engine_us:>12.2f}")
+    stats = engine.stats()['event0']
+    print(f"引擎统计示例 event0：{stats}")
+
+
+if __name__ == '__main__':
+    main()
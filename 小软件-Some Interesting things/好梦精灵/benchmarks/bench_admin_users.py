@@ -0,0 +1,111 @@
+"""
+后台用户列表：一次返回全部用户 与 游标分页 + 服务端筛选
+
+对比旧接口（遍历全部用户并序列化）与分页查询首页、翻页、带条件查询的耗时和响应大小。
+运行：python benchmarks/bench_admin_users.py [用户数]
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, parent_dir)
+
+from services.user_service import UserService
+from services.user_storage import JournalUserStorage, SQLiteUserStorage
+
+
+def make_users(count):
+    rng = random.Random(1)
+    return {
+        f'user{i}': {
+            'password_hash': 'pbkdf2:sha256:600000$bench$' + '0' * 64,
+            'created_at': f'2024-{i * 12 // count + 1:02d}-{i % 28 + 1:02d}T{i % 24:02d}:00:00',
+            'updated_at': '2024-01-01T00:00:00',
+            'health_score': rng.randrange(1000),
+            'is_admin': False,
+            'wechat_openid': f'openid{i}' if i % 4 == 0 else None,
+            'wechat_info': {'nickname': f'n{i}'} if i % 4 == 0 else {}
+        }
+        for i in range(count)
+    }
+
+
+def timed(func, repeat=5):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+
+def list_all(service):
+    """旧接口：所有普通用户一次性序列化"""
+    users = [{'username': username, 'health_score': data.get('health_score', 0),
+              'created_at': data.get('created_at', ''), 'wechat_openid': data.get('wechat_openid')}
+             for username, data in service.iter_users()]
+    return len(json.dumps({'users': users}, ensure_ascii=False))
+
+
+def page(service, **kwargs):
+    users, cursor = service.page_users(limit=50, **kwargs)
+    body = [{'username': username, 'health_score': data.get('health_score', 0),
+             'created_at': data.get('created_at', ''), 'wechat_openid': data.get('wechat_openid')}
+            for username, data in users]
+    return len(json.dumps({'users': body, 'next_cursor': cursor}, ensure_ascii=False)), cursor
+
+
+def deep_page(service, sort, pages=100):
+    cursor = None
+    for _ in range(pages):
+        _, cursor = service.page_users(sort=sort, cursor=cursor, limit=50)
+    return page(service, sort=sort, cursor=cursor)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    users = make_users(count)
+    online = set(random.Random(2).sample(sorted(users), 300))
+    work_dir = tempfile.mkdtemp()
+    try:
+        users_file = os.path.join(work_dir, 'users.json')
+        with open(users_file, 'w', encoding='utf-8') as f:
+            json.dump(users, f, ensure_ascii=False)
+        db_storage = SQLiteUserStorage(os.path.join(work_dir, 'users.db'))
+        db_storage.import_users(users)
+
+        start = time.perf_counter()
+        services = {
+            'journal': UserService(storage=JournalUserStorage(users_file),
+                                   series_dir=os.path.join(work_dir, 'user_shards')),
+            'sqlite': UserService(storage=db_storage, series_dir=os.path.join(work_dir, 'user_shards'))
+        }
+        print(f"{count} 个用户（加载含建索引 {(time.perf_counter() - start) * 1000:.0f} ms）")
+
+        cases = [
+            ('旧接口：全部用户', lambda s: (list_all(s), None), 1),
+            ('分页：分数首页', lambda s: page(s), 20),
+            ('分页：分数连翻101页', lambda s: deep_page(s, 'score'), 1),
+            ('分页：最新注册连翻101页', lambda s: deep_page(s, '-created_at'), 1),
+            ('筛选：分数 500-510', lambda s: page(s, min_score=500, max_score=510), 20),
+            ('筛选：已绑定微信', lambda s: page(s, sort='username', wechat=True), 20),
+            ('筛选：在线用户(300)', lambda s: page(s, only=online), 20),
+        ]
+        print(f"{'查询':<22} {'journal(ms)':>12} {'sqlite(ms)':>12} {'响应(KB)':>10}")
+        for label, func, repeat in cases:
+            row = []
+            for name in ('journal', 'sqlite'):
+                elapsed, (size, _) = timed(lambda: func(services[name]), repeat)
+                row.append(elapsed)
+            print(f"{label:<22} {row[0]:>12.2f} {row[1]:>12.2f} {size / 1024:>10.1f}")
+        services['journal'].storage.close()
+        db_storage.close()
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+批量发放：逐条调用 add_points / award_badge / update_habit 与 bulk_award
+
+三种方式处理同一批操作（积分 + 徽章，其中一部分完成习惯）：
+1. 旧实现：每次调用整体读写 JSON 文件，并重写该用户的积分历史文件（抽样 200 条后按比例折算）；
+2. 当前实现逐条调用：内存缓存 + 账本逐条追加；
+3. bulk_award：一轮加锁修改，账本一次写入。
+运行：python benchmarks/bench_bulk_award.py [用户数] [每批操作数]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+from datetime import datetime
+
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, parent_dir)
+
+from services.incentive_service import IncentiveService
+from utils.write_behind import WriteBehindWriter
+
+
+def seed(data_dir, count):
+    os.makedirs(data_dir)
+    files = {
+        'user_points.json': {f'user{i}': i for i in range(count)},
+        'user_badges.json': {f'user{i}': ['habit_master'] for i in range(0, count, 2)},
+        'user_habits.json': {}
+    }
+    for name, data in files.items():
+        with open(os.path.join(data_dir, name), 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def make_operations(count, users):
+    operations = []
+    for i in range(count):
+        operation = {'user_id': f'user{i * 7 % users}', 'points': 30, 'reason': '春节活动', 'badge': 'new_year_2025'}
+        if i % 5 == 0:
+            operation.update(habit='早睡', progress=100)
+        operations.append(operation)
+    return operations
+
+
+def rw(data_dir, name, mutate):
+    path = os.path.join(data_dir, name)
+    data = {}
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    mutate(data)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def old_add_points(data_dir, user_id, points, reason):
+    rw(data_dir, 'user_points.json', lambda d: d.__setitem__(user_id, d.get(user_id, 0) + points))
+    entry = {'timestamp': datetime.now().isoformat(), 'points': points, 'reason': reason}
+    history_file = os.path.join(data_dir, f'points_history_{user_id}.json')
+    history = []
+    if os.path.exists(history_file):
+        with open(history_file, 'r', encoding='utf-8') as f:
+            history = json.load(f)
+    history.append(entry)
+    with open(history_file, 'w', encoding='utf-8') as f:
+        json.dump(history, f, ensure_ascii=False, indent=2)
+
+
+def old_award_badge(data_dir, user_id, badge):
+    def mutate(data):
+        owned = data.setdefault(user_id, [])
+        if badge not in owned:
+            owned.append(badge)
+    rw(data_dir, 'user_badges.json', mutate)
+
+
+def old_apply(data_dir, operation):
+    """旧实现中一条操作需要的调用"""
+    user_id = operation['user_id']
+    old_add_points(data_dir, user_id, operation['points'], operation['reason'])
+    old_award_badge(data_dir, user_id, operation['badge'])
+    if 'habit' in operation:
+        rw(data_dir, 'user_habits.json',
+           lambda d: d.setdefault(user_id, {}).__setitem__(operation['habit'], {'progress': 100, 'completed': True}))
+        old_add_points(data_dir, user_id, 50, f"完成习惯: {operation['habit']}")
+        old_award_badge(data_dir, user_id, 'habit_master')
+
+
+def per_call(service, operation):
+    user_id = operation['user_id']
+    service.add_points(user_id, operation['points'], operation['reason'])
+    service.award_badge(user_id, operation['badge'])
+    if 'habit' in operation:
+        service.update_habit(user_id, operation['habit'], operation['progress'])
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    batch = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    operations = make_operations(batch, users)
+    work_dir = tempfile.mkdtemp()
+    try:
+        print(f"{users} 个用户，每批 {batch} 条操作（每 5 条有 1 条完成习惯）")
+        print(f"{'方式':<22} {'整批(ms)':>12} {'每条(ms)':>10} {'账本写入次数':>12}")
+
+        old_dir = os.path.join(work_dir, 'old')
+        seed(old_dir, users)
+        sample = operations[:200]
+        start = time.perf_counter()
+        for operation in sample:
+            old_apply(old_dir, operation)
+        per_op = (time.perf_counter() - start) / len(sample) * 1000
+        print(f"{'旧实现逐条（折算）':<22} {per_op * batch:>12.0f} {per_op:>10.3f} {'-':>12}")
+
+        for label, run in (('当前实现逐条调用', lambda s: [per_call(s, op) for op in operations]),
+                           ('bulk_award', lambda s: s.bulk_award(operations))):
+            data_dir = os.path.join(work_dir, label)
+            seed(data_dir, users)
+            writer = WriteBehindWriter(interval=1.0)
+            service = IncentiveService(data_dir, writer=writer)
+            service.get_user_points('user0')
+            writes = []
+            original = service.ledger._write
+            service.ledger._write = lambda line: writes.append(1) or original(line)
+            start = time.perf_counter()
+            run(service)
+            elapsed = (time.perf_counter() - start) * 1000
+            service.close()
+            writer.stop()
+            print(f"{label:<22} {elapsed:>12.1f} {elapsed / batch:>10.4f} {len(writes):>12}")
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+聊天记录：整体重写最近 100 条的 JSON 文件 与 按天分段追加写的聊天记录
+
+1. 每条消息的持久化耗时：旧做法把最近 100 条以 indent=2 整体写入 chat_messages.json
+   （临时文件 + rename），新做法向当天的段文件追加一行（fsync 由后台线程合并）。
+2. 启动耗时随历史总量的变化：历史分布在 30 天的段文件中，ChatService 启动时只从
+   最新的段末尾读取内存窗口（500 条）。
+运行：python benchmarks/bench_chat_log.py
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+from datetime import date, timedelta
+
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, parent_dir)
+
+from services.chat_service import ChatService
+from utils.chat_log import ChatLog
+
+
+def rewrite_last_100(path, messages):
+    """旧做法：每条消息后整体重写最近 100 条"""
+    tmp_file = path + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(messages[-100:], f, ensure_ascii=False, indent=2)
+    os.replace(tmp_file, path)
+
+
+def persist_cost(work_dir, count=5000):
+    messages = []
+    start = time.perf_counter()
+    for i in range(count):
+        messages.append({'id': i + 1, 'username': 'alice', 'message': f'今晚早点睡 {i}',
+                         'timestamp': '2024-01-01T22:00:00'})
+        rewrite_last_100(os.path.join(work_dir, 'chat_messages.json'), messages)
+    rewrite_us = (time.perf_counter() - start) / count * 1e6
+
+    log = ChatLog(os.path.join(work_dir, 'persist_log'))
+    start = time.perf_counter()
+    for msg in messages:
+        log.append(msg)
+    append_us = (time.perf_counter() - start) / count * 1e6
+    log.close()
+    return rewrite_us, append_us
+
+
+def seed_history(data_dir, total, days=30):
+    log_dir = os.path.join(data_dir, 'chat_log')
+    os.makedirs(log_dir)
+    first_day = date(2024, 1, 1)
+    per_day = total // days
+    message_id = 0
+    for offset in range(days):
+        day = (first_day + timedelta(days=offset)).isoformat()
+        with open(os.path.join(log_dir, f'{day}.jsonl'), 'w', encoding='utf-8') as f:
+            for i in range(per_day):
+                message_id += 1
+                f.write(json.dumps({'id': message_id, 'username': f'user{i % 50}', 'message': f'晚安 {message_id}',
+                                    'timestamp': f'{day}T22:00:00'}, ensure_ascii=False) + '\n')
+    return message_id
+
+
+def main():
+    work_dir = tempfile.mkdtemp()
+    try:
+        rewrite_us, append_us = persist_cost(work_dir)
+        print(f"每条消息持久化：整体重写最近 100 条 {rewrite_us:.0f} us，追加一行 {append_us:.1f} us")
+
+        print(f"{'历史消息数':>10} {'段文件总大小(MB)':>16} {'启动(ms)':>10}")
+        for total in (30000, 300000, 3000000):
+            data_dir = os.path.join(work_dir, f'history{total}')
+            last_id = seed_history(data_dir, total)
+            size = sum(entry.stat().st_size for entry in os.scandir(os.path.join(data_dir, 'chat_log')))
+            start = time.perf_counter()
+            service = ChatService(data_dir=data_dir, capacity=500)
+            elapsed = (time.perf_counter() - start) * 1000
+            assert service.get_recent_messages(1)[0]['id'] == last_id
+            service.close()
+            print(f"{total:>10} {size / 1024 / 1024:>16.1f} {elapsed:>10.2f}")
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
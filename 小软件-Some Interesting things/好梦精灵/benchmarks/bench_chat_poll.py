@@ -0,0 +1,58 @@
+"""
+聊天轮询：每次返回最近 50 条 与 只返回 after 之后的增量
+
+模拟多个客户端每 2 秒轮询一次 /chat/messages，期间平均每 rate 次轮询有一条新消息。
+对比每次轮询的响应体字节数和服务端生成响应（取消息 + JSON 序列化）的耗时。
+运行：python benchmarks/bench_chat_poll.py
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, parent_dir)
+
+from services.chat_service import ChatService
+
+
+def run(service, polls, rate, incremental):
+    last_id = 0
+    total_bytes = 0
+    elapsed = 0.0
+    for i in range(polls):
+        if i % rate == 0:
+            service.add_message(f'user{i % 7}', f'今晚 11 点前睡觉，第 {i} 条打卡消息')
+        start = time.perf_counter()
+        if incremental and last_id:
+            messages = service.get_messages_after(last_id)
+        else:
+            messages = service.get_recent_messages()
+        body = json.dumps({'messages': messages}, ensure_ascii=False).encode('utf-8')
+        elapsed += time.perf_counter() - start
+        total_bytes += len(body)
+        if messages:
+            last_id = messages[-1]['id']
+    return total_bytes / polls, elapsed / polls * 1e6
+
+
+def main():
+    work_dir = tempfile.mkdtemp()
+    try:
+        service = ChatService(data_dir=work_dir)
+        for i in range(500):
+            service.add_message(f'user{i % 7}', f'历史消息 {i}')
+        print(f"{'每条新消息的轮询次数':<12} {'全量(字节/次)':>14} {'全量(us)':>10} {'增量(字节/次)':>14} {'增量(us)':>10}")
+        for rate in (1, 5, 30):
+            full_bytes, full_us = run(service, 3000, rate, incremental=False)
+            delta_bytes, delta_us = run(service, 3000, rate, incremental=True)
+            print(f"{rate:<20} {full_bytes:>14.0f} {full_us:>10.1f} {delta_bytes:>14.0f} {delta_us:>10.1f}")
+    finally:
+        service.close()
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+聊天推送：5000 个客户端定时轮询 与 广播中心推送
+
+轮询：每个客户端每 2 秒请求一次 /chat/messages?after=，每 5 秒请求一次 /chat/online，
+用与 api/app.py 相同的两个路由测出单次请求（含 WSGI 开销）的 CPU 时间，乘以请求频率得到每秒 CPU。
+推送：5000 个线程各自订阅广播中心并阻塞等待（对应 5000 个推送连接的处理线程），
+测量发布一条消息到每个订阅者取到事件的延迟，以及每条消息广播所花的进程 CPU 时间
+（包括唤醒 5000 个线程）；另外单独测量广播中心把事件放入 5000 个队列本身的耗时。
+运行：python benchmarks/bench_chat_push.py [连接数]
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import statistics
+
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, parent_dir)
+
+from flask import Flask, request, jsonify
+from services.chat_service import ChatService, ChatHub
+
+
+def polling_cpu(service, listeners):
+    """返回 (单次消息轮询 us, 单次在线人数轮询 us, 全部客户端每秒 CPU ms)"""
+    app = Flask(__name__)
+
+    @app.route('/chat/messages')
+    def get_messages():
+        return jsonify({'messages': service.get_messages_after(request.args.get('after', type=int))})
+
+    @app.route('/chat/online')
+    def get_online():
+        return jsonify({'count': service.get_online_count()})
+
+    client = app.test_client()
+    last_id = service.get_recent_messages(1)[-1]['id']
+    repeat = 3000
+    start = time.process_time()
+    for _ in range(repeat):
+        client.get(f'/chat/messages?after={last_id}')
+    messages_us = (time.process_time() - start) / repeat * 1e6
+    start = time.process_time()
+    for _ in range(repeat):
+        client.get('/chat/online')
+    online_us = (time.process_time() - start) / repeat * 1e6
+    per_second_ms = (listeners / 2 * messages_us + listeners / 5 * online_us) / 1000
+    return messages_us, online_us, per_second_ms
+
+
+def hub_fanout(listeners, repeat=50):
+    """只测广播中心放入队列的耗时（订阅者不取事件），返回每条消息 ms"""
+    hub = ChatHub(queue_size=repeat)
+    for _ in range(listeners):
+        hub.subscribe()
+    start = time.process_time()
+    for i in range(repeat):
+        hub.publish('message', {'id': i, 'username': 'alice', 'message': '晚安'}, i)
+    return (time.process_time() - start) / repeat * 1000
+
+
+def push(service, listeners, messages):
+    """返回 (每条消息的投递延迟列表 ms, 每条消息广播的 CPU ms, 空闲 1 秒的 CPU ms)"""
+    received = [[0.0] * messages for _ in range(listeners)]
+    ready = threading.Barrier(listeners + 1)
+
+    def listen(slot):
+        subscriber = service.subscribe()
+        ready.wait()
+        for i in range(messages):
+            subscriber.get(timeout=15)
+            received[slot][i] = time.perf_counter()
+        service.unsubscribe(subscriber)
+
+    threading.stack_size(256 * 1024)
+    threads = [threading.Thread(target=listen, args=(slot,), daemon=True) for slot in range(listeners)]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    time.sleep(0.5)
+
+    idle_start = time.process_time()
+    time.sleep(1)
+    idle_ms = (time.process_time() - idle_start) * 1000
+
+    sent = []
+    cpu_start = time.process_time()
+    for i in range(messages):
+        sent.append(time.perf_counter())
+        service.add_message('alice', f'第 {i} 条推送消息')
+        time.sleep(0.5)  # 每条消息之间留出全部投递完成的时间
+    for thread in threads:
+        thread.join()
+    cpu_ms = (time.process_time() - cpu_start) * 1000 / messages
+    latencies = [(row[i] - sent[i]) * 1000 for row in received for i in range(messages)]
+    return latencies, cpu_ms, idle_ms
+
+
+def main():
+    listeners = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    work_dir = tempfile.mkdtemp()
+    try:
+        service = ChatService(data_dir=work_dir, queue_size=256)
+        for i in range(50):
+            service.add_message(f'user{i % 7}', f'历史消息 {i}')
+        messages_us, online_us, poll_ms = polling_cpu(service, listeners)
+        print(f"{listeners} 个客户端")
+        print(f"轮询：单次 /chat/messages?after= {messages_us:.0f} us，单次 /chat/online {online_us:.0f} us，"
+              f"合计每秒 CPU {poll_ms:.0f} ms（无新消息时也是如此）")
+
+        print(f"推送：广播中心放入 {listeners} 个队列 {hub_fanout(listeners):.1f} ms/条")
+        latencies, cpu_ms, idle_ms = push(service, listeners, 20)
+        quantiles = statistics.quantiles(latencies, n=100)
+        print(f"      空闲时每秒 CPU {idle_ms:.1f} ms，每条消息广播 CPU {cpu_ms:.1f} ms")
+        print(f"      投递延迟 p50 {quantiles[49]:.1f} ms，p99 {quantiles[98]:.1f} ms，最大 {max(latencies):.1f} ms，"
+              f"移出的慢订阅者 {service.room().hub.evicted_count}")
+    finally:
+        service.close()
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
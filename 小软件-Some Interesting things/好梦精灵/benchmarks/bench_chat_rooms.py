@@ -0,0 +1,102 @@
+"""
+多聊天室：所有发言挤在一个聊天室 与 分散到各自加锁的聊天室
+
+1. 8 个线程同时发言：全部发到同一个聊天室（共用一把锁、一个段文件）
+   与各发到自己的聊天室，对比总吞吐和发言时等待聊天室锁的时间占比。
+2. /chat/online：500 个聊天室、每个 20 人在线时，取某聊天室在线用户、
+   全部聊天室去重在线人数和各聊天室人数的耗时。
+运行：python benchmarks/bench_chat_rooms.py
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, parent_dir)
+
+from services.chat_service import ChatService
+
+THREADS = 8
+PER_THREAD = 2000
+
+
+class TimedLock:
+    """记录等待时间的锁，用于统计锁争用"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.waited = 0.0
+
+    def __enter__(self):
+        if not self._lock.acquire(blocking=False):
+            start = time.perf_counter()
+            self._lock.acquire()
+            self.waited += time.perf_counter() - start
+        return self
+
+    def __exit__(self, *exc):
+        self._lock.release()
+
+
+def post(work_dir, room_of):
+    service = ChatService(data_dir=work_dir)
+    rooms = {room_of(i) for i in range(THREADS)}
+    locks = []
+    for name in rooms:
+        lock = TimedLock()
+        service.room(name)._lock = lock
+        locks.append(lock)
+
+    def worker(index):
+        room = room_of(index)
+        for n in range(PER_THREAD):
+            service.add_message(f'user{index}', f'今晚 10 点半睡觉 {n}', room=room)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(THREADS)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    service.close()
+    total = THREADS * PER_THREAD
+    return total / elapsed, sum(lock.waited for lock in locks) / (elapsed * THREADS) * 100
+
+
+def online_listing(work_dir):
+    service = ChatService(data_dir=work_dir)
+    for room in range(500):
+        for user in range(20):
+            service.join_room(f'user{(room * 7 + user) % 5000}', room=f'room{room}')
+    repeat = 200
+    start = time.perf_counter()
+    for i in range(repeat):
+        service.get_online_users(room=f'room{i % 500}')
+        service.get_online_count(None)
+        service.get_room_sizes()
+    elapsed = (time.perf_counter() - start) / repeat * 1000
+    count = service.get_online_count(None)
+    service.close()
+    return elapsed, count
+
+
+def main():
+    work_dir = tempfile.mkdtemp()
+    try:
+        single_rate, single_wait = post(os.path.join(work_dir, 'single'), lambda i: 'lobby')
+        sharded_rate, sharded_wait = post(os.path.join(work_dir, 'sharded'), lambda i: f'room{i}')
+        print(f"{THREADS} 个线程各发 {PER_THREAD} 条")
+        print(f"  同一个聊天室：{single_rate:>8.0f} 条/秒，等锁时间占比 {single_wait:.1f}%")
+        print(f"  各自的聊天室：{sharded_rate:>8.0f} 条/秒，等锁时间占比 {sharded_wait:.1f}%")
+        elapsed, count = online_listing(os.path.join(work_dir, 'online'))
+        print(f"/chat/online（500 个聊天室，去重后 {count} 人在线）：{elapsed:.2f} ms")
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
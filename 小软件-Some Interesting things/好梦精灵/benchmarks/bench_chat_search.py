@@ -0,0 +1,108 @@
+"""
+聊天记录搜索：逐条扫描全部消息 与 字符二元组倒排索引
+
+直接生成 N 条（默认 100 万）分布在 100 天里的历史消息写入聊天记录，
+启动 ChatSearchService 建立归档索引，统计建索引耗时和内存增量；
+然后对比常见词、少见词、多个关键词、没有结果四类查询
+在（旧做法）从新到旧逐条比对正文 与 （新做法）倒排索引下取最新 20 条的耗时。
+运行：python benchmarks/bench_chat_search.py [消息条数]
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import resource
+from datetime import datetime, timedelta
+
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, parent_dir)
+
+from services.chat_service import ChatService
+from services.chat_search_service import ChatSearchService
+from utils.chat_search import normalize
+
+DAYS = 100
+WORDS = ("今晚 早点 睡觉 明天 早起 跑步 喝水 手机 失眠 做梦 午睡 熬夜 咖啡 牛奶 音乐 冥想 "
+         "闹钟 打卡 周末 加班 作业 考试 运动 瑜伽 散步 洗澡 读书 电影 晚安 早安 困了 醒了 "
+         "头疼 焦虑 放松 深呼吸 白噪音 褪黑素 打呼噜 说梦话 起夜 赖床 补觉 生物钟").split()
+RARE = "薰衣草精油"
+QUERIES = [("常见词", "睡觉"), ("少见词", RARE), ("多个关键词", "早起 跑步 打卡"), ("没有结果", "睡前故事")]
+LIMIT = 20
+
+
+def generate(work_dir, count):
+    """按时间顺序把消息写入每天的段文件，每 5000 条里有一条含少见词"""
+    rng = random.Random(7)
+    log_dir = os.path.join(work_dir, 'chat_log')
+    os.makedirs(log_dir)
+    start = datetime(2024, 1, 1)
+    per_day = count // DAYS
+    texts = []
+    for day in range(DAYS):
+        with open(os.path.join(log_dir, (start + timedelta(days=day)).strftime('%Y-%m-%d') + '.jsonl'),
+                  'w', encoding='utf-8') as f:
+            for n in range(per_day):
+                msg_id = day * per_day + n + 1
+                text = ''.join(rng.choice(WORDS) for _ in range(rng.randint(3, 8)))
+                if msg_id % 5000 == 0:
+                    text += RARE
+                texts.append(text)
+                f.write(json.dumps({
+                    'username': f'user{rng.randrange(2000)}', 'message': text,
+                    'timestamp': (start + timedelta(days=day, seconds=n * 86400 / per_day)).isoformat(),
+                    'room': 'lobby', 'id': msg_id
+                }, ensure_ascii=False) + '\n')
+    with open(os.path.join(work_dir, 'chat_seq.json'), 'w') as f:
+        json.dump({'reserved': count + 1}, f)
+    return texts
+
+
+def scan_search(texts, query):
+    """旧做法：从最新的消息开始逐条核对正文"""
+    terms = normalize(query).split()
+    results = []
+    for text in reversed(texts):
+        text = normalize(text)
+        if all(term in text for term in terms):
+            results.append(text)
+            if len(results) >= LIMIT:
+                break
+    return results
+
+
+def timed(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    work_dir = tempfile.mkdtemp()
+    try:
+        texts = generate(work_dir, count)
+        service = ChatService(data_dir=work_dir)
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.perf_counter()
+        search = ChatSearchService(service)
+        search.backfilled.wait()
+        elapsed = time.perf_counter() - start
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print(f"{count} 条历史消息：建立归档索引 {elapsed:.1f} 秒，内存增加约 {(rss_after - rss_before) / 1024:.0f} MB")
+
+        for label, query in QUERIES:
+            index_ms, results = timed(lambda: search.search(query, limit=LIMIT), 50)
+            scan_ms, expected = timed(lambda: scan_search(texts, query), 3)
+            assert [normalize(m['message']) for m in results] == expected
+            print(f"  {label}「{query}」命中 {len(results)} 条：逐条扫描 {scan_ms:>8.2f} ms，倒排索引 {index_ms:>6.2f} ms")
+        service.close()
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""
+轮询接口：每次重新生成并序列化响应 与 按数据版本的 ETag 条件请求
+
+200 个客户端按页面上的定时器轮询：每 2 秒 /chat/messages?after=，每 5 秒 /chat/online
+（100 个聊天室、每个 10 人在线）；期间平均每 10 秒一条新消息、每 30 秒有人进出聊天室。
+用与 api/app.py 相同的路由逻辑，对比不带与带 If-None-Match 时服务端处理单次请求
+（Flask 应用内的全部开销，不含测试客户端构造请求）的耗时、响应体字节数，以及 304 命中率。
+浏览器按 URL 缓存，after 变化后的第一次请求没有可用的 ETag。
+运行：python benchmarks/bench_conditional.py [客户端数]
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, parent_dir)
+
+from flask import Flask, Response, request, jsonify
+from services.chat_service import ChatService
+from utils.conditional import ConditionalStats, make_etag
+
+SECONDS = 120
+ROOMS = 100
+
+
+def build_app(service, stats):
+    app = Flask(__name__)
+
+    def conditional_json(endpoint, version, build):
+        etag = make_etag(endpoint, request.query_string, version)
+        if request.if_none_match.contains_weak(etag):
+            stats.record(endpoint, True)
+            response = Response(status=304)
+        else:
+            stats.record(endpoint, False)
+            response = jsonify(build())
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    @app.route('/chat/messages')
+    def get_messages():
+        room = service.room(request.args.get('room') or 'lobby')
+        after = request.args.get('after', type=int)
+        return conditional_json('chat/messages', room.message_version(),
+                                lambda: {'messages': room.get_messages_after(after)})
+
+    @app.route('/chat/online')
+    def get_online():
+        room = service.room(request.args.get('room') or 'lobby')
+        return conditional_json('chat/online', service.presence_version(), lambda: {
+            'count': room.get_online_count(),
+            'users': room.get_online_users(),
+            'total': service.get_online_count(None),
+            'rooms': service.get_room_sizes()
+        })
+
+    # 只统计服务端处理请求的时间
+    app.server_time = 0.0
+    wsgi_app = app.wsgi_app
+
+    def timed_app(environ, start_response):
+        start = time.perf_counter()
+        body = list(wsgi_app(environ, start_response))
+        app.server_time += time.perf_counter() - start
+        return body
+
+    app.wsgi_app = timed_app
+    return app
+
+
+def simulate(work_dir, clients, conditional):
+    """返回 {接口: (单次请求 us, 平均响应字节数)} 和 304 统计"""
+    service = ChatService(data_dir=work_dir, presence_ttl=3600)
+    for room in range(ROOMS):
+        for user in range(10):
+            service.join_room(f'user{room * 10 + user}', room=f'room{room}')
+    for i in range(50):
+        service.add_message('alice', f'今晚 11 点前睡觉，第 {i} 条打卡消息', room='room0')
+    stats = ConditionalStats()
+    app = build_app(service, stats)
+    client = app.test_client()
+    etags = {}
+    last_ids = [service.message_version('room0') - 1] * clients
+    totals = {'chat/messages': [0.0, 0, 0], 'chat/online': [0.0, 0, 0]}
+
+    def poll(endpoint, url, key):
+        headers = {'If-None-Match': etags[key]} if conditional and key in etags else {}
+        before = app.server_time
+        response = client.get(url, headers=headers)
+        total = totals[endpoint]
+        total[0] += app.server_time - before
+        total[1] += len(response.data)
+        total[2] += 1
+        if response.status_code == 200:
+            etags[key] = response.headers['ETag']
+        return response
+
+    for second in range(SECONDS):
+        if second % 10 == 0:
+            service.add_message('bob', f'第 {second} 秒：准备睡觉了', room='room0')
+        if second % 30 == 15:
+            service.leave_room(f'user{second}', room=f'room{second // 10}')
+        for c in range(clients):
+            if second % 2 == c % 2:
+                url = f'/chat/messages?room=room0&after={last_ids[c]}'
+                response = poll('chat/messages', url, (url, c))
+                if response.status_code == 200 and response.json['messages']:
+                    last_ids[c] = response.json['messages'][-1]['id']
+            if second % 5 == c % 5:
+                poll('chat/online', '/chat/online?room=room0', ('online', c))
+    service.close()
+    return {endpoint: (t / n * 1e6, size / n) for endpoint, (t, size, n) in totals.items()}, stats.snapshot()
+
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    work_dir = tempfile.mkdtemp()
+    try:
+        plain, _ = simulate(os.path.join(work_dir, 'plain'), clients, False)
+        conditional, stats = simulate(os.path.join(work_dir, 'conditional'), clients, True)
+        print(f"{clients} 个客户端轮询 {SECONDS} 秒")
+        for endpoint in ('chat/messages', 'chat/online'):
+            (plain_us, plain_bytes), (cond_us, cond_bytes) = plain[endpoint], conditional[endpoint]
+            print(f"  /{endpoint}：每次重新生成 {plain_us:>6.0f} us / {plain_bytes:>6.0f} B，"
+                  f"ETag {cond_us:>6.0f} us / {cond_bytes:>6.0f} B，304 命中率 {stats[endpoint]['hit_ratio']:.1%}")
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+用户数据导出对比：整体构建后 json 序列化 与 逐用户流式 NDJSON
+
+在用户数递增时对比导出过程的峰值内存和耗时。
+运行：python benchmarks/bench_export.py [天数]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import datetime
+import tempfile
+import tracemalloc
+
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, parent_dir)
+
+from services.user_service import UserService
+from services.user_storage import JsonUserStorage
+
+
+def make_service(work_dir, count, days):
+    """创建 count 个用户、每人 days 天历史的 UserService"""
+    service = UserService(storage=JsonUserStorage(os.path.join(work_dir, 'users.json'), writer=None),
+                          series_dir=os.path.join(work_dir, 'user_shards'))
+    start = datetime.date(2024, 1, 1)
+    dates = [(start + datetime.timedelta(days=i)).isoformat() for i in range(days)]
+    for i in range(count):
+        username = f'user{i}'
+        service.storage.add_user(username, {
+            'password_hash': 'bench',
+            'created_at': '2024-01-01T00:00:00',
+            'updated_at': '2024-01-01T00:00:00',
+            'health_score': i % 1000,
+            'is_admin': False,
+            'wechat_openid': None,
+            'wechat_info': {}
+        })
+        service.series.replace(username, 'sleep_data',
+                               {d: {'sleep_hours': 7.5, 'bedtime': '23:00', 'quality_score': 8.0} for d in dates})
+        service.series.replace(username, 'behavior_data',
+                               {d: {'screen_time': 3.0, 'exercise_time': 30, 'steps': 6000, 'score': 9} for d in dates})
+    service.series._cache.clear()
+    return service
+
+
+def measure(export):
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = export()
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    peak_mb = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    tracemalloc.stop()
+    return peak_mb, elapsed_ms, size
+
+
+def main():
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 365
+    print(f"每人 {days} 天历史")
+    print(f"{'用户数':>8} {'整体峰值(MB)':>14} {'整体耗时(ms)':>14} {'流式峰值(MB)':>14} {'流式耗时(ms)':>14}")
+    for count in (250, 500, 1000):
+        work_dir = tempfile.mkdtemp()
+        try:
+            service = make_service(work_dir, count, days)
+
+            # 旧方式：所有用户放进一个字典后整体序列化
+            def export_whole():
+                export_data = {}
+                for record in service.iter_export():
+                    export_data[record.pop('username')] = record
+                return len(json.dumps(export_data, ensure_ascii=False))
+
+            # 新方式：每个用户序列化为一行后立即交给响应
+            def export_stream():
+                return sum(len(json.dumps(record, ensure_ascii=False)) + 1 for record in service.iter_export())
+
+            whole = measure(export_whole)
+            stream = measure(export_stream)
+            print(f"{count:>8} {whole[0]:>14.1f} {whole[1]:>14.0f} {stream[0]:>14.1f} {stream[1]:>14.0f}")
+        finally:
+            shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
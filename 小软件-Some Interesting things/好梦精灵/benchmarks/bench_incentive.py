@@ -0,0 +1,106 @@
+"""
+激励服务读取/写入：每次调用整体读写 JSON 文件 与 内存缓存 + 延迟写入
+
+运行：python benchmarks/bench_incentive.py [用户数]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, parent_dir)
+
+from services.incentive_service import IncentiveService
+from utils.write_behind import WriteBehindWriter
+
+
+def seed(data_dir, count):
+    files = {
+        'user_points.json': {f'user{i}': i * 10 for i in range(count)},
+        'user_badges.json': {f'user{i}': ['habit_master', 'health_master'] for i in range(count)},
+        'user_habits.json': {
+            f'user{i}': {'早睡': {'progress': 50, 'created_at': '2024-01-01T00:00:00',
+                                 'last_updated': '2024-01-01T00:00:00'}}
+            for i in range(count)
+        }
+    }
+    for name, data in files.items():
+        with open(os.path.join(data_dir, name), 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def load(data_dir, name):
+    with open(os.path.join(data_dir, name), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save(data_dir, name, data):
+    with open(os.path.join(data_dir, name), 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def old_get(data_dir, i):
+    """旧实现：三个 GET 接口各读取一次完整文件"""
+    user_id = f'user{i}'
+    load(data_dir, 'user_points.json').get(user_id, 0)
+    load(data_dir, 'user_badges.json').get(user_id, [])
+    load(data_dir, 'user_habits.json').get(user_id, {})
+
+
+def old_update_habit(data_dir, i):
+    """旧实现：读写习惯文件，完成时再读写积分和徽章文件"""
+    user_id = f'user{i}'
+    habits = load(data_dir, 'user_habits.json')
+    habits[user_id]['早睡']['progress'] = 100
+    points = load(data_dir, 'user_points.json')
+    points[user_id] += 50
+    save(data_dir, 'user_points.json', points)
+    badges = load(data_dir, 'user_badges.json')
+    save(data_dir, 'user_badges.json', badges)
+    save(data_dir, 'user_habits.json', habits)
+
+
+def timed(func, count):
+    start = time.perf_counter()
+    for i in range(count):
+        func(i)
+    return (time.perf_counter() - start) / count * 1000
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    work_dir = tempfile.mkdtemp()
+    try:
+        seed(work_dir, count)
+        print(f"{count} 个用户")
+        print(f"{'操作':<20} {'整体读写(ms)':>14} {'内存缓存(ms)':>14}")
+
+        writer = WriteBehindWriter(interval=1.0)
+        service = IncentiveService(work_dir, writer=writer)
+        service.get_user_points('user0')  # 首次加载
+
+        def new_get(i):
+            user_id = f'user{i}'
+            service.get_user_points(user_id)
+            service.get_user_badges(user_id)
+            service.get_user_habits(user_id)
+
+        old_ms = timed(lambda i: old_get(work_dir, i), 50)
+        new_ms = timed(new_get, 5000)
+        print(f"{'三个 GET 接口':<20} {old_ms:>14.2f} {new_ms:>14.4f}")
+
+        old_ms = timed(lambda i: old_update_habit(work_dir, i), 20)
+        start_writes = writer.write_count
+        new_ms = timed(lambda i: service.update_habit(f'user{i}', '早睡', 100), 2000)
+        print(f"{'完成习惯':<20} {old_ms:>14.2f} {new_ms:>14.4f}")
+        writer.stop()
+        print(f"缓存模式 2000 次完成习惯期间写出文件 {writer.write_count - start_writes} 次")
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
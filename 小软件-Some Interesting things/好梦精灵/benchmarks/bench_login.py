@@ -0,0 +1,102 @@
+"""
+登录吞吐基准测试：在请求线程中计算密码哈希与交给进程池计算对比
+
+200 个并发客户端线程持续登录，同时另一个线程不断调用轻量接口（排行榜），
+观察登录吞吐、成功登录的延迟、被拒绝的请求数以及轻量接口在登录高峰期间的延迟。
+只统计测试时间窗口内完成的请求。
+运行：python benchmarks/bench_login.py [并发数] [秒数] [哈希方法]
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, parent_dir)
+
+from services.user_service import UserService
+from utils.password_hasher import PasswordHasher
+
+
+def run(label, hasher, clients, duration, users_file):
+    service = UserService(users_file, storage_mode='json', hasher=hasher)
+    # 所有测试用户共用一个预先算好的哈希，避免注册阶段耗时过长
+    password_hash = PasswordHasher(method=hasher.method, workers=0).hash('password')
+    for i in range(clients):
+        service.storage.add_user(f'user{i}', {
+            'password_hash': password_hash,
+            'created_at': '2024-01-01T00:00:00',
+            'health_score': i,
+            'is_admin': False,
+            'wechat_openid': None,
+            'wechat_info': {}
+        })
+
+    stop = threading.Event()
+    counts = {'ok': 0, 'busy': 0}
+    counts_lock = threading.Lock()
+    login_latencies = []
+    probe_latencies = []
+
+    def client(i):
+        while not stop.is_set():
+            start = time.perf_counter()
+            result = service.login_user(f'user{i}', 'password')
+            if stop.is_set():
+                break
+            with counts_lock:
+                counts['ok' if result['success'] else 'busy'] += 1
+                if result['success']:
+                    login_latencies.append(time.perf_counter() - start)
+            if not result['success']:
+                time.sleep(0.2)  # 模拟客户端收到503后退避重试
+
+    def probe():
+        while not stop.is_set():
+            start = time.perf_counter()
+            service.get_leaderboard()
+            probe_latencies.append(time.perf_counter() - start)
+            time.sleep(0.005)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    threads.append(threading.Thread(target=probe))
+    window_start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    elapsed = time.perf_counter() - window_start
+    for thread in threads:
+        thread.join()
+    hasher.shutdown()
+
+    login_latencies.sort()
+    probe_latencies.sort()
+    login_p50 = login_latencies[len(login_latencies) // 2] * 1000 if login_latencies else float('nan')
+    probe_p99 = probe_latencies[int(len(probe_latencies) * 0.99) - 1] * 1000 if probe_latencies else 0
+    print(f"{label:>10} {counts['ok'] / elapsed:>10.1f} {login_p50:>14.0f} {counts['busy']:>10} {probe_p99:>16.2f}")
+
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    method = sys.argv[3] if len(sys.argv) > 3 else 'pbkdf2:sha256:600000'
+    workers = os.cpu_count() or 1
+
+    print(f"{clients} 个并发客户端，{duration:.0f} 秒，{method}，{workers} 个工作进程")
+    print(f"{'模式':>10} {'登录/秒':>10} {'登录p50(ms)':>14} {'拒绝次数':>10} {'排行榜p99(ms)':>16}")
+    for label, hasher in (
+        ('请求线程', PasswordHasher(method=method, workers=0, max_pending=clients)),
+        ('进程池', PasswordHasher(method=method, workers=workers)),
+    ):
+        work_dir = tempfile.mkdtemp()
+        try:
+            run(label, hasher, clients, duration, os.path.join(work_dir, 'users.json'))
+        finally:
+            shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+积分历史：每个用户一个 JSON 文件整体重写 与 分段追加账本
+
+对比已有一定历史的用户再获得积分时的写入耗时，以及"最近 20 条""某月积分合计"查询耗时；
+最后测量后台合并期间追加积分的等待时间和合并后的启动耗时。
+运行：python benchmarks/bench_points_ledger.py [每个用户已有记录数]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, parent_dir)
+
+from utils.points_ledger import PointsLedger
+
+USERS = 20
+
+
+def make_history(count):
+    start = datetime(2024, 1, 1)
+    return [{'timestamp': (start + timedelta(hours=i)).isoformat(), 'points': 10, 'reason': '睡眠分析完成'}
+            for i in range(count)]
+
+
+def old_record(data_dir, user_id, entry):
+    """旧实现：读入整个历史数组，追加一条后整体写回"""
+    history_file = os.path.join(data_dir, f'points_history_{user_id}.json')
+    history = []
+    if os.path.exists(history_file):
+        with open(history_file, 'r', encoding='utf-8') as f:
+            history = json.load(f)
+    history.append(entry)
+    with open(history_file, 'w', encoding='utf-8') as f:
+        json.dump(history, f, ensure_ascii=False, indent=2)
+
+
+def old_load(data_dir, user_id):
+    with open(os.path.join(data_dir, f'points_history_{user_id}.json'), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def timed(func, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        func(i)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    history = make_history(count)
+    work_dir = tempfile.mkdtemp()
+    try:
+        old_dir = os.path.join(work_dir, 'old')
+        os.makedirs(old_dir)
+        ledger = PointsLedger(os.path.join(work_dir, 'ledger'))
+        for u in range(USERS):
+            with open(os.path.join(old_dir, f'points_history_user{u}.json'), 'w', encoding='utf-8') as f:
+                json.dump(history, f, ensure_ascii=False, indent=2)
+            for entry in history:
+                ledger.append(f'user{u}', entry['points'], entry['reason'], entry['timestamp'])
+        ledger.close()
+
+        start = time.perf_counter()
+        ledger = PointsLedger(os.path.join(work_dir, 'ledger'))
+        load_ms = (time.perf_counter() - start) * 1000
+        print(f"{USERS} 个用户，每人 {count} 条历史；账本 {len(ledger.segments)} 段，"
+              f"启动重建索引 {load_ms:.0f} ms")
+        print(f"{'操作':<18} {'整体重写(ms)':>14} {'追加账本(ms)':>14}")
+
+        now = datetime(2030, 1, 1).isoformat()
+        entry = {'timestamp': now, 'points': 10, 'reason': '睡眠分析完成'}
+        old_ms = timed(lambda i: old_record(old_dir, f'user{i % USERS}', entry), 20)
+        new_ms = timed(lambda i: ledger.append(f'user{i % USERS}', 10, '睡眠分析完成', now), 5000)
+        print(f"{'记录一次积分':<18} {old_ms:>14.2f} {new_ms:>14.4f}")
+
+        old_ms = timed(lambda i: old_load(old_dir, f'user{i % USERS}')[-20:], 20)
+        new_ms = timed(lambda i: ledger.last(f'user{i % USERS}', 20), 2000)
+        print(f"{'最近 20 条':<18} {old_ms:>14.2f} {new_ms:>14.4f}")
+
+        def old_sum(i):
+            return sum(e['points'] for e in old_load(old_dir, f'user{i % USERS}')
+                       if '2024-03-01' <= e['timestamp'] < '2024-04-01')
+
+        old_ms = timed(old_sum, 20)
+        new_ms = timed(lambda i: ledger.sum(f'user{i % USERS}', '2024-03-01', '2024-04-01'), 20000)
+        print(f"{'某月积分合计':<18} {old_ms:>14.2f} {new_ms:>14.4f}")
+
+        # 合并在另一个线程中进行，同时测量追加积分的最长等待
+        result = {}
+
+        def compact():
+            start = time.perf_counter()
+            result['written'] = ledger.compact(keep_since='2025-01-01')
+            result['ms'] = (time.perf_counter() - start) * 1000
+
+        thread = threading.Thread(target=compact)
+        thread.start()
+        waits = []
+        while thread.is_alive():
+            start = time.perf_counter()
+            ledger.append('user0', 10, '睡眠分析完成', now)
+            waits.append((time.perf_counter() - start) * 1000)
+            time.sleep(0.001)
+        thread.join()
+        print(f"合并（2025 年前结转）{result['ms']:.0f} ms，剩余 {result['written']} 条记录，"
+              f"{len(ledger.segments)} 段；期间追加 {len(waits)} 次，最长等待 {max(waits, default=0):.1f} ms")
+        ledger.close()
+
+        start = time.perf_counter()
+        PointsLedger(os.path.join(work_dir, 'ledger')).close()
+        print(f"合并后启动重建索引 {(time.perf_counter() - start) * 1000:.0f} ms")
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
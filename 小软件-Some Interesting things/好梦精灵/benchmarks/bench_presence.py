@@ -0,0 +1,78 @@
+"""
+在线状态：遍历全部最后心跳时间找出过期用户 与 时间轮分桶过期
+
+N 个在线用户每 5 秒心跳一次（分散在 5 秒内），ttl 为 15 秒，模拟运行 60 秒，
+期间每 10 秒有 1% 的用户不再发送心跳。对比每次 /chat/online 查询时
+（旧做法）遍历全部用户检查超时并复制用户集合 与 （新做法）只处理到期的桶、复用用户元组的耗时。
+运行：python benchmarks/bench_presence.py [在线用户数]
+"""
+import os
+import sys
+import time
+import random
+
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, parent_dir)
+
+from utils.presence import PresenceTracker
+
+TTL = 15
+
+
+class ScanPresence:
+    """旧做法加上超时：最后心跳时间字典，每次查询遍历全部用户"""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.last_seen = {}
+
+    def heartbeat(self, username):
+        self.last_seen[username] = self.clock()
+
+    def query(self):
+        now = self.clock()
+        for username in [u for u, seen in self.last_seen.items() if now - seen > TTL]:
+            del self.last_seen[username]
+        return len(self.last_seen), list(self.last_seen)
+
+
+def simulate(tracker, heartbeat, query, count, clock_state):
+    rng = random.Random(1)
+    users = [f'user{i}' for i in range(count)]
+    active = set(users)
+    for username in users:
+        heartbeat(username)
+    query_time = 0.0
+    queries = 0
+    for second in range(60):
+        for username in rng.sample(sorted(active), count // 100) if second % 10 == 0 else ():
+            active.discard(username)
+        # 本秒内有 1/5 的在线用户发来心跳，每 200 次心跳穿插一次在线人数查询
+        for i, username in enumerate(u for u in users if hash(u) % 5 == second % 5 and u in active):
+            clock_state[0] += 1 / count
+            heartbeat(username)
+            if i % 200 == 0:
+                start = time.perf_counter()
+                query()
+                query_time += time.perf_counter() - start
+                queries += 1
+        clock_state[0] = float(second + 1)
+    return query_time / queries * 1e6
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    clock_state = [0.0]
+    scan = ScanPresence(lambda: clock_state[0])
+    scan_us = simulate(scan, scan.heartbeat, scan.query, count, clock_state)
+
+    clock_state[0] = 0.0
+    wheel = PresenceTracker(TTL, clock=lambda: clock_state[0])
+    wheel_us = simulate(wheel, wheel.heartbeat, lambda: (wheel.count(), wheel.users()), count, clock_state)
+    assert len(wheel) == len(scan.last_seen)
+    print(f"{count} 个在线用户，60 秒后仍在线 {len(wheel)} 人，时间轮处理过期 {wheel.expired_count} 人")
+    print(f"每次在线查询：遍历检查并复制 {scan_us:.0f} us，时间轮 {wheel_us:.1f} us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+综合排行：每次请求关联两处数据重新计算 与 增量维护的排行跳表
+
+对比 /leaderboard 取前 10 名时，遍历全部用户、查找积分、按权重计算后取前 10 名
+与直接读取预先排好的综合排行的耗时，以及分数/积分变化时维护排行的开销。
+运行：python benchmarks/bench_ranking.py [用户数]
+"""
+import os
+import sys
+import json
+import time
+import heapq
+import random
+import shutil
+import tempfile
+
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, parent_dir)
+
+from services.user_service import UserService
+from services.user_storage import JournalUserStorage
+from services.incentive_service import IncentiveService
+from services.ranking_service import RankingService
+from utils.write_behind import WriteBehindWriter
+
+WEIGHTS = {'health': 1.0, 'points': 0.1}
+
+
+def seed(work_dir, count):
+    rng = random.Random(1)
+    users = {
+        f'user{i}': {'password_hash': 'bench', 'created_at': '2024-01-01T00:00:00', 'health_score': rng.randrange(1000),
+                     'is_admin': False, 'wechat_openid': None, 'wechat_info': {}}
+        for i in range(count)
+    }
+    with open(os.path.join(work_dir, 'users.json'), 'w', encoding='utf-8') as f:
+        json.dump(users, f)
+    os.makedirs(os.path.join(work_dir, 'data'))
+    with open(os.path.join(work_dir, 'data', 'user_points.json'), 'w', encoding='utf-8') as f:
+        json.dump({f'user{i}': rng.randrange(5000) for i in range(count)}, f)
+
+
+def joined_top(user_service, incentive_service, limit=10):
+    """旧做法：每次请求遍历用户、关联积分、计算综合分后取前 limit 名"""
+    points = incentive_service.all_points()
+    rows = ((WEIGHTS['health'] * data.get('health_score', 0) + WEIGHTS['points'] * points.get(name, 0),
+             name, data.get('health_score', 0), points.get(name, 0))
+            for name, data in user_service.iter_users() if not data.get('is_admin', False))
+    return [(name, health, pts) for _, name, health, pts in heapq.nlargest(limit, rows)]
+
+
+def timed(func, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        func(i)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    work_dir = tempfile.mkdtemp()
+    try:
+        seed(work_dir, count)
+        # 写出间隔足够长，避免后台整体写积分文件的耗时混入计时
+        writer = WriteBehindWriter(interval=60)
+        user_service = UserService(storage=JournalUserStorage(os.path.join(work_dir, 'users.json')),
+                                   series_dir=os.path.join(work_dir, 'user_shards'))
+        # 同理，避免计时期间触发用户日志的后台快照
+        user_service.storage.journal.compact_threshold = 10 ** 9
+        incentive_service = IncentiveService(os.path.join(work_dir, 'data'), writer=writer)
+
+        start = time.perf_counter()
+        ranking = RankingService(user_service, incentive_service, weights=WEIGHTS)
+        print(f"{count} 个用户，权重 {WEIGHTS}；启动构建综合排行 {(time.perf_counter() - start) * 1000:.0f} ms")
+
+        joined_ms = timed(lambda i: joined_top(user_service, incentive_service), 5)
+        ranked_ms = timed(lambda i: ranking.top(10), 5000)
+        print(f"{'前 10 名':<16} 请求时关联计算 {joined_ms:>9.2f} ms    预计算排行 {ranked_ms:>8.4f} ms")
+
+        # 先各跑一轮预热，再计时整个写入调用和其中维护排行的部分
+        for _ in range(2):
+            score_ms = timed(lambda i: user_service.add_health_score(f'user{i % count}', 5), 5000)
+            points_ms = timed(lambda i: incentive_service.add_points(f'user{i % count}', 10), 5000)
+        health = dict(ranking.health)
+        points = dict(ranking.points)
+        maintain_score = timed(lambda i: ranking.score_changed(f'user{i}', health[f'user{i}'] + 1), 5000)
+        maintain_points = timed(lambda i: ranking.points_changed(f'user{i}', points[f'user{i}'] + 1), 5000)
+        ranking.rebuild()
+        print(f"{'加健康分':<16} 整个调用 {score_ms:>9.4f} ms    其中维护排行 {maintain_score:>8.4f} ms")
+        print(f"{'加积分':<16} 整个调用 {points_ms:>9.4f} ms    其中维护排行 {maintain_points:>8.4f} ms")
+        assert ranking.top(10) == joined_top(user_service, incentive_service)
+        incentive_service.close()
+        writer.stop()
+        user_service.storage.close()
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
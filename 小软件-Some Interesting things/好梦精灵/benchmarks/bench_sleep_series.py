@@ -0,0 +1,130 @@
+"""
+睡眠时序数据：按用户 JSON 分片（{日期: 记录}） 与 按列追加存储（SleepSeriesStore）
+
+生成 N 个用户（默认 10 万）、每人 Y 年（默认 3 年）每晚一条的睡眠记录，直接写成 SleepSeriesStore 的数据文件；
+对比两种布局下：第一次访问一个用户（从磁盘读入）的耗时、每晚追加一条记录的耗时、
+已在内存中的用户计算最近 7 天趋势的耗时、每个用户的磁盘和内存占用。
+JSON 分片每个用户的开销与用户总数无关，只在其中 1000 个用户上测量。
+运行：python benchmarks/bench_sleep_series.py [用户数] [年数]
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import datetime
+import tempfile
+import tracemalloc
+
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, parent_dir)
+
+from utils.sleep_series import SleepSeriesStore, RECORD
+from utils.sleep_tracker import SleepTracker
+from utils.user_shards import UserShardStore
+
+SAMPLE = 1000
+VARIANTS = 64
+
+
+def make_variants(days, rng):
+    """预先生成若干份不同的历史数据，各用户轮流使用，加快生成速度"""
+    start = datetime.date.today() - datetime.timedelta(days=days)
+    rows = []
+    for _ in range(VARIANTS):
+        rows.append([(start.toordinal() + d, round(rng.uniform(5, 9), 1), rng.choice((1350, 1380, 1410, 30)),
+                      round(rng.uniform(4, 10), 1)) for d in range(days)])
+    return rows
+
+
+def write_store(base_dir, users, variants):
+    store = SleepSeriesStore(base_dir)
+    blobs = [b''.join(RECORD.pack(*row) for row in rows) for rows in variants]
+    for i in range(users):
+        path = store._path(f'user{i}')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(blobs[i % VARIANTS])
+
+
+def write_shards(base_dir, variants):
+    shards = UserShardStore(base_dir)
+    for i in range(SAMPLE):
+        shards.replace(f'user{i}', 'sleep_data', {
+            datetime.date.fromordinal(day).isoformat(): {
+                'sleep_hours': hours, 'bedtime': f'{bedtime // 60:02d}:{bedtime % 60:02d}', 'quality_score': quality}
+            for day, hours, bedtime, quality in variants[i % VARIANTS]})
+    shards._cache.clear()
+    return shards
+
+
+def per_call(func, names):
+    start = time.perf_counter()
+    for name in names:
+        func(name)
+    return (time.perf_counter() - start) / len(names) * 1000
+
+
+def dir_size(path):
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+
+def json_trends(shards, name, days=7):
+    """旧做法：在 {日期: 记录} 中逐天查找"""
+    data = shards.get(name, 'sleep_data')
+    today = datetime.date.today()
+    recent = [data[d] for d in ((today - datetime.timedelta(days=i)).isoformat() for i in range(days)) if d in data]
+    return sum(r['sleep_hours'] for r in recent) / len(recent) if recent else None
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    years = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    days = years * 365
+    rng = random.Random(5)
+    variants = make_variants(days, rng)
+    work_dir = tempfile.mkdtemp()
+    try:
+        start = time.perf_counter()
+        write_store(os.path.join(work_dir, 'sleep'), users, variants)
+        print(f"{users} 个用户 × {days} 晚：生成数据文件 {time.perf_counter() - start:.0f} 秒，"
+              f"共 {dir_size(os.path.join(work_dir, 'sleep')) / 1024 ** 3:.2f} GB")
+        shards = write_shards(os.path.join(work_dir, 'shards'), variants)
+
+        sample = [f'user{i}' for i in rng.sample(range(SAMPLE), SAMPLE)]
+        spread = [f'user{i}' for i in rng.sample(range(users), SAMPLE)]
+        today = datetime.date.today().isoformat()
+        entry = {'sleep_hours': 7.5, 'bedtime': '23:00', 'quality_score': 8.0}
+
+        start = time.perf_counter()
+        store = SleepSeriesStore(os.path.join(work_dir, 'sleep'), cache_size=users)
+        open_ms = (time.perf_counter() - start) * 1000
+        tracker = SleepTracker(store)
+        cold_ms = per_call(store.get, spread)
+        # 内存单独测量（tracemalloc 会拖慢加载）
+        others = [f'user{i}' for i in range(SAMPLE, 2 * SAMPLE) if i < users]
+        tracemalloc.start()
+        for name in others:
+            store.get(name)
+        memory_kb = tracemalloc.get_traced_memory()[0] / max(len(others), 1) / 1024
+        tracemalloc.stop()
+        trend_ms = per_call(tracker.get_sleep_trends, spread)
+        append_ms = per_call(lambda name: store.put(name, today, entry), spread)
+
+        json_cold_ms = per_call(lambda name: shards.get(name, 'sleep_data'), sample)
+        json_trend_ms = per_call(lambda name: json_trends(shards, name), sample[:200])
+        shards._cache.clear()
+        json_append_ms = per_call(lambda name: shards.put(name, 'sleep_data', today, entry), sample[:200])
+
+        print(f"打开存储（按需加载，不读取任何用户）：{open_ms:.2f} ms")
+        print(f"{'':>10} {'首次访问 ms':>12} {'7 天趋势 ms':>12} {'追加一晚 ms':>12} {'每用户磁盘 KB':>14}")
+        print(f"{'JSON 分片':>10} {json_cold_ms:>12.2f} {json_trend_ms:>12.3f} {json_append_ms:>12.2f} "
+              f"{dir_size(os.path.join(work_dir, 'shards')) / SAMPLE / 1024:>14.1f}")
+        print(f"{'按列存储':>10} {cold_ms:>12.2f} {trend_ms:>12.3f} {append_ms:>12.3f} {days * RECORD.size / 1024:>14.1f}")
+        print(f"按列存储每个已加载用户约占内存 {memory_kb:.1f} KB")
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
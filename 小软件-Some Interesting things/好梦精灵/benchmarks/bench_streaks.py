@@ -0,0 +1,121 @@
+"""
+连续天数索引：查询耗时与从积分账本重建的耗时
+
+1. 抽样用户一年的每日分析记录（约七成天数有活动）写入账本，测量逐条重放的重建速度；
+2. 把一周前（以及全部）记录结转（日期编码成位图）后，按抽样用户的数据复制出全部用户，
+   测量全量用户一年数据的启动重建耗时；
+3. 对比遍历用户全部历史计算连续天数 与 索引查询的耗时。
+运行：python benchmarks/bench_streaks.py [用户数] [抽样用户数]
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+from datetime import date, timedelta
+
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, parent_dir)
+
+from utils.points_ledger import PointsLedger
+from utils.streak_index import StreakIndex
+
+ACTIONS = ('analyze_sleep', 'analyze_behavior')
+TODAY = date(2025, 1, 1)
+
+
+def seed_sample(ledger, sample):
+    rng = random.Random(1)
+    for day in range(365, -1, -1):
+        ts = f"{(TODAY - timedelta(days=day)).isoformat()}T22:00:00"
+        for u in range(sample):
+            for action in ACTIONS:
+                if rng.random() < 0.7:
+                    ledger.append(f'user{u}', 10, '分析完成', ts, action)
+
+
+def replicate(src_dir, dst_dir, sample, users):
+    """把结转后的抽样数据复制成 users 个用户"""
+    os.makedirs(dst_dir)
+    with open(os.path.join(src_dir, sorted(os.listdir(src_dir))[0]), 'r', encoding='utf-8') as f:
+        header, *records = [json.loads(line) for line in f]
+    with open(os.path.join(dst_dir, '00000001.jsonl'), 'w', encoding='utf-8') as out:
+        out.write(json.dumps({'compacted_through': 1}) + '\n')
+        for copy in range(users // sample):
+            for record in records:
+                record = dict(record, user=f"user{int(record['user'][4:]) + copy * sample}")
+                out.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+def naive_streak(ledger, user_id, action):
+    """不用索引：读出用户全部记录，按天去重后从今天往回数"""
+    days = {date.fromisoformat(e['timestamp'][:10]) for e in ledger.last(user_id, ledger.count(user_id))
+            if e.get('action') == action}
+    day, streak = TODAY, 0
+    if day not in days:
+        day -= timedelta(days=1)
+    while day in days:
+        streak += 1
+        day -= timedelta(days=1)
+    return streak
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    sample = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    work_dir = tempfile.mkdtemp()
+    try:
+        sample_dir = os.path.join(work_dir, 'sample')
+        ledger = PointsLedger(sample_dir)
+        seed_sample(ledger, sample)
+        ledger.close()
+
+        streaks = StreakIndex()
+        start = time.perf_counter()
+        ledger = PointsLedger(sample_dir, observers=[streaks])
+        elapsed = time.perf_counter() - start
+        records = sum(ledger.count(f'user{u}') for u in range(sample))
+        print(f"逐条重放：{sample} 个用户一年 {records} 条记录，重建 {elapsed * 1000:.0f} ms"
+              f"（{records / elapsed:.0f} 条/秒）")
+
+        user_id = 'user7'
+        repeat = 20
+        start = time.perf_counter()
+        for _ in range(repeat):
+            expected = naive_streak(ledger, user_id, 'analyze_sleep')
+        naive_ms = (time.perf_counter() - start) / repeat * 1000
+        start = time.perf_counter()
+        for _ in range(100000):
+            current = streaks.current_streak(user_id, 'analyze_sleep', TODAY)
+        index_us = (time.perf_counter() - start) / 100000 * 1e6
+        assert current == expected
+        print(f"当前连续天数查询：遍历历史 {naive_ms:.2f} ms，索引 {index_us:.2f} us")
+
+        expected = {u: streaks.summary(f'user{u}', TODAY) for u in range(sample)}
+        for label, keep_since in (('保留最近一周原始记录', TODAY - timedelta(days=7)),
+                                  ('全部结转', TODAY + timedelta(days=1))):
+            start = time.perf_counter()
+            ledger.compact(keep_since=keep_since.isoformat())
+            compact_ms = (time.perf_counter() - start) * 1000
+
+            full_dir = os.path.join(work_dir, f'full_{keep_since.isoformat()}')
+            replicate(sample_dir, full_dir, sample, users)
+            size = sum(os.path.getsize(os.path.join(full_dir, name)) for name in os.listdir(full_dir))
+            streaks = StreakIndex()
+            start = time.perf_counter()
+            full = PointsLedger(full_dir, observers=[streaks])
+            elapsed = time.perf_counter() - start
+            assert all(streaks.summary(f'user{u + sample}', TODAY) == expected[u] for u in range(sample))
+            full.close()
+            shutil.rmtree(full_dir)
+            print(f"{label}：抽样结转 {compact_ms:.0f} ms；{users} 个用户一年数据"
+                  f"（{size / 1024 / 1024:.0f} MB）重建 {elapsed:.1f} s")
+        ledger.close()
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
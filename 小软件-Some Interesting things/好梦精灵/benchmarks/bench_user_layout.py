@@ -0,0 +1,130 @@
+"""
+用户记录布局对比：sleep_data / behavior_data 内嵌在 users.json 与按用户分片存储
+
+对比内存占用、启动加载、分数写入（同步整体重写）和读取用户信息的延迟，以及分片中每天记录的写入耗时。
+运行：python benchmarks/bench_user_layout.py [用户数] [天数]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import datetime
+import tempfile
+import tracemalloc
+
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, parent_dir)
+
+from services.user_service import UserService
+from services.user_storage import JsonUserStorage
+
+
+def make_users(count, days):
+    """生成带有 days 天历史数据的用户"""
+    start = datetime.date(2024, 1, 1)
+    dates = [(start + datetime.timedelta(days=i)).isoformat() for i in range(days)]
+    return {
+        f'user{i}': {
+            'password_hash': 'pbkdf2:sha256:600000$bench$' + '0' * 64,
+            'created_at': '2024-01-01T00:00:00',
+            'health_score': i % 1000,
+            'sleep_data': {d: {'sleep_hours': 7.5, 'bedtime': '23:00', 'quality_score': 8.0} for d in dates},
+            'behavior_data': {d: {'screen_time': 3.0, 'exercise_time': 30, 'steps': 6000, 'score': 9} for d in dates},
+            'is_admin': False,
+            'wechat_openid': None,
+            'wechat_info': {}
+        }
+        for i in range(count)
+    }
+
+
+def measure(label, load, write, read, writes=5, reads=200):
+    tracemalloc.start()
+    start = time.perf_counter()
+    state = load()
+    load_ms = (time.perf_counter() - start) * 1000
+    memory_mb = tracemalloc.get_traced_memory()[0] / 1024 / 1024
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for i in range(writes):
+        write(state, i)
+    write_ms = (time.perf_counter() - start) / writes * 1000
+
+    start = time.perf_counter()
+    for i in range(reads):
+        read(state, i)
+    read_ms = (time.perf_counter() - start) / reads * 1000
+
+    print(f"{label:>8} {memory_mb:>12.1f} {load_ms:>14.1f} {write_ms:>14.2f} {read_ms:>16.3f}")
+    return state
+
+
+def main():
+    user_count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 365
+    work_dir = tempfile.mkdtemp()
+    try:
+        users_file = os.path.join(work_dir, 'users.json')
+        with open(users_file, 'w', encoding='utf-8') as f:
+            json.dump(make_users(user_count, days), f, ensure_ascii=False, indent=2)
+        embedded_file = os.path.join(work_dir, 'embedded.json')
+        shutil.copy(users_file, embedded_file)
+
+        print(f"{user_count} 个用户，每人 {days} 天历史")
+        print(f"{'布局':>8} {'内存(MB)':>12} {'启动加载(ms)':>14} {'分数写入(ms)':>14} {'用户信息(ms)':>16}")
+
+        # 旧布局：整个文件常驻内存，每次写入序列化所有用户的全部历史
+        def load_embedded():
+            with open(embedded_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+
+        def write_embedded(users, i):
+            users[f'user{i}']['health_score'] += 1
+            with open(embedded_file, 'w', encoding='utf-8') as f:
+                json.dump(users, f, ensure_ascii=False, indent=2)
+
+        def read_embedded(users, i):
+            user_data = users[f'user{i % user_count}'].copy()
+            user_data.pop('password_hash', None)
+            return json.dumps(user_data, ensure_ascii=False)
+
+        measure('内嵌', load_embedded, write_embedded, read_embedded)
+
+        # 新布局：首次启动时把历史迁移到分片（不计入下面的测量）
+        start = time.perf_counter()
+        UserService(storage=JsonUserStorage(users_file, writer=None))
+        print(f"(分片迁移耗时 {(time.perf_counter() - start) * 1000:.0f} ms)")
+
+        def load_sharded():
+            return UserService(storage=JsonUserStorage(users_file, writer=None))
+
+        def write_sharded(service, i):
+            service.add_health_score(f'user{i}', 1)
+
+        def read_sharded(service, i):
+            return json.dumps(service.get_user_info(f'user{i % user_count}'), ensure_ascii=False)
+
+        service = measure('分片', load_sharded, write_sharded, read_sharded)
+
+        start = time.perf_counter()
+        for i in range(200):
+            service.get_user_series(f'user{i % user_count}', 'sleep_data')
+        print(f"按需读取单个用户睡眠分片: {(time.perf_counter() - start) / 200 * 1000:.3f} ms")
+
+        # 每天的行为记录只追加到分片日志，耗时与历史长度无关（先读入分片，只计写入）
+        new_day = datetime.date(2024, 1, 1) + datetime.timedelta(days=days)
+        for i in range(200):
+            service.get_user_series(f'user{i % user_count}', 'behavior_data')
+        start = time.perf_counter()
+        for i in range(200):
+            service.series.put(f'user{i % user_count}', 'behavior_data', new_day.isoformat(),
+                               {'screen_time': 2.5, 'exercise_time': 45, 'steps': 8000, 'score': 10})
+        print(f"写入一天行为记录: {(time.perf_counter() - start) / 200 * 1000:.3f} ms")
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
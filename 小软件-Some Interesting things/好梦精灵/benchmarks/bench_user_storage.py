@@ -0,0 +1,88 @@
+"""
+用户数据写入延迟基准测试：同步整体重写、延迟合并写入与追加日志模式对比
+
+运行：python benchmarks/bench_user_storage.py [用户数 ...]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, parent_dir)
+
+from services.user_service import UserService
+from services.user_storage import JsonUserStorage, JournalUserStorage
+from utils.write_behind import WriteBehindWriter
+
+
+def make_users(count):
+    """生成测试用户数据（不计算密码哈希，避免干扰写入测试）"""
+    return {
+        f'user{i}': {
+            'password_hash': 'pbkdf2:sha256:600000$bench$' + '0' * 64,
+            'created_at': '2024-01-01T00:00:00',
+            'health_score': i % 1000,
+            'is_admin': False,
+            'wechat_openid': None,
+            'wechat_info': {}
+        }
+        for i in range(count)
+    }
+
+
+def bench(mode, user_count, writes):
+    work_dir = tempfile.mkdtemp()
+    try:
+        users_file = os.path.join(work_dir, 'users.json')
+        with open(users_file, 'w', encoding='utf-8') as f:
+            json.dump(make_users(user_count), f, ensure_ascii=False, indent=2)
+
+        writer = WriteBehindWriter(interval=1.0)
+        if mode == 'json-sync':
+            storage = JsonUserStorage(users_file, writer=None)
+        elif mode == 'json':
+            storage = JsonUserStorage(users_file, writer=writer)
+        else:
+            storage = JournalUserStorage(users_file)
+        service = UserService(storage=storage)
+
+        latencies = []
+        for i in range(writes):
+            start = time.perf_counter()
+            service.add_health_score(f'user{i % user_count}', 8.5)
+            latencies.append(time.perf_counter() - start)
+        writer.stop()
+        storage.close()
+
+        start = time.perf_counter()
+        UserService(users_file, storage_mode='journal').storage.close()
+        load_time = time.perf_counter() - start
+    finally:
+        shutil.rmtree(work_dir)
+
+    latencies.sort()
+    return {
+        'avg_ms': sum(latencies) / len(latencies) * 1000,
+        'p99_ms': latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        'load_ms': load_time * 1000,
+        'file_writes': writer.write_count if mode == 'json' else '-'
+    }
+
+
+def main():
+    user_counts = [int(arg) for arg in sys.argv[1:]] or [10000, 100000]
+    print(f"{'用户数':>8} {'模式':>10} {'写入次数':>8} {'平均写入(ms)':>14} {'p99(ms)':>10} "
+          f"{'启动加载(ms)':>14} {'实际写文件':>10}")
+    for user_count in user_counts:
+        for mode in ('json-sync', 'json', 'journal'):
+            writes = 20 if mode == 'json-sync' else 2000
+            result = bench(mode, user_count, writes)
+            print(f"{user_count:>8} {mode:>10} {writes:>8} {result['avg_ms']:>14.3f} "
+                  f"{result['p99_ms']:>10.3f} {result['load_ms']:>14.1f} {result['file_writes']:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""
+多 worker 吞吐量与一致性测试
+
+父进程创建监听 socket 后 fork 出 N 个 worker（与 gunicorn 的 pre-fork 模型相同），
+每个 worker 在 SHARED_STATE_DB 模式下加载 api.app，共用同一个 SQLite 库。
+压测混合读写请求（聊天收发、加入聊天室、排行榜、排名查询、睡眠分析加分），
+结束后从多个新连接读取聊天记录、在线用户和排行榜，检查各 worker 返回的结果是否一致。
+运行：python benchmarks/bench_workers.py [每轮秒数] [客户端线程数]
+"""
+import os
+import sys
+import json
+import time
+import logging
+import random
+import socket
+import shutil
+import tempfile
+import threading
+import http.client
+import multiprocessing
+
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, parent_dir)
+
+USER_COUNT = 1000
+
+
+def seed_users(work_dir):
+    """直接写入数据库创建测试用户，避免注册时计算密码哈希"""
+    from services.user_storage import SQLiteUserStorage
+    storage = SQLiteUserStorage(os.path.join(work_dir, 'users.db'))
+    storage.import_users({
+        f'user{i}': {
+            'password_hash': 'bench',
+            'created_at': '2024-01-01T00:00:00',
+            'health_score': i % 500,
+            'is_admin': False,
+            'wechat_openid': None,
+            'wechat_info': {}
+        }
+        for i in range(USER_COUNT)
+    })
+    storage.close()
+
+
+def serve(fd, work_dir, ready):
+    """worker 进程：加载应用并在继承的监听 socket 上处理请求"""
+    os.chdir(work_dir)
+    os.environ['SHARED_STATE_DB'] = os.path.join(work_dir, 'shared_state.db')
+    sys.stdout = open(os.devnull, 'w')
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    from werkzeug.serving import make_server
+    from api.app import app
+    server = make_server('127.0.0.1', 0, app, threaded=True, fd=fd)
+    ready.release()
+    server.serve_forever()
+
+
+def request(port, method, path, body=None):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        conn.request(method, path, json.dumps(body) if body is not None else None, headers)
+        response = conn.getresponse()
+        data = response.read()
+        return response.status, data
+    finally:
+        conn.close()
+
+
+def client(port, duration, threads, results):
+    """客户端进程：多个线程循环发送混合请求，统计成功数"""
+    counts = []
+
+    def run(seed):
+        rng = random.Random(seed)
+        done = errors = 0
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            user = f'user{rng.randrange(USER_COUNT)}'
+            roll = rng.random()
+            if roll < 0.3:
+                status, _ = request(port, 'GET', '/chat/messages')
+            elif roll < 0.5:
+                status, _ = request(port, 'GET', '/leaderboard')
+            elif roll < 0.6:
+                status, _ = request(port, 'GET', f'/user/{user}/rank')
+            elif roll < 0.7:
+                status, _ = request(port, 'GET', '/chat/online')
+            elif roll < 0.8:
+                status, _ = request(port, 'POST', '/chat/join', {'username': user})
+            elif roll < 0.9:
+                status, _ = request(port, 'POST', '/chat/send', {'username': user, 'message': '晚安'})
+            else:
+                status, _ = request(port, 'POST', '/analyze',
+                                    {'user_id': user, 'sleep_hours': 7.5, 'bedtime': '23:00'})
+            if status == 200 and time.perf_counter() < deadline:
+                done += 1
+            elif status != 200:
+                errors += 1
+        counts.append((done, errors))
+
+    workers = [threading.Thread(target=run, args=(os.getpid() * 100 + i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    results.put((sum(c[0] for c in counts), sum(c[1] for c in counts)))
+
+
+def check_consistency(port, samples=24):
+    """多次用新连接读取共享状态，所有 worker 返回相同结果才算一致"""
+    seen = set()
+    for _ in range(samples):
+        messages = json.loads(request(port, 'GET', '/chat/messages')[1])['messages']
+        online = json.loads(request(port, 'GET', '/chat/online')[1])['count']
+        leaderboard = request(port, 'GET', '/leaderboard')[1]
+        seen.add((messages[-1]['id'] if messages else 0, online, leaderboard))
+    return len(seen) == 1
+
+
+def run_round(worker_count, duration, client_threads):
+    work_dir = tempfile.mkdtemp()
+    ctx = multiprocessing.get_context('fork')
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(256)
+    port = listener.getsockname()[1]
+    workers = []
+    try:
+        seed_users(work_dir)
+        ready = ctx.Semaphore(0)
+        for _ in range(worker_count):
+            process = ctx.Process(target=serve, args=(listener.fileno(), work_dir, ready), daemon=True)
+            process.start()
+            workers.append(process)
+        for _ in range(worker_count):
+            ready.acquire()
+
+        results = ctx.Queue()
+        client_procs = 4
+        clients = [ctx.Process(target=client, args=(port, duration, client_threads // client_procs, results))
+                   for _ in range(client_procs)]
+        for process in clients:
+            process.start()
+        totals = [results.get() for _ in clients]
+        for process in clients:
+            process.join()
+
+        done = sum(t[0] for t in totals)
+        errors = sum(t[1] for t in totals)
+        consistent = check_consistency(port)
+        return done / duration, errors, consistent
+    finally:
+        for process in workers:
+            process.terminate()
+            process.join()
+        listener.close()
+        shutil.rmtree(work_dir)
+
+
+def main():
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    client_threads = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    print(f"CPU 核数: {os.cpu_count()}，每轮 {duration:.0f} 秒，{client_threads} 个客户端线程")
+    print(f"{'worker数':>8} {'请求/秒':>10} {'失败数':>8} {'结果一致':>8}")
+    for worker_count in (1, 2, 4, 8):
+        throughput, errors, consistent = run_round(worker_count, duration, client_threads)
+        print(f"{worker_count:>8} {throughput:>10.1f} {errors:>8} {'是' if consistent else '否':>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+"""
+把 users.json（及未合并的 users.json.journal）导入 SQLite 数据库
+
+用法：python scripts/migrate_users.py [users.json] [users.db]
+导入完成后以 USER_STORAGE_MODE=sqlite 启动应用即可使用数据库存储。
+"""
+import os
+import sys
+
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, parent_dir)
+
+from services.user_storage import migrate_json_to_sqlite
+
+
+def main():
+    users_file = sys.argv[1] if len(sys.argv) > 1 else 'users.json'
+    db_file = sys.argv[2] if len(sys.argv) > 2 else None
+
+    if not os.path.exists(users_file):
+        print(f"找不到用户数据文件: {users_file}")
+        sys.exit(1)
+
+    count = migrate_json_to_sqlite(users_file, db_file)
+    print(f"已导入 {count} 个用户")
+
+
+if __name__ == '__main__':
+    main()
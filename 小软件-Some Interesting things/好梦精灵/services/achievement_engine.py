@@ -0,0 +1,126 @@
+import operator
+import threading
+import time
+
+# 条件中可用的比较运算
+OPERATORS = {
+    '>=': operator.ge,
+    '>': operator.gt,
+    '<=': operator.le,
+    '<': operator.lt,
+    '==': operator.eq,
+    '!=': operator.ne,
+    'in': lambda value, options: value in options
+}
+
+# 默认成就规则：event 为触发事件（可为列表），when 中的条件全部满足时授予 badge。
+# 条件字段先在事实（facts，如 streak 当前连续天数）中查找，其次取事件数据中的同名字段。
+DEFAULT_RULES = [
+    {'badge': 'weekly_analyzer', 'event': 'analyze_sleep', 'when': [['streak', '>=', 7]]},
+    {'badge': 'health_master', 'event': 'analyze_behavior', 'when': [['score', '>=', 90]]},
+    {'badge': 'habit_master', 'event': 'habit_update', 'when': [['completed', '==', True]]}
+]
+
+
+class _CompiledRule:
+    __slots__ = ('badge', 'checks')
+
+    def __init__(self, badge, checks):
+        self.badge = badge
+        self.checks = checks  # [(字段, 比较函数, 值), ...]
+
+
+class AchievementEngine:
+    """成就规则引擎
+
+    规则是普通的字典数据，创建时按触发事件编译成分派表，
+    每个事件只检查挂在该事件下的规则，徽章越多也不会拖慢无关事件。
+    事实（facts）按需计算：同一次评估中只计算规则实际用到的事实，且每个只算一次。
+    每种事件的评估次数、检查规则数和耗时都有统计，见 stats()。
+    """
+
+    def __init__(self, rules=None, facts=None):
+        """
+        :param rules: 规则列表，格式见 DEFAULT_RULES
+        :param facts: {事实名: 函数(user_id, event, data)}，条件字段优先从这里取值
+        """
+        self.facts = facts or {}
+        self.dispatch = self._compile(DEFAULT_RULES if rules is None else rules)
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _compile(self, rules):
+        """把规则编译成 {事件: [_CompiledRule, ...]}，规则有误时抛出 ValueError"""
+        dispatch = {}
+        for rule in rules:
+            badge = rule.get('badge')
+            if not badge:
+                raise ValueError(f'规则缺少 badge: {rule}')
+            checks = []
+            for condition in rule.get('when', []):
+                field, op, value = condition
+                if op not in OPERATORS:
+                    raise ValueError(f'规则 {badge} 中有未知的比较运算: {op}')
+                checks.append((field, OPERATORS[op], value))
+            events = rule.get('event')
+            for event in [events] if isinstance(events, str) else events or []:
+                dispatch.setdefault(event, []).append(_CompiledRule(badge, checks))
+        return dispatch
+
+    def evaluate(self, user_id, event, data=None, owned=()):
+        """
+        评估某个事件触发的规则
+        :param user_id: 用户ID
+        :param event: 事件类型
+        :param data: 事件数据
+        :param owned: 用户已有的徽章，这些规则直接跳过
+        :return: 新满足条件的徽章列表
+        """
+        start = time.perf_counter_ns()
+        data = data or {}
+        rules = self.dispatch.get(event, ())
+        values = {}
+        earned = []
+        checked = 0
+        for rule in rules:
+            if rule.badge in owned or rule.badge in earned:
+                continue
+            checked += 1
+            for field, compare, expected in rule.checks:
+                if field not in values:
+                    fact = self.facts.get(field)
+                    values[field] = fact(user_id, event, data) if fact else data.get(field)
+                value = values[field]
+                try:
+                    if value is None or not compare(value, expected):
+                        break
+                except TypeError:
+                    break
+            else:
+                earned.append(rule.badge)
+        self._record(event, checked, time.perf_counter_ns() - start)
+        return earned
+
+    def _record(self, event, checked, elapsed_ns):
+        with self._lock:
+            stats = self._stats.get(event)
+            if stats is None:
+                stats = self._stats[event] = {'evaluations': 0, 'rules_checked': 0, 'total_ns': 0, 'max_ns': 0}
+            stats['evaluations'] += 1
+            stats['rules_checked'] += checked
+            stats['total_ns'] += elapsed_ns
+            stats['max_ns'] = max(stats['max_ns'], elapsed_ns)
+
+    def stats(self):
+        """各事件的评估统计：次数、挂载规则数、平均检查规则数、平均和最大耗时（微秒）"""
+        with self._lock:
+            return {
+                event: {
+                    'evaluations': s['evaluations'],
+                    'rules': len(self.dispatch.get(event, ())),
+                    'avg_rules_checked': round(s['rules_checked'] / s['evaluations'], 2),
+                    'avg_us': round(s['total_ns'] / s['evaluations'] / 1000, 2),
+                    'max_us': round(s['max_ns'] / 1000, 2)
+                }
+                for event, s in self._stats.items()
+            }
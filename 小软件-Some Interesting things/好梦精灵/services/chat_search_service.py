@@ -0,0 +1,126 @@
+import heapq
+import threading
+from datetime import datetime
+from utils.chat_search import SearchIndex, normalize, tokenize
+
+
+class ChatSearchService:
+    """聊天记录全文搜索
+
+    每个聊天室有两份字符二元组倒排索引：启动时已有的历史消息由后台线程从聊天记录中
+    建立（归档索引），之后写入的消息由 ChatService 在写入时通知本服务加入（实时索引）。
+    两份索引各自只由一个线程写入，不同聊天室的写入也不共用锁。
+    查询时各聊天室按新到旧给出候选消息，按时间合并后读取正文核对关键词，取最新的若干条。
+    多进程部署时各 worker 追加到同一份聊天记录，实时索引改由后台线程每 poll_interval 秒
+    从聊天记录中读取新增的消息（包括本 worker 写入的），新消息最多延迟这么久才能搜到。
+    """
+
+    def __init__(self, chat_service, poll_interval=1.0):
+        """
+        :param chat_service: ChatService 实例
+        :param poll_interval: 多进程部署时读取聊天记录新增消息的间隔秒数
+        """
+        self.chat_service = chat_service
+        self.poll_interval = poll_interval
+        self.shared = chat_service.shared_state is not None
+        self.indexes = {}  # 聊天室名 -> (归档索引, 实时索引)
+        self._lock = threading.Lock()
+        self.backfilled = threading.Event()
+        self._closed = threading.Event()
+        if not self.shared:
+            chat_service.listeners.append(self)
+        # 先注册监听再记下各聊天室当前的末尾位置，此后写入的消息全部进入实时索引
+        boundaries = {}
+        for name in chat_service.list_rooms():
+            self._room_indexes(name)
+            boundaries[name] = chat_service.room(name).log.snapshot()
+        threading.Thread(target=self._backfill, args=(boundaries,), daemon=True).start()
+        self._follower = None
+        if self.shared:
+            self._follower = threading.Thread(target=self._follow, args=(dict(boundaries),), daemon=True)
+            self._follower.start()
+
+    def _room_indexes(self, room):
+        indexes = self.indexes.get(room)
+        if indexes is None:
+            with self._lock:
+                indexes = self.indexes.setdefault(room, (SearchIndex(), SearchIndex()))
+        return indexes
+
+    @staticmethod
+    def _timestamp(msg):
+        try:
+            return datetime.fromisoformat(msg['timestamp']).timestamp()
+        except (KeyError, TypeError, ValueError):
+            return 0.0
+
+    def message_added(self, room, msg, location):
+        """ChatService 的监听接口：把新消息加入实时索引"""
+        day, offset = location
+        self._room_indexes(room)[1].add(msg['message'], day, offset, msg['id'], self._timestamp(msg))
+
+    def _backfill(self, boundaries):
+        """按时间顺序把各聊天室启动前的消息加入归档索引"""
+        for room, until in boundaries.items():
+            if until is None:
+                continue
+            archive, live = self._room_indexes(room)
+            for day, offset, msg in self.chat_service.room(room).log.scan(until):
+                if not self.shared and len(live) and msg.get('id', 0) >= live.ids[0]:
+                    break  # 已由实时索引收录
+                archive.add(msg.get('message', ''), day, offset, msg.get('id', 0), self._timestamp(msg))
+        self.backfilled.set()
+
+    def _follow(self, positions):
+        """多进程部署时把各聊天室聊天记录中新增的消息加入实时索引；启动后新建的聊天室从头读取"""
+        while not self._closed.wait(self.poll_interval):
+            for room in self.chat_service.list_rooms():
+                records, position = self.chat_service.room(room).log.read_from(positions.get(room))
+                live = self._room_indexes(room)[1]
+                for day, offset, msg in records:
+                    live.add(msg.get('message', ''), day, offset, msg.get('id', 0), self._timestamp(msg))
+                if position is not None:
+                    positions[room] = position
+
+    def close(self):
+        """停止读取聊天记录新增消息的后台线程"""
+        self._closed.set()
+        if self._follower is not None:
+            self._follower.join()
+
+    def _candidates(self, room, tokens):
+        """按新到旧返回聊天室的候选消息 (时间戳, 聊天室名, 索引, 文档号)"""
+        archive, live = self._room_indexes(room)
+        for index in (live, archive):
+            for docno in index.candidates(tokens):
+                yield index.times[docno], room, index, docno
+
+    def search(self, query, room=None, limit=20):
+        """
+        搜索包含全部关键词（以空白分隔）的消息，按时间从新到旧返回
+        :param room: 只搜索该聊天室，默认搜索全部聊天室
+        :raises ValueError: 关键词中没有可索引的词（至少需要两个连续汉字或一个完整的字母数字词）
+        """
+        terms = normalize(query).split()
+        tokens = set()
+        for term in terms:
+            tokens |= tokenize(term)
+        if not tokens:
+            raise ValueError('关键词至少需要两个连续汉字或一个完整的英文单词、数字')
+        rooms = [room] if room is not None else list(self.indexes)
+        streams = [self._candidates(name, tokens) for name in rooms if name in self.indexes]
+        results = []
+        for _, name, index, docno in heapq.merge(*streams, key=lambda item: item[0], reverse=True):
+            day, offset, _, _ = index.location(docno)
+            msg = self.chat_service.room(name).log.read_at(day, offset)
+            # 二元组都出现不代表关键词连续出现，按正文核对
+            text = normalize(msg.get('message', ''))
+            if all(term in text for term in terms):
+                results.append(dict(msg, room=name))
+                if len(results) >= limit:
+                    break
+        return results
+
+    def stats(self):
+        """各聊天室已索引的消息数"""
+        return {room: len(archive) + len(live) for room, (archive, live) in self.indexes.items()}
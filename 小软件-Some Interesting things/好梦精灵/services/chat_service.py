@@ -1,59 +1,492 @@
 import json
 import os
+import re
+import threading
+import time
+from collections import deque
 from datetime import datetime
-from typing import List, Dict
+from typing import List, Dict, Optional, Sequence
+from utils.ring_buffer import RingBuffer
+from utils.chat_log import ChatLog
+from utils.presence import PresenceTracker
 
-class ChatService:
-    def __init__(self):
-        self.data_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
-        self.messages_file = os.path.join(self.data_dir, 'chat_messages.json')
-        self.online_users = set()
-        self.messages = self.load_messages()
-    
-    def load_messages(self) -> List[Dict]:
-        """加载聊天消息"""
-        if os.path.exists(self.messages_file):
-            try:
-                with open(self.messages_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except:
-                return []
-        return []
-    
-    def save_messages(self):
-        """保存聊天消息"""
-        os.makedirs(self.data_dir, exist_ok=True)
-        with open(self.messages_file, 'w', encoding='utf-8') as f:
-            json.dump(self.messages[-100:], f, ensure_ascii=False, indent=2)  # 只保留最近100条
+def sse_event(event: str, data, event_id=None) -> str:
+    """按 Server-Sent Events 格式编码一个事件"""
+    head = f'id: {event_id}\n' if event_id is not None else ''
+    return f'{head}event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
+
+class ChatSubscriber:
+    """广播中心的一个订阅者（一个推送连接），事件放在有界队列中"""
+    
+    def __init__(self, maxsize: int):
+        self.events = deque()
+        self.maxsize = maxsize
+        self.closed = False
+        self._cond = threading.Condition()
+    
+    def offer(self, event) -> bool:
+        """放入事件，队列已满时关闭订阅并返回 False"""
+        with self._cond:
+            if self.closed:
+                return False
+            if len(self.events) >= self.maxsize:
+                self.closed = True
+                self._cond.notify()
+                return False
+            self.events.append(event)
+            self._cond.notify()
+            return True
+    
+    def get(self, timeout: float = None):
+        """
+        取出一个事件 (id, 编码后的文本)
+        :return: 超时或订阅已关闭且事件取完时返回 None
+        """
+        with self._cond:
+            if not self.events and not self.closed:
+                self._cond.wait(timeout)
+            return self.events.popleft() if self.events else None
+    
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+
+class ChatHub:
+    """进程内的聊天广播中心
+    
+    每个推送连接订阅一个有界队列，发布时事件只编码一次，再把同一份文本放入各订阅者的队列。
+    消费过慢、队列写满的订阅者会被移出，其连接在取完已排队的事件后结束，
+    客户端重连时带上最后收到的 id，从消息缓冲区补齐缺失的消息。
+    """
+    
+    def __init__(self, queue_size: int = 256):
+        """
+        :param queue_size: 每个订阅者最多积压的事件数
+        """
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self.published_count = 0
+        self.evicted_count = 0
+    
+    def subscribe(self) -> ChatSubscriber:
+        subscriber = ChatSubscriber(self.queue_size)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+    
+    def unsubscribe(self, subscriber: ChatSubscriber):
+        subscriber.close()
+        with self._lock:
+            self._subscribers.discard(subscriber)
+    
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+    
+    def publish(self, event: str, data, event_id=None):
+        """向所有订阅者广播事件"""
+        item = (event_id, sse_event(event, data, event_id))
+        with self._lock:
+            subscribers = list(self._subscribers)
+            self.published_count += 1
+        slow = [subscriber for subscriber in subscribers if not subscriber.offer(item)]
+        if slow:
+            with self._lock:
+                for subscriber in slow:
+                    if subscriber in self._subscribers:
+                        self._subscribers.discard(subscriber)
+                        self.evicted_count += 1
+
+# 默认聊天室，数据存放在 data 目录下，与单聊天室版本的文件位置相同
+DEFAULT_ROOM = 'lobby'
+# 聊天室名只能包含文字、数字、下划线和连字符，可直接用作目录名
+ROOM_NAME = re.compile(r'[\w-]{1,32}')
+
+class ChatRoom:
+    """一个聊天室的消息、推送和在线状态
+    
+    每个聊天室有自己的锁、消息环形缓冲区、聊天记录目录、序号文件、广播中心和在线状态，
+    不同聊天室的发言不会争用同一把锁或同一个文件。
+    """
+    # 序号预留步长：每分配这么多个 id 同步写一次序号文件
+    ID_BLOCK = 1000
+    
+    def __init__(self, name, base_dir, shared_state=None, capacity=500, queue_size=256,
+                 poll_interval=1.0, fsync_interval=1.0, presence_ttl=15.0, moderation=None,
+                 on_presence=None, on_message=None):
+        """
+        :param name: 聊天室名
+        :param base_dir: 聊天室的数据目录，其中包含 chat_log 目录和 chat_seq.json
+        :param moderation: ModerationFilter 实例，写入前过滤消息中的敏感词，None 表示不过滤
+        :param on_presence: 本聊天室有用户心跳时调用的函数，参数为用户名
+        :param on_message: 本进程写入消息后调用的函数，参数为 (聊天室名, 消息, 在聊天记录中的位置)，
+                           单进程时在聊天室锁内按 id 顺序调用
+        """
+        self.name = name
+        self.base_dir = base_dir
+        self.seq_file = os.path.join(base_dir, 'chat_seq.json')
+        self.shared_state = shared_state
+        self.channel = 'chat' if name == DEFAULT_ROOM else f'chat:{name}'
+        self.hub = ChatHub(queue_size)
+        self.poll_interval = poll_interval
+        self.moderation = moderation
+        self.on_presence = on_presence
+        self.on_message = on_message
+        self._pump = None
+        self._pump_lock = threading.Lock()
+        # 多个 worker 同时追加同一个段文件，只有单进程时才在启动时修复段尾
+        self.log = ChatLog(os.path.join(base_dir, 'chat_log'), fsync_interval,
+                           repair=shared_state is None)
+        if shared_state is not None:
+            namespace = 'chat_online' if name == DEFAULT_ROOM else f'chat_online:{name}'
+            self.online_users = shared_state.namespace(namespace, ttl=presence_ttl)
+            return
+        self.online_users = PresenceTracker(presence_ttl, on_change=self._publish_online)
+        self._lock = threading.Lock()
+        self.messages = self.load_messages(capacity)
+    
+    def load_messages(self, capacity) -> RingBuffer:
+        """
+        从聊天记录末尾加载最近 capacity 条消息到环形缓冲区
+        
+        id 的延续依靠序号文件：每次预留 ID_BLOCK 个 id 并同步写出上界，重启后从上界继续分配，
+        即使掉电丢失了尚未 fsync 的消息也不会重复使用 id。
+        """
+        messages = self.log.tail(capacity)
+        next_id = messages[-1]['id'] + 1 if messages else 1
+        try:
+            with open(self.seq_file, 'r', encoding='utf-8') as f:
+                next_id = max(next_id, json.load(f)['reserved'])
+        except (OSError, ValueError, KeyError):
+            pass
+        
+        ring = RingBuffer(capacity, messages[0]['id'] if messages else next_id)
+        for msg in messages:
+            ring.append(msg, msg['id'])
+        ring.skip_to(next_id)
+        self._reserved = next_id
+        return ring
+    
+    def _reserve_ids(self):
+        """预留下一段 id 并同步写出上界"""
+        self._reserved = self.messages.next_seq + self.ID_BLOCK
+        os.makedirs(self.base_dir, exist_ok=True)
+        tmp_file = self.seq_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({'reserved': self._reserved}, f)
+        os.replace(tmp_file, self.seq_file)
+    
+    def close(self):
+        self.log.close()
     
     def add_message(self, username: str, message: str) -> Dict:
-        """添加消息"""
+        if self.moderation is not None:
+            message, _ = self.moderation.censor(message)
         msg = {
-            'id': len(self.messages) + 1,
             'username': username,
             'message': message,
-            'timestamp': datetime.now().isoformat()
+            'timestamp': datetime.now().isoformat(),
+            'room': self.name
         }
-        self.messages.append(msg)
-        self.save_messages()
+        if self.shared_state is not None:
+            msg['id'] = self.shared_state.append(self.channel, msg, keep=100)
+            location = self.log.append(msg)
+            if self.on_message is not None:
+                self.on_message(self.name, msg, location)
+            return msg
+        
+        with self._lock:
+            if self.messages.next_seq >= self._reserved:
+                self._reserve_ids()
+            msg['id'] = self.messages.next_seq
+            location = self.log.append(msg)
+            if self.on_message is not None:
+                self.on_message(self.name, msg, location)
+            self.messages.append(msg)
+            # 在锁内发布，保证推送顺序与 id 顺序一致
+            self.hub.publish('message', msg, msg['id'])
         return msg
     
     def get_recent_messages(self, limit: int = 50) -> List[Dict]:
-        """获取最近的消息"""
-        return self.messages[-limit:]
+        if self.shared_state is not None:
+            return [dict(record, id=record_id) for record_id, record in self.shared_state.tail(self.channel, limit)]
+        with self._lock:
+            return self.messages.tail(limit)
+    
+    def get_messages_after(self, after_id: int, limit: int = 50) -> List[Dict]:
+        if self.shared_state is not None:
+            return [dict(record, id=record_id)
+                    for record_id, record in self.shared_state.since(self.channel, after_id, limit)]
+        with self._lock:
+            return self.messages.since(after_id, limit)
+    
+    def get_messages_before(self, before_id: int, limit: int = 50) -> List[Dict]:
+        return self.log.before(before_id, limit)
+    
+    def message_version(self) -> int:
+        """消息版本号：写入新消息后增大，可用于判断客户端缓存的消息列表是否仍有效"""
+        if self.shared_state is not None:
+            records = self.shared_state.tail(self.channel, 1)
+            return records[-1][0] if records else 0
+        return self.messages.next_seq
+    
+    def subscribe(self) -> ChatSubscriber:
+        """
+        订阅本聊天室新消息和在线人数的推送
+        多进程部署时其它 worker 写入的消息不经过本进程，由后台线程定期从共享库取增量后广播
+        """
+        subscriber = self.hub.subscribe()
+        if self.shared_state is not None:
+            with self._pump_lock:
+                if self._pump is None or not self._pump.is_alive():
+                    self._pump = threading.Thread(target=self._pump_shared, daemon=True)
+                    self._pump.start()
+        return subscriber
+    
+    def unsubscribe(self, subscriber: ChatSubscriber):
+        self.hub.unsubscribe(subscriber)
+    
+    def _pump_shared(self):
+        """把共享库中的新消息和在线人数变化广播给本进程的订阅者，没有订阅者时退出"""
+        records = self.shared_state.tail(self.channel, 1)
+        last_id = records[-1][0] if records else 0
+        online = self.get_online_count()
+        while True:
+            time.sleep(self.poll_interval)
+            with self._pump_lock:
+                if not self.hub.subscriber_count():
+                    self._pump = None
+                    return
+            for msg in self.get_messages_after(last_id, limit=self.hub.queue_size):
+                self.hub.publish('message', msg, msg['id'])
+                last_id = msg['id']
+            self.online_users.purge_expired()
+            count = self.get_online_count()
+            if count != online:
+                online = count
+                self.hub.publish('online', {'count': count})
     
-    def join_room(self, username: str):
-        """用户加入聊天室"""
-        self.online_users.add(username)
+    def _publish_online(self, count: int):
+        self.hub.publish('online', {'count': count})
     
-    def leave_room(self, username: str):
-        """用户离开聊天室"""
-        self.online_users.discard(username)
+    def join(self, username: str):
+        if self.shared_state is not None:
+            self.online_users[username] = datetime.now().isoformat()
+        else:
+            self.online_users.heartbeat(username)
+        if self.on_presence is not None:
+            self.on_presence(username)
     
-    def get_online_users(self) -> List[str]:
-        """获取在线用户列表"""
-        return list(self.online_users)
+    def leave(self, username: str):
+        if self.shared_state is not None:
+            self.online_users.pop(username, None)
+        else:
+            self.online_users.leave(username)
+    
+    def is_online(self, username: str) -> bool:
+        return username in self.online_users
+    
+    def get_online_users(self) -> Sequence[str]:
+        if self.shared_state is not None:
+            return list(self.online_users)
+        return self.online_users.users()
     
     def get_online_count(self) -> int:
-        """获取在线用户数量"""
-        return len(self.online_users)
\ No newline at end of file
+        if self.shared_state is not None:
+            return len(self.online_users)
+        return self.online_users.count()
+
+class ChatService:
+    """多聊天室的聊天服务
+    
+    聊天室在第一次使用时从磁盘加载，之后各自独立加锁；不存在的聊天室由发言或加入时新建，总数有上限。
+    各方法的 room 参数默认为 DEFAULT_ROOM，与单聊天室版本的接口保持一致。
+    """
+    
+    def __init__(self, shared_state=None, data_dir=None, capacity=500,
+                 queue_size=256, poll_interval=1.0, fsync_interval=1.0, presence_ttl=15.0, moderation=None,
+                 max_rooms=100):
+        """
+        :param shared_state: SharedState 实例；多进程部署时最近的消息和在线用户存放在共享库中，
+                             为 None 时最近的消息保存在本进程内存
+        :param data_dir: 数据目录，默认为项目的 data 目录；默认聊天室的全部聊天记录按天追加到其中的
+                         chat_log 目录，其它聊天室的数据放在 chat_rooms/<聊天室名> 目录
+        :param capacity: 每个聊天室内存中保留的消息条数
+        :param queue_size: 每个推送连接最多积压的事件数
+        :param poll_interval: 多进程部署时，有推送连接的 worker 检查共享库新消息的间隔秒数
+        :param fsync_interval: 聊天记录两次 fsync 之间的最长秒数
+        :param presence_ttl: 在线心跳超时秒数，客户端每 5 秒发送一次心跳
+        :param moderation: ModerationFilter 实例，各聊天室写入消息前用它替换敏感词
+        :param max_rooms: 聊天室总数（包括磁盘上已有的）的上限，达到后不再新建
+        """
+        self.data_dir = data_dir or os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
+        self.messages_file = os.path.join(self.data_dir, 'chat_messages.json')  # 旧版本的消息文件
+        self.rooms_dir = os.path.join(self.data_dir, 'chat_rooms')
+        self.shared_state = shared_state
+        self.max_rooms = max_rooms
+        self.room_options = {
+            'shared_state': shared_state, 'capacity': capacity, 'queue_size': queue_size,
+            'poll_interval': poll_interval, 'fsync_interval': fsync_interval, 'presence_ttl': presence_ttl,
+            'moderation': moderation
+        }
+        self.rooms = {}
+        self._rooms_lock = threading.Lock()
+        # 新消息的监听者（如全文搜索），需实现 message_added(room, msg, location)
+        self.listeners = []
+        # 全部聊天室名：启动时扫描一次磁盘，之后随新建聊天室更新
+        self._room_names = self._scan_room_names()
+        # 跨聊天室的在线用户：任一聊天室有心跳即视为在线
+        self.presence = PresenceTracker(presence_ttl) if shared_state is None else None
+        self._migrate_messages_file()
+    
+    def _scan_room_names(self) -> List[str]:
+        names = {DEFAULT_ROOM}
+        if os.path.isdir(self.rooms_dir):
+            names.update(name for name in os.listdir(self.rooms_dir) if ROOM_NAME.fullmatch(name))
+        return sorted(names)
+    
+    def _migrate_messages_file(self):
+        """把旧版本 chat_messages.json 中的消息导入默认聊天室的聊天记录后删除该文件"""
+        if not os.path.exists(self.messages_file):
+            return
+        try:
+            with open(self.messages_file, 'r', encoding='utf-8') as f:
+                messages = json.load(f)
+        except (OSError, ValueError):
+            messages = []
+        log = ChatLog(os.path.join(self.data_dir, 'chat_log'))
+        if not log.segments():
+            ids = [msg.get('id') for msg in messages]
+            if any(not isinstance(i, int) for i in ids) or any(a >= b for a, b in zip(ids, ids[1:])):
+                # 旧版本按 len(messages) + 1 分配 id，重载后会重复，按顺序重新编号
+                for i, msg in enumerate(messages, 1):
+                    msg['id'] = i
+            for msg in messages:
+                log.append(msg)
+        log.close()
+        os.remove(self.messages_file)
+    
+    def room(self, name: str = DEFAULT_ROOM, create: bool = True) -> ChatRoom:
+        """
+        取得聊天室，已存在（包括其它进程新建的）时从磁盘加载
+        :param create: 不存在时是否新建；为 False 时不存在则抛出 KeyError
+        :raises ValueError: 名称不合法，或需要新建但聊天室数已达 max_rooms
+        """
+        room = self.rooms.get(name)
+        if room is not None:
+            return room
+        if not ROOM_NAME.fullmatch(name):
+            raise ValueError(f'聊天室名不合法: {name}')
+        base_dir = self.data_dir if name == DEFAULT_ROOM else os.path.join(self.rooms_dir, name)
+        exists = name in self._room_names or os.path.isdir(base_dir)
+        if not exists and not create:
+            raise KeyError(name)
+        with self._rooms_lock:
+            room = self.rooms.get(name)
+            if room is None:
+                if not exists:
+                    # 新建前重新扫描磁盘，连同其它进程新建的聊天室一起计数
+                    self._room_names = self._scan_room_names()
+                    if name not in self._room_names and len(self._room_names) >= self.max_rooms:
+                        raise ValueError(f'聊天室数量已达上限 {self.max_rooms}')
+                on_presence = self.presence.heartbeat if self.presence is not None else None
+                room = ChatRoom(name, base_dir, on_presence=on_presence, on_message=self._notify_message,
+                                **self.room_options)
+                self.rooms[name] = room
+                if name not in self._room_names:
+                    self._room_names = sorted(self._room_names + [name])
+            return room
+    
+    def _notify_message(self, room, msg, location):
+        for listener in self.listeners:
+            listener.message_added(room, msg, location)
+    
+    def list_rooms(self) -> List[str]:
+        """全部聊天室名（包括本次启动后尚未使用、只存在于磁盘上的）；多进程部署时重新扫描磁盘，包括其它进程新建的"""
+        if self.shared_state is not None:
+            self._room_names = self._scan_room_names()
+        return list(self._room_names)
+    
+    def close(self):
+        """fsync 并关闭各聊天室的聊天记录"""
+        for room in list(self.rooms.values()):
+            room.close()
+    
+    def add_message(self, username: str, message: str, room: str = DEFAULT_ROOM) -> Dict:
+        """添加消息"""
+        return self.room(room).add_message(username, message)
+    
+    def get_recent_messages(self, limit: int = 50, room: str = DEFAULT_ROOM) -> List[Dict]:
+        """获取最近的消息"""
+        return self.room(room).get_recent_messages(limit)
+    
+    def get_messages_after(self, after_id: int, limit: int = 50, room: str = DEFAULT_ROOM) -> List[Dict]:
+        """
+        获取 id 大于 after_id 的消息，供客户端轮询增量
+        :param limit: 最多返回最早的 limit 条，客户端以最后一条的 id 继续取后面的消息
+        """
+        return self.room(room).get_messages_after(after_id, limit)
+    
+    def get_messages_before(self, before_id: int, limit: int = 50, room: str = DEFAULT_ROOM) -> List[Dict]:
+        """获取 id 小于 before_id 的最近 limit 条消息，用于向前翻阅全部历史"""
+        return self.room(room).get_messages_before(before_id, limit)
+    
+    def subscribe(self, room: str = DEFAULT_ROOM) -> ChatSubscriber:
+        """订阅聊天室新消息和在线人数的推送"""
+        return self.room(room).subscribe()
+    
+    def unsubscribe(self, subscriber: ChatSubscriber, room: str = DEFAULT_ROOM):
+        self.room(room).unsubscribe(subscriber)
+    
+    def join_room(self, username: str, room: str = DEFAULT_ROOM):
+        """用户加入聊天室；客户端定时重复调用作为心跳，超过 presence_ttl 秒没有心跳视为离开"""
+        self.room(room).join(username)
+    
+    def leave_room(self, username: str, room: str = DEFAULT_ROOM):
+        """用户离开聊天室，不在其它聊天室时同时从全局在线用户中移除"""
+        self.room(room).leave(username)
+        if self.presence is not None and not any(r.is_online(username) for r in list(self.rooms.values())):
+            self.presence.leave(username)
+    
+    def get_online_users(self, room: Optional[str] = DEFAULT_ROOM) -> Sequence[str]:
+        """获取聊天室的在线用户列表，room 为 None 时返回所有聊天室的在线用户"""
+        if room is not None:
+            return self.room(room).get_online_users()
+        if self.presence is not None:
+            return self.presence.users()
+        return sorted({username for r in list(self.rooms.values()) for username in r.get_online_users()})
+    
+    def get_online_count(self, room: Optional[str] = DEFAULT_ROOM) -> int:
+        """获取聊天室的在线用户数量，room 为 None 时返回所有聊天室的在线人数（每人只计一次）"""
+        if room is not None:
+            return self.room(room).get_online_count()
+        if self.presence is not None:
+            return self.presence.count()
+        return len(self.get_online_users(None))
+    
+    def message_version(self, room: str = DEFAULT_ROOM) -> int:
+        """聊天室的消息版本号，写入新消息后增大"""
+        return self.room(room).message_version()
+    
+    def presence_version(self) -> Optional[int]:
+        """
+        在线状态的版本号：任一聊天室有人加入、离开或超时，或新建了聊天室后增大
+        多进程部署时在线用户存放在共享库中，没有版本号，返回 None
+        """
+        if self.presence is None:
+            return None
+        # 各计数只增不减，其和在任一计数变化时增大；超时是惰性处理的，先处理到期的用户
+        self.presence.expire()
+        version = self.presence.version + len(self._room_names)
+        for room in list(self.rooms.values()):
+            room.online_users.expire()
+            version += room.online_users.version
+        return version
+    
+    def get_room_sizes(self) -> Dict[str, int]:
+        """各聊天室的在线人数，尚未加载的聊天室计为 0，不会为此从磁盘加载"""
+        sizes = dict.fromkeys(self._room_names, 0)
+        for name, room in list(self.rooms.items()):
+            sizes[name] = room.get_online_count()
+        return sizes
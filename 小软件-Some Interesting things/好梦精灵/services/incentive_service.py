@@ -1,33 +1,84 @@
+import copy
 import json
 import os
-from datetime import datetime
+import threading
+from datetime import date, datetime
+from services.achievement_engine import AchievementEngine
+from utils.cached_json import CachedJsonFile
+from utils.points_ledger import PointsLedger
+from utils.streak_index import StreakIndex
+from utils.write_behind import write_behind
+
+# 计入连续天数的行为及其在积分记录中的原因
+ACTIVITY_REASONS = {
+    'analyze_sleep': '睡眠分析完成',
+    'analyze_behavior': '行为分析完成'
+}
+
+# 积分账本自上次合并以来新增超过这么多段（每段 4MB）时在后台合并，早于 LEDGER_KEEP_DAYS 天的记录结转
+LEDGER_AUTO_COMPACT = 16
+LEDGER_KEEP_DAYS = 365
 
 class IncentiveService:
-    def __init__(self, data_dir='data'):
+    def __init__(self, data_dir='data', writer=write_behind, rules=None, user_exists=None):
+        """
+        :param data_dir: 数据目录
+        :param writer: 积分/徽章/习惯文件使用的延迟写入器
+        :param rules: 成就规则，默认为 achievement_engine.DEFAULT_RULES
+        :param user_exists: 判断用户是否已注册的函数，为 None 时不检查
+        """
         self.data_dir = data_dir
+        self.user_exists = user_exists
         self.points_file = os.path.join(data_dir, 'user_points.json')
         self.badges_file = os.path.join(data_dir, 'user_badges.json')
         self.habits_file = os.path.join(data_dir, 'user_habits.json')
         self._ensure_data_dir()
+        # 三个文件常驻内存，读取不访问磁盘，修改由写入器合并写出
+        self.points = CachedJsonFile(self.points_file, writer)
+        self.badges = CachedJsonFile(self.badges_file, writer)
+        self.habits = CachedJsonFile(self.habits_file, writer)
+        # 积分变动记录追加到分段账本，不再每次重写整个历史文件，新增数据积累到一定量时在后台合并，
+        # 一年前的记录按用户结转；连续天数索引随账本加载重建，并在每次记录行为积分时更新
+        self.streaks = StreakIndex()
+        self.ledger = PointsLedger(os.path.join(data_dir, 'points_ledger'), observers=[self.streaks],
+                                   auto_compact=LEDGER_AUTO_COMPACT, keep_days=LEDGER_KEEP_DAYS)
+        self._migrate_points_history()
+        # 行为记录的"当天是否已记录"检查与账本追加在同一把锁内完成，并发提交只会写入一条
+        self._activity_lock = threading.Lock()
+        # 积分变化的监听者（如综合排行），需实现 points_changed(user_id, total)
+        self.listeners = []
+        # 成就规则中可引用的事实，只在规则用到时计算
+        self.achievements = AchievementEngine(rules, facts={
+            'streak': lambda user_id, event, data: self._check_consecutive_days(user_id, event),
+            'longest_streak': lambda user_id, event, data: self.streaks.longest_streak(user_id, event),
+            'total_points': lambda user_id, event, data: self.get_user_points(user_id),
+            'badge_count': lambda user_id, event, data: len(self.get_user_badges(user_id))
+        })
     
     def _ensure_data_dir(self):
         """确保数据目录存在"""
         if not os.path.exists(self.data_dir):
             os.makedirs(self.data_dir)
     
-    def add_points(self, user_id, points, reason=""):
+    def add_points(self, user_id, points, reason="", action=None):
         """
         为用户添加积分
         :param user_id: 用户ID
         :param points: 积分数量
         :param reason: 积分原因
+        :param action: 产生积分的行为类型，用于统计连续天数
         """
-        user_points = self._load_user_points()
-        
-        if user_id not in user_points:
-            user_points[user_id] = 0
+        with self.points.lock:
+            user_points = self._load_user_points()
             
-        user_points[user_id] += points
+            if user_id not in user_points:
+                user_points[user_id] = 0
+                
+            user_points[user_id] += points
+            total = user_points[user_id]
+            self._save_user_points(user_points)
+            # 在锁内通知，保证同一用户的积分按顺序送达
+            self._notify_points(user_id, total)
         
         # 记录积分变动历史
         history_entry = {
@@ -35,11 +86,58 @@ class IncentiveService:
             'points': points,
             'reason': reason
         }
-        
-        self._save_user_points(user_points)
+        if action:
+            history_entry['action'] = action
         self._record_points_history(user_id, history_entry)
         
-        return user_points[user_id]
+        return total
+    
+    def record_activity(self, user_id, action):
+        """
+        记录用户完成一次行为（如睡眠分析），只计入连续天数，不奖励积分；
+        同一用户同一行为每天只写入一条 0 积分的记录，重复提交不会增加积分或账本记录
+        :param user_id: 用户ID
+        :param action: 行为类型，见 ACTIVITY_REASONS
+        :return: 是否为当天第一次记录，未注册的用户不记录并返回 False
+        """
+        if not self._is_registered(user_id):
+            return False
+        with self._activity_lock:
+            if self.streaks.last_active(user_id, action) == date.today().toordinal():
+                return False
+            self.ledger.append(user_id, 0, ACTIVITY_REASONS[action], action=action)
+        return True
+    
+    def _is_registered(self, user_id):
+        """用户是否已注册，未设置 user_exists 时视为已注册"""
+        return self.user_exists is None or self.user_exists(user_id)
+    
+    def forget_user(self, user_id):
+        """
+        删除用户的积分、徽章、习惯和积分记录
+        :param user_id: 用户ID
+        """
+        for store in (self.points, self.badges, self.habits):
+            with store.lock:
+                data = store.data()
+                if user_id in data:
+                    del data[user_id]
+                    store.mark_dirty()
+                    if store is self.points:
+                        self._notify_points(user_id, 0)
+        self.ledger.forget(user_id)
+    
+    def user_removed(self, user_id):
+        """UserService 的监听接口：用户被删除时清除其激励数据"""
+        self.forget_user(user_id)
+    
+    def get_streaks(self, user_id):
+        """
+        获取用户各行为的连续天数
+        :param user_id: 用户ID
+        :return: {行为: {'current', 'longest', 'last_active'}}
+        """
+        return self.streaks.summary(user_id)
     
     def get_user_points(self, user_id):
         """
@@ -50,22 +148,54 @@ class IncentiveService:
         user_points = self._load_user_points()
         return user_points.get(user_id, 0)
     
+    def get_points_history(self, user_id, limit=20):
+        """
+        获取用户最近的积分变动
+        :param user_id: 用户ID
+        :param limit: 返回条数
+        :return: 按时间顺序排列的记录列表
+        """
+        return self.ledger.last(user_id, limit)
+    
+    def sum_points(self, user_id, start=None, end=None):
+        """
+        统计时间段内获得的积分
+        :param user_id: 用户ID
+        :param start: 起始时间（ISO 格式，含）
+        :param end: 结束时间（ISO 格式，不含）
+        :return: 积分合计
+        """
+        return self.ledger.sum(user_id, start, end)
+    
+    def all_points(self):
+        """
+        获取全部用户积分
+        :return: {用户ID: 积分} 的副本
+        """
+        with self.points.lock:
+            return dict(self._load_user_points())
+    
+    def _notify_points(self, user_id, total):
+        for listener in self.listeners:
+            listener.points_changed(user_id, total)
+    
     def award_badge(self, user_id, badge_name):
         """
         授予用户徽章
         :param user_id: 用户ID
         :param badge_name: 徽章名称
         """
-        user_badges = self._load_user_badges()
-        
-        if user_id not in user_badges:
-            user_badges[user_id] = []
+        with self.badges.lock:
+            user_badges = self._load_user_badges()
             
-        if badge_name not in user_badges[user_id]:
-            user_badges[user_id].append(badge_name)
-            self._save_user_badges(user_badges)
-            return True
-        return False
+            if user_id not in user_badges:
+                user_badges[user_id] = []
+                
+            if badge_name not in user_badges[user_id]:
+                user_badges[user_id].append(badge_name)
+                self._save_user_badges(user_badges)
+                return True
+            return False
     
     def get_user_badges(self, user_id):
         """
@@ -73,8 +203,8 @@ class IncentiveService:
         :param user_id: 用户ID
         :return: 用户徽章列表
         """
-        user_badges = self._load_user_badges()
-        return user_badges.get(user_id, [])
+        with self.badges.lock:
+            return list(self._load_user_badges().get(user_id, []))
     
     def get_user_habits(self, user_id):
         """
@@ -82,8 +212,8 @@ class IncentiveService:
         :param user_id: 用户ID
         :return: 用户习惯列表
         """
-        user_habits = self._load_user_habits()
-        return user_habits.get(user_id, {})
+        with self.habits.lock:
+            return copy.deepcopy(self._load_user_habits().get(user_id, {}))
     
     def update_habit(self, user_id, habit_name, progress):
         """
@@ -93,8 +223,22 @@ class IncentiveService:
         :param progress: 进度值
         :return: 更新后的习惯列表
         """
-        user_habits = self._load_user_habits()
+        with self.habits.lock:
+            user_habits = self._load_user_habits()
+            completed_now = self._apply_habit(user_habits, user_id, habit_name, progress)
+            self._save_user_habits(user_habits)
+            result = copy.deepcopy(user_habits[user_id])
+        
+        # 根据进度奖励积分
+        if completed_now:
+            self.add_points(user_id, 50, f"完成习惯: {habit_name}")
+        self.check_achievements(user_id, "habit_update",
+                                {'habit': habit_name, 'progress': progress, 'completed': completed_now})
         
+        return result
+    
+    def _apply_habit(self, user_habits, user_id, habit_name, progress):
+        """在习惯数据中更新进度，返回是否本次刚完成"""
         if user_id not in user_habits:
             user_habits[user_id] = {}
             
@@ -105,42 +249,134 @@ class IncentiveService:
                 'last_updated': datetime.now().isoformat()
             }
         
-        user_habits[user_id][habit_name]['progress'] = progress
-        user_habits[user_id][habit_name]['last_updated'] = datetime.now().isoformat()
-        
-        # 根据进度奖励积分
-        if progress >= 100 and not user_habits[user_id][habit_name].get('completed', False):
-            self.add_points(user_id, 50, f"完成习惯: {habit_name}")
-            user_habits[user_id][habit_name]['completed'] = True
-            self.award_badge(user_id, "habit_master")
+        habit = user_habits[user_id][habit_name]
+        habit['progress'] = progress
+        habit['last_updated'] = datetime.now().isoformat()
+        completed_now = progress >= 100 and not habit.get('completed', False)
+        if completed_now:
+            habit['completed'] = True
+        return completed_now
+    
+    def bulk_award(self, operations):
+        """
+        批量发放积分、徽章和更新习惯进度
+        三份数据各加锁、各标记写出一次，积分变动一次性追加到账本；
+        某条操作无效时只跳过该条，其余照常执行。
+        :param operations: [{'user_id', 'points', 'reason', 'badge', 'habit', 'progress'}, ...]，
+                           除 user_id 外都可省略，habit 与 progress 需同时给出
+        :return: 与 operations 一一对应的结果列表，成功时含 points（当前积分）、
+                 badge_awarded、habit_completed，失败时含 error
+        """
+        results = []
+        history = []
+        now = datetime.now().isoformat()
+        with self.points.lock, self.badges.lock, self.habits.lock:
+            user_points = self._load_user_points()
+            user_badges = self._load_user_badges()
+            user_habits = self._load_user_habits()
+            changed = set()
+            
+            for operation in operations:
+                error = self._check_operation(operation)
+                user_id = operation.get('user_id') if isinstance(operation, dict) else None
+                if error:
+                    results.append({'user_id': user_id, 'success': False, 'error': error})
+                    continue
+                
+                result = {'user_id': user_id, 'success': True}
+                awards = []
+                if operation.get('points'):
+                    awards.append((operation['points'], operation.get('reason', '')))
+                badges = [operation['badge']] if operation.get('badge') else []
+                if 'habit' in operation:
+                    completed = self._apply_habit(user_habits, user_id, operation['habit'], operation['progress'])
+                    result['habit_completed'] = completed
+                    changed.add('habits')
+                    if completed:
+                        awards.append((50, f"完成习惯: {operation['habit']}"))
+                
+                for points, reason in awards:
+                    user_points[user_id] = user_points.get(user_id, 0) + points
+                    history.append((user_id, points, reason, now, None))
+                    changed.add('points')
+                if 'habit' in operation:
+                    badges.extend(self.achievements.evaluate(
+                        user_id, "habit_update",
+                        {'habit': operation['habit'], 'progress': operation['progress'], 'completed': completed},
+                        owned=user_badges.get(user_id, []) + badges
+                    ))
+                if badges:
+                    owned = user_badges.setdefault(user_id, [])
+                    new_badges = [badge for badge in badges if badge not in owned]
+                    owned.extend(new_badges)
+                    if new_badges:
+                        changed.add('badges')
+                    if operation.get('badge'):
+                        result['badge_awarded'] = operation['badge'] in new_badges
+                result['points'] = user_points.get(user_id, 0)
+                results.append(result)
+            
+            if 'points' in changed:
+                self._save_user_points(user_points)
+                for user_id in {user_id for user_id, _, _, _, _ in history}:
+                    self._notify_points(user_id, user_points[user_id])
+            if 'badges' in changed:
+                self._save_user_badges(user_badges)
+            if 'habits' in changed:
+                self._save_user_habits(user_habits)
         
-        self._save_user_habits(user_habits)
-        return user_habits[user_id]
+        self.ledger.append_many(history)
+        return results
+    
+    @staticmethod
+    def _check_operation(operation):
+        """检查批量操作中的一条，返回错误信息，合法时返回 None"""
+        if not isinstance(operation, dict):
+            return '操作必须是对象'
+        if not isinstance(operation.get('user_id'), str) or not operation['user_id']:
+            return '缺少 user_id'
+        points = operation.get('points')
+        if points is not None and (isinstance(points, bool) or not isinstance(points, int)):
+            return 'points 必须是整数'
+        if not isinstance(operation.get('reason', ''), str):
+            return 'reason 必须是字符串'
+        badge = operation.get('badge')
+        if badge is not None and (not isinstance(badge, str) or not badge):
+            return 'badge 必须是非空字符串'
+        if ('habit' in operation) != ('progress' in operation):
+            return 'habit 与 progress 需同时提供'
+        if 'habit' in operation:
+            if not isinstance(operation['habit'], str) or not operation['habit']:
+                return 'habit 必须是非空字符串'
+            progress = operation['progress']
+            if isinstance(progress, bool) or not isinstance(progress, (int, float)):
+                return 'progress 必须是数字'
+        if not points and not badge and 'habit' not in operation:
+            return '至少需要 points、badge 或 habit 之一'
+        return None
     
     def check_achievements(self, user_id, action, data):
         """
-        检查用户是否达成成就
+        检查用户是否达成成就，只评估挂在该行为上的规则
         :param user_id: 用户ID
-        :param action: 行为类型
+        :param action: 行为类型（analyze_sleep、analyze_behavior、habit_update 等）
         :param data: 行为数据
+        :return: 本次新获得的徽章列表，未注册的用户不授予徽章
         """
         badges_awarded = []
-        
-        # 根据行为检查成就
-        if action == "analyze_sleep":
-            # 连续分析成就
-            if self._check_consecutive_days(user_id, "analyze_sleep") >= 7:
-                if self.award_badge(user_id, "weekly_analyzer"):
-                    badges_awarded.append("weekly_analyzer")
-                    
-        elif action == "analyze_behavior":
-            # 健康评分成就
-            if data.get('score', 0) >= 90:
-                if self.award_badge(user_id, "health_master"):
-                    badges_awarded.append("health_master")
+        if not self._is_registered(user_id):
+            return badges_awarded
+        owned = self.get_user_badges(user_id)
+        for badge in self.achievements.evaluate(user_id, action, data, owned):
+            if self.award_badge(user_id, badge):
+                badges_awarded.append(badge)
         
         return badges_awarded
     
+    def get_achievement_stats(self):
+        """成就规则评估的统计（各事件的次数、规则数和耗时）"""
+        return self.achievements.stats()
+    
     def _check_consecutive_days(self, user_id, action):
         """
         检查连续天数
@@ -148,55 +384,62 @@ class IncentiveService:
         :param action: 行为类型
         :return: 连续天数
         """
-        # 简化实现，实际应用中需要检查历史记录
-        return 1
+        return self.streaks.current_streak(user_id, action)
+    
+    def flush(self):
+        """立即写出积分、徽章和习惯的未保存修改"""
+        for store in (self.points, self.badges, self.habits):
+            store.flush()
+    
+    def close(self):
+        """写出剩余修改并释放写入器中的注册"""
+        for store in (self.points, self.badges, self.habits):
+            store.close()
+        self.ledger.close()
     
     def _load_user_points(self):
-        """加载用户积分数据"""
-        if os.path.exists(self.points_file):
-            with open(self.points_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return {}
+        """获取用户积分数据（内存缓存）"""
+        return self.points.data()
     
     def _save_user_points(self, user_points):
-        """保存用户积分数据"""
-        with open(self.points_file, 'w', encoding='utf-8') as f:
-            json.dump(user_points, f, ensure_ascii=False, indent=2)
+        """保存用户积分数据（由后台线程合并写入）"""
+        self.points.replace(user_points)
     
     def _load_user_badges(self):
-        """加载用户徽章数据"""
-        if os.path.exists(self.badges_file):
-            with open(self.badges_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return {}
+        """获取用户徽章数据（内存缓存）"""
+        return self.badges.data()
     
     def _save_user_badges(self, user_badges):
-        """保存用户徽章数据"""
-        with open(self.badges_file, 'w', encoding='utf-8') as f:
-            json.dump(user_badges, f, ensure_ascii=False, indent=2)
+        """保存用户徽章数据（由后台线程合并写入）"""
+        self.badges.replace(user_badges)
     
     def _load_user_habits(self):
-        """加载用户习惯数据"""
-        if os.path.exists(self.habits_file):
-            with open(self.habits_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return {}
+        """获取用户习惯数据（内存缓存）"""
+        return self.habits.data()
     
     def _save_user_habits(self, user_habits):
-        """保存用户习惯数据"""
-        with open(self.habits_file, 'w', encoding='utf-8') as f:
-            json.dump(user_habits, f, ensure_ascii=False, indent=2)
+        """保存用户习惯数据（由后台线程合并写入）"""
+        self.habits.replace(user_habits)
     
     def _record_points_history(self, user_id, entry):
-        """记录积分历史"""
-        history_file = os.path.join(self.data_dir, f'points_history_{user_id}.json')
-        history = []
-        
-        if os.path.exists(history_file):
-            with open(history_file, 'r', encoding='utf-8') as f:
+        """记录积分历史（追加到账本）"""
+        self.ledger.append(user_id, entry['points'], entry.get('reason', ''), entry['timestamp'],
+                           entry.get('action'))
+    
+    def _migrate_points_history(self):
+        """把旧版每个用户一个的 points_history_<用户>.json 导入账本后删除"""
+        prefix, suffix = 'points_history_', '.json'
+        reason_actions = {reason: action for action, reason in ACTIVITY_REASONS.items()}
+        for name in sorted(os.listdir(self.data_dir)):
+            if not (name.startswith(prefix) and name.endswith(suffix)):
+                continue
+            user_id = name[len(prefix):-len(suffix)]
+            path = os.path.join(self.data_dir, name)
+            with open(path, 'r', encoding='utf-8') as f:
                 history = json.load(f)
-        
-        history.append(entry)
-        
-        with open(history_file, 'w', encoding='utf-8') as f:
-            json.dump(history, f, ensure_ascii=False, indent=2)
\ No newline at end of file
+            if user_id not in self.ledger.users:
+                for entry in sorted(history, key=lambda e: e.get('timestamp', '')):
+                    # 旧记录没有行为类型，按原因还原，使历史分析也计入连续天数
+                    entry.setdefault('action', reason_actions.get(entry.get('reason')))
+                    self._record_points_history(user_id, entry)
+            os.remove(path)
@@ -0,0 +1,219 @@
+import threading
+import time
+from utils.ranked_index import RankedIndex
+
+# 综合分 = health × 健康分数 + points × 积分；默认与原排行榜一致，只按健康分数排名
+DEFAULT_WEIGHTS = {'health': 1.0, 'points': 0.0}
+
+
+def parse_weights(text):
+    """
+    解析 "health=1,points=0.1" 形式的权重配置
+    :return: 权重字典，text 为空时返回 None
+    """
+    if not text:
+        return None
+    weights = {}
+    for part in text.split(','):
+        name, _, value = part.partition('=')
+        name = name.strip()
+        if name not in DEFAULT_WEIGHTS:
+            raise ValueError(f'未知的排行权重: {name}')
+        weights[name] = float(value)
+    return weights
+
+
+class RankingService:
+    """健康分数与积分的综合排行
+
+    健康分数来自 UserService，积分来自 IncentiveService。本服务注册为两者的监听者，
+    在分数或积分变化时只更新对应用户在排行跳表中的位置，请求时直接读取，
+    不需要再到两处存储中关联数据。管理员不参与排名。
+    多进程部署时其它 worker 的修改不会通知到本进程，可设置 rebuild_interval 定期重建：
+    到期后由一个后台线程重建，请求继续读取当前排行；重建期间收到的修改先记下，换入新数据时再应用。
+    综合分只由健康分数决定（默认权重）且用户存储自带分数跳表时，直接读取存储的跳表，不再另建一份。
+    """
+
+    def __init__(self, user_service, incentive_service, weights=None, rebuild_interval=None):
+        """
+        :param weights: 综合分权重，见 DEFAULT_WEIGHTS
+        :param rebuild_interval: 两次全量重建之间的最短秒数，None 表示只在启动时重建
+        """
+        self.user_service = user_service
+        self.incentive_service = incentive_service
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        self.rebuild_interval = rebuild_interval
+        self.health = {}
+        self.points = {}
+        self.ranking = None  # 自建的综合分跳表，使用存储的跳表时为 None
+        self._lock = threading.RLock()
+        self._rebuild_lock = threading.Lock()
+        self._built_at = 0.0
+        self._version = 0
+        self._pending = None  # 重建期间收到的修改 [(事件, 参数...), ...]
+        user_service.listeners.append(self)
+        incentive_service.listeners.append(self)
+        self.rebuild()
+
+    def combined(self, health, points):
+        """按权重计算综合分"""
+        return round(self.weights['health'] * health + self.weights['points'] * points, 6)
+
+    def rebuild(self):
+        """从两个服务重新读取全部分数和积分"""
+        with self._rebuild_lock:
+            with self._lock:
+                self._pending = []
+            try:
+                points = self.incentive_service.all_points()
+                health = {
+                    username: data.get('health_score', 0)
+                    for username, data in self.user_service.iter_users()
+                    if not data.get('is_admin', False)
+                }
+                with self._lock:
+                    # 读取期间的修改可能已读到也可能没读到，按顺序重新应用（各事件都带最终值，重复应用结果不变）
+                    for event in self._pending:
+                        self._replay(health, points, *event)
+                    self.health = health
+                    self.points = points
+                    self._rerank()
+                    self._built_at = time.monotonic()
+            finally:
+                with self._lock:
+                    self._pending = None
+
+    @staticmethod
+    def _replay(health, points, event, username=None, value=None):
+        if event == 'add':
+            health[username] = value
+        elif event == 'score':
+            if username in health:
+                health[username] = value
+        elif event == 'remove':
+            health.pop(username, None)
+        elif event == 'reset':
+            for name in health:
+                health[name] = 0
+        elif event == 'points':
+            points[username] = value
+
+    def _record(self, *event):
+        """在锁内调用：重建进行中时记下修改"""
+        if self._pending is not None:
+            self._pending.append(event)
+
+    def _storage_index(self):
+        """综合分与健康分数相同时可直接使用的存储跳表，没有时返回 None"""
+        if self.weights != DEFAULT_WEIGHTS:
+            return None
+        return getattr(self.user_service.storage, 'ranking', None)
+
+    def _rerank(self):
+        self._version += 1
+        if self._storage_index() is not None:
+            self.ranking = None
+            return
+        self.ranking = RankedIndex()
+        for username, score in self.health.items():
+            self.ranking.set(username, self.combined(score, self.points.get(username, 0)))
+
+    def _maybe_rebuild(self):
+        if self.rebuild_interval is None or time.monotonic() - self._built_at < self.rebuild_interval:
+            return
+        with self._lock:
+            if time.monotonic() - self._built_at < self.rebuild_interval:
+                return
+            # 先推迟下次到期时间，同时到达的请求不会再各自启动重建；重建失败时下个间隔再试
+            self._built_at = time.monotonic()
+        threading.Thread(target=self.rebuild, daemon=True).start()
+
+    def set_weights(self, weights):
+        """更换权重并重新排序"""
+        with self._lock:
+            self.weights = dict(DEFAULT_WEIGHTS, **weights)
+            self._rerank()
+
+    def _update(self, username):
+        if username in self.health:
+            self._version += 1
+            if self.ranking is not None:
+                self.ranking.set(username, self.combined(self.health[username], self.points.get(username, 0)))
+
+    # ---- 监听接口，由 UserService / IncentiveService 调用 ----
+
+    def user_added(self, username, record):
+        if not record.get('is_admin', False):
+            with self._lock:
+                self.health[username] = record.get('health_score', 0)
+                self._record('add', username, self.health[username])
+                self._update(username)
+
+    def score_changed(self, username, total):
+        with self._lock:
+            self._record('score', username, total)
+            if username in self.health:
+                self.health[username] = total
+                self._update(username)
+
+    def user_removed(self, username):
+        with self._lock:
+            self._record('remove', username)
+            self.health.pop(username, None)
+            if self.ranking is not None:
+                self.ranking.remove(username)
+            self._version += 1
+
+    def scores_reset(self):
+        with self._lock:
+            self._record('reset')
+            self.health = dict.fromkeys(self.health, 0)
+            self._rerank()
+
+    def points_changed(self, user_id, total):
+        with self._lock:
+            self._record('points', user_id, total)
+            self.points[user_id] = total
+            self._update(user_id)
+
+    # ---- 查询 ----
+
+    def version(self):
+        """排行数据的版本号：任一用户的分数、积分或排名权重变化后增大"""
+        self._maybe_rebuild()
+        return self._version
+
+    def top(self, limit=10):
+        """返回前 limit 名 [(用户名, 健康分数, 积分), ...]"""
+        self._maybe_rebuild()
+        with self._lock:
+            if self.ranking is None:
+                with self.user_service.storage._lock:
+                    return [(username, score, self.points.get(username, 0))
+                            for username, score in self._storage_index().top(limit)]
+            return [(username, self.health[username], self.points.get(username, 0))
+                    for username, _ in self.ranking.top(limit)]
+
+    def rank(self, username):
+        """返回用户的综合排名信息，不参与排名时返回 None"""
+        self._maybe_rebuild()
+        with self._lock:
+            if self.ranking is not None:
+                return self._rank_info(self.ranking, username)
+            with self.user_service.storage._lock:
+                return self._rank_info(self._storage_index(), username)
+
+    def _rank_info(self, index, username):
+        rank = index.rank(username)
+        if rank is None:
+            return None
+        score = index.score(username)
+        return {
+            'username': username,
+            'rank': rank,
+            'score': score,
+            # 使用存储的跳表时综合分就是健康分数
+            'health_score': self.health[username] if self.ranking is not None else score,
+            'points': self.points.get(username, 0),
+            'total': len(index)
+        }
@@ -1,123 +1,340 @@
+import base64
+import datetime
 import json
 import os
-import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
+import threading
+import time
+from services.user_storage import create_storage, default_series_dir
+from services.user_storage import SORT_KEYS, sort_position, position_after, matches_filters
+from utils.user_shards import UserShardStore
+from utils.sleep_series import SleepSeriesStore
+from utils.password_hasher import get_password_hasher, HasherBusy
+from utils.user_aggregates import UserAggregates
+
+BUSY_RESULT = {'success': False, 'busy': True, 'message': '服务繁忙，请稍后重试'}
+
+# 候选用户（如在线用户）不超过该数量时直接逐个读取后排序，否则沿排序索引扫描并按集合过滤
+SMALL_CANDIDATE_SET = 2000
+
+
+def encode_cursor(position):
+    return base64.urlsafe_b64encode(json.dumps(position, ensure_ascii=False).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """解析分页游标，格式错误时抛出 ValueError"""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, UnicodeError):
+        raise ValueError('无效的分页游标')
+    if not isinstance(position, list) or len(position) != 2:
+        raise ValueError('无效的分页游标')
+    return position
 
 class UserService:
-    def __init__(self):
-        self.users_file = 'users.json'
-        self.users = self.load_users()
+    def __init__(self, users_file='users.json', storage_mode='json', storage=None, series_dir=None,
+                 hasher=None, shared=False, stats_interval=10.0):
+        """
+        :param users_file: 用户数据文件
+        :param storage_mode: 'json' 每次修改整体重写文件；'journal' 追加日志 + 后台快照；
+                             'sqlite' 使用同目录下的 SQLite 数据库
+        :param storage: 直接传入的 UserStorage 实例，优先于 storage_mode
+        :param series_dir: sleep_data / behavior_data 分片目录，默认与用户数据文件同目录；
+                           睡眠数据按列存放在其中的 sleep 目录
+        :param hasher: PasswordHasher 实例，默认使用全局进程池
+        :param shared: 多个 worker 进程共用数据目录，分片不在本进程内合并，读取前检查其它进程的追加
+        :param stats_interval: 其它 worker 修改过数据库时，用户统计最多每隔这么多秒在后台重建一次
+        """
+        self.users_file = users_file
+        self.storage_mode = storage_mode
+        self.storage = storage or create_storage(storage_mode, users_file)
+        series_dir = series_dir or default_series_dir(users_file)
+        self.series = UserShardStore(series_dir, shared=shared)
+        # 睡眠数据改为按列追加存储，分片中的旧 sleep_data 在用户第一次访问时迁移过去，写好数据文件后再删除
+        self.sleep_series = SleepSeriesStore(os.path.join(series_dir, 'sleep'),
+                                             legacy=lambda username: self.series.get(username, 'sleep_data'),
+                                             drop_legacy=lambda username: self.series.pop(username, 'sleep_data'),
+                                             shared=shared)
+        self.hasher = hasher or get_password_hasher()
+        self.load_users()
+        self.storage.extract_series(self.series)
+        self.aggregates = UserAggregates()
+        self.aggregates.rebuild(self.storage.iter_users())
+        self.stats_interval = stats_interval
+        self._stats_stale = False
+        self._stats_rebuilt_at = time.monotonic()
+        self._stats_thread = None
+        # 用户和分数变化的监听者（如综合排行），按需实现 user_added / score_changed / user_removed / scores_reset
+        self.listeners = []
         # 微信配置
         self.wechat_app_id = 'your_wechat_app_id'
         self.wechat_app_secret = 'your_wechat_app_secret'
     
     def load_users(self):
         """加载用户数据"""
-        if os.path.exists(self.users_file):
-            with open(self.users_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return {}
+        return self.storage.load()
     
     def save_users(self):
         """保存用户数据"""
-        with open(self.users_file, 'w', encoding='utf-8') as f:
-            json.dump(self.users, f, ensure_ascii=False, indent=2)
+        self.storage.save()
     
     def register_user(self, username, password):
         """用户注册"""
-        if username in self.users:
+        if self.storage.exists(username):
             return {'success': False, 'message': '用户已存在'}
         
         # 检查是否为管理员账号
         is_admin = username == 'admin'
         
-        self.users[username] = {
-            'password_hash': generate_password_hash(password),
-            'created_at': datetime.datetime.now().isoformat(),
+        try:
+            password_hash = self.hasher.hash(password)
+        except HasherBusy:
+            return dict(BUSY_RESULT)
+        
+        now = datetime.datetime.now().isoformat()
+        record = {
+            'password_hash': password_hash,
+            'created_at': now,
+            'updated_at': now,
             'health_score': 0,
-            'sleep_data': {},
-            'behavior_data': {},
             'is_admin': is_admin,
             'wechat_openid': None,
             'wechat_info': {}
         }
-        self.save_users()
+        if not self.storage.add_user(username, record):
+            # 其它请求或 worker 在检查之后抢先注册了同名用户
+            return {'success': False, 'message': '用户已存在'}
+        self.aggregates.add_user(record)
+        self._notify('user_added', username, record)
         return {'success': True, 'message': '注册成功'}
     
     def login_user(self, username, password):
         """用户登录"""
-        if username not in self.users:
+        user = self.storage.get(username)
+        if user is None:
             return {'success': False, 'message': '用户不存在'}
         
-        if check_password_hash(self.users[username]['password_hash'], password):
-            return {'success': True, 'user_id': username}
-        return {'success': False, 'message': '密码错误'}
+        try:
+            if not self.hasher.verify(user['password_hash'], password):
+                return {'success': False, 'message': '密码错误'}
+        except HasherBusy:
+            return dict(BUSY_RESULT)
+        # 哈希强度配置变化后，借登录时拿到的明文透明地重新计算哈希；
+        # 繁忙时跳过，留到下次登录，不影响本次登录结果
+        if self.hasher.needs_rehash(user['password_hash']):
+            try:
+                self.storage.update_user(username, {'password_hash': self.hasher.hash(password)})
+            except HasherBusy:
+                pass
+        return {'success': True, 'user_id': username}
     
     def get_user_info(self, username):
         """获取用户信息"""
-        if username in self.users:
-            user_data = self.users[username].copy()
+        user = self.storage.get(username)
+        if user is not None:
+            user_data = user.copy()
             user_data.pop('password_hash', None)
             return user_data
         return None
     
     def clear_user_data(self, username):
         """清除用户数据（仅管理员）"""
-        if username in self.users and self.users[username].get('is_admin'):
-            for user in self.users.values():
-                if not user.get('is_admin'):
-                    user['health_score'] = 0
-                    user['sleep_data'] = {}
-                    user['behavior_data'] = {}
-            self.save_users()
+        user = self.storage.get(username)
+        if user is not None and user.get('is_admin'):
+            self.clear_all_data()
             return True
         return False
     
     def add_health_score(self, username, score):
         """累加用户健康分数"""
-        if username in self.users:
-            self.users[username]['health_score'] += score
-            self.save_users()
-            return self.users[username]['health_score']
-        return 0
+        scores = self.storage.add_score(username, score)
+        if scores is None:
+            return 0
+        # 用存储读到的原分数而不是 total - score，浮点误差可能使其落入相邻的分段
+        old_score, total = scores
+        if not self.storage.get(username).get('is_admin', False):
+            self.aggregates.change_score(old_score, total)
+            self._notify('score_changed', username, total)
+        return total
     
     def reset_all_scores(self):
         """重置所有用户健康分数"""
-        for username, data in self.users.items():
-            if not data.get('is_admin', False):
-                data['health_score'] = 0
-        self.save_users()
+        self.storage.reset_scores()
+        self.aggregates.reset_scores()
+        self._notify('scores_reset')
+    
+    def clear_all_data(self):
+        """清除所有非管理员用户的分数和历史数据"""
+        self.storage.clear_data()
+        self.aggregates.reset_scores()
+        self._notify('scores_reset')
+        for username, _ in self.storage.iter_users():
+            self.series.delete(username)
+            self.sleep_series.delete(username)
+    
+    def delete_user(self, username):
+        """删除非管理员用户"""
+        user = self.storage.get(username)
+        if user is not None and not user.get('is_admin', False):
+            self.series.delete(username)
+            self.sleep_series.delete(username)
+            if self.storage.delete_user(username):
+                self.aggregates.remove_user(user)
+                self._notify('user_removed', username)
+                return True
+        return False
+    
+    def _notify(self, event, *args):
+        for listener in self.listeners:
+            handler = getattr(listener, event, None)
+            if handler is not None:
+                handler(*args)
+    
+    def get_user_series(self, username, kind):
+        """
+        按需读取用户时序数据
+        :param kind: 'sleep_data' 或 'behavior_data'
+        :return: {日期: 记录}
+        """
+        if kind == 'sleep_data':
+            return self.sleep_series.get(username).to_dict()
+        return self.series.get(username, kind)
+    
+    def record_user_series(self, username, kind, date, entry):
+        """记录用户某天的睡眠或行为数据"""
+        if self.storage.exists(username):
+            if kind == 'sleep_data':
+                self.sleep_series.put(username, date, entry)
+            else:
+                self.series.put(username, kind, date, entry)
+            # 刷新修改时间，增量导出才能带上新的时序数据
+            self.storage.update_user(username, {'updated_at': datetime.datetime.now().isoformat()})
     
     def bind_wechat(self, username, openid, wechat_info):
         """绑定微信账号"""
-        if username in self.users:
-            self.users[username]['wechat_openid'] = openid
-            self.users[username]['wechat_info'] = wechat_info
-            self.save_users()
-            return True
-        return False
+        user = self.storage.get(username)
+        if user is None:
+            return False
+        old_openid = user.get('wechat_openid')
+        self.storage.update_user(username, {'wechat_openid': openid, 'wechat_info': wechat_info})
+        if not user.get('is_admin', False):
+            self.aggregates.change_wechat(old_openid, openid)
+        return True
     
     def get_wechat_users(self):
         """获取已绑定微信的用户"""
-        wechat_users = []
-        for username, data in self.users.items():
-            if data.get('wechat_openid') and not data.get('is_admin', False):
-                wechat_users.append({
-                    'username': username,
-                    'openid': data['wechat_openid'],
-                    'wechat_info': data.get('wechat_info', {})
-                })
-        return wechat_users
+        return self.storage.wechat_users()
     
     def get_leaderboard(self, limit=10):
         """获取排行榜"""
-        # 过滤非管理员用户
-        regular_users = [
-            (name, data['health_score']) 
-            for name, data in self.users.items() 
-            if not data.get('is_admin', False)
-        ]
-        
-        # 按健康分数排序
-        sorted_users = sorted(regular_users, key=lambda x: x[1], reverse=True)
-        return sorted_users[:limit]
\ No newline at end of file
+        return self.storage.leaderboard(limit)
+    
+    def get_user_rank(self, username):
+        """获取用户在排行榜中的名次，管理员或不存在的用户返回 None"""
+        result = self.storage.rank(username)
+        if result is None:
+            return None
+        rank, score = result
+        return {
+            'username': username,
+            'rank': rank,
+            'health_score': score,
+            'total': self.storage.count_ranked()
+        }
+    
+    def get_system_stats(self):
+        """
+        获取普通用户统计：总数、活跃数、平均分、微信绑定数、分数分布和每日注册数
+        多进程共用数据库时，其它 worker 的修改不会经过本进程的增量统计，发现后在后台重建，
+        重建完成前返回的统计最多落后 stats_interval 秒
+        """
+        if self.storage.changed_by_others():
+            self._stats_stale = True
+        if (self._stats_stale and self._stats_thread is None
+                and time.monotonic() - self._stats_rebuilt_at >= self.stats_interval):
+            self._stats_thread = threading.Thread(target=self._rebuild_stats, daemon=True)
+            self._stats_thread.start()
+        return self.aggregates.snapshot()
+    
+    def _rebuild_stats(self):
+        try:
+            self._stats_stale = False
+            old = self.aggregates
+            changes = old.change_count
+            aggregates = UserAggregates(old.bucket_width)
+            aggregates.rebuild(self.storage.iter_users())
+            self.aggregates = aggregates
+            if old.change_count != changes:
+                # 重建期间本进程的修改可能没有计入，下次再重建
+                self._stats_stale = True
+        finally:
+            self._stats_rebuilt_at = time.monotonic()
+            self._stats_thread = None
+    
+    def page_users(self, sort='score', cursor=None, limit=50, min_score=None, max_score=None, wechat=None,
+                   only=None):
+        """
+        分页获取普通用户（不含密码哈希）
+        :param sort: score / created_at / -created_at / username
+        :param cursor: 上一页返回的 next_cursor
+        :param only: 只在这些用户名中查找（在线、设备类型等会话条件），None 表示不限
+        :return: ([(username, 用户数据), ...], next_cursor)，没有下一页时 next_cursor 为 None
+        """
+        if sort not in SORT_KEYS:
+            raise ValueError(f'未知的排序方式: {sort}')
+        after = decode_cursor(cursor) if cursor else None
+        if only is not None and len(only) <= SMALL_CANDIDATE_SET:
+            rows = []
+            for username in only:
+                record = self.storage.get(username)
+                if record is None or record.get('is_admin', False):
+                    continue
+                if not matches_filters(record, min_score, max_score, wechat):
+                    continue
+                position = sort_position(sort, username, record)
+                if after is None or position_after(sort, position, after):
+                    rows.append((position, username, record))
+            rows.sort(key=lambda row: (-row[0][0], row[1]) if sort == 'score' else row[0],
+                      reverse=sort == '-created_at')
+            page = [(username, record) for _, username, record in rows[:limit]]
+        else:
+            page = []
+            batch_size = limit if only is None else max(limit, 500)
+            while len(page) < limit:
+                batch = self.storage.page_users(sort, after, batch_size, min_score, max_score, wechat)
+                page.extend(row for row in batch if only is None or row[0] in only)
+                if len(batch) < batch_size:
+                    break
+                after = sort_position(sort, *batch[-1])
+            page = page[:limit]
+
+        next_cursor = None
+        if len(page) == limit:
+            next_cursor = encode_cursor(sort_position(sort, *page[-1]))
+        users = []
+        for username, data in page:
+            user_data = dict(data)
+            user_data.pop('password_hash', None)
+            users.append((username, user_data))
+        return users, next_cursor
+    
+    def iter_users(self, updated_since=None):
+        """遍历非管理员用户 (username, 用户数据)，不含密码哈希"""
+        for username, data in self.storage.iter_users(updated_since):
+            user_data = dict(data)
+            user_data.pop('password_hash', None)
+            yield username, user_data
+    
+    def iter_export(self, updated_since=None):
+        """逐个生成导出记录，时序数据按需从分片读取，内存占用与用户总数无关"""
+        for username, data in self.storage.iter_users(updated_since):
+            shard = self.series.read(username)
+            sleep_data = self.sleep_series.read(username)
+            yield {
+                'username': username,
+                'health_score': data.get('health_score', 0),
+                'created_at': data.get('created_at', ''),
+                'updated_at': data.get('updated_at', data.get('created_at', '')),
+                'sleep_data': sleep_data if sleep_data is not None else shard.get('sleep_data', {}),
+                'behavior_data': shard.get('behavior_data', {})
+            }
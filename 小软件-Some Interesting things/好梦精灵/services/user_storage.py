@@ -0,0 +1,624 @@
+import datetime
+import json
+import os
+import sqlite3
+import threading
+from utils.user_journal import UserJournal, apply_entry
+from utils.ranked_index import RankedIndex, SortedIndex
+from utils.write_behind import write_behind
+from utils.user_shards import UserShardStore, split_embedded_series
+
+# 后台用户列表支持的排序：score 分数从高到低，created_at / -created_at 按注册时间升序 / 降序，username 按用户名
+SORT_KEYS = ('score', 'created_at', '-created_at', 'username')
+
+
+def sort_position(sort, username, record):
+    """用户在某种排序下的位置 (排序值, 用户名)，用作分页游标"""
+    if sort == 'score':
+        return record.get('health_score', 0), username
+    if sort == 'username':
+        return username, username
+    return record.get('created_at', ''), username
+
+
+def position_after(sort, position, cursor):
+    """在该排序下 position 是否排在 cursor 之后"""
+    if sort == 'score':
+        return (-position[0], position[1]) > (-cursor[0], cursor[1])
+    if sort == '-created_at':
+        return tuple(position) < tuple(cursor)
+    return tuple(position) > tuple(cursor)
+
+
+def matches_filters(record, min_score=None, max_score=None, wechat=None):
+    """用户记录是否满足分数范围和微信绑定条件"""
+    score = record.get('health_score', 0)
+    if min_score is not None and score < min_score:
+        return False
+    if max_score is not None and score > max_score:
+        return False
+    if wechat is not None and bool(record.get('wechat_openid')) != wechat:
+        return False
+    return True
+
+
+class UserStorage:
+    """用户存储接口
+
+    默认实现基于内存字典，所有修改先通过 apply_entry 应用到字典，
+    再由子类的 _persist 负责落盘。排行榜和后台分页由随修改增量维护的索引提供
+    （分数用跳表，注册时间和用户名用有序列表），SQLite 实现会覆盖为索引查询。
+    用户统计由 UserService 中的 UserAggregates 增量维护，不在存储层计算。
+    Flask 以多线程处理请求，字典、索引和落盘的修改都在同一把锁内完成，索引查询也持有该锁。
+    """
+
+    def __init__(self):
+        self.users = {}
+        self.ranking = RankedIndex()
+        self.by_created = SortedIndex()
+        self.by_name = SortedIndex()
+        self._lock = threading.RLock()
+
+    def load(self):
+        """加载用户数据"""
+        with self._lock:
+            self.users = self._load_users()
+            self._rebuild_indexes()
+            return self.users
+
+    def _load_users(self):
+        return {}
+
+    def save(self):
+        """把全部数据写出到磁盘"""
+        pass
+
+    def close(self):
+        """释放文件句柄等资源"""
+        pass
+
+    def changed_by_others(self):
+        """自上次调用以来是否有其它进程修改过数据"""
+        return False
+
+    def extract_series(self, shard_store):
+        """把旧格式记录中内嵌的 sleep_data / behavior_data 移入分片，返回迁移的用户数"""
+        moved = split_embedded_series(self.users, shard_store)
+        if moved:
+            self.save()
+        return moved
+
+    def _persist(self, entry):
+        """持久化一条修改记录"""
+        raise NotImplementedError
+
+    def _apply(self, op, username=None, **payload):
+        entry = {'op': op}
+        if username is not None:
+            entry['username'] = username
+        entry.update(payload)
+        entry['at'] = datetime.datetime.now().isoformat()
+        with self._lock:
+            old = self.users.get(username) if username is not None else None
+            old_created = old.get('created_at', '') if old and not old.get('is_admin', False) else None
+            apply_entry(self.users, entry)
+            self._update_indexes(entry, old_created)
+            self._persist(entry)
+
+    def _rebuild_indexes(self):
+        self.ranking.clear()
+        created, names = [], []
+        for username, data in self.iter_users():
+            self.ranking.set(username, data.get('health_score', 0))
+            created.append((data.get('created_at', ''), username))
+            names.append((username, username))
+        self.by_created = SortedIndex(created)
+        self.by_name = SortedIndex(names)
+
+    def _update_indexes(self, entry, old_created=None):
+        """
+        按修改类型增量更新排行榜和分页索引
+        :param old_created: 修改前该普通用户的注册时间，用于从有序索引中删除旧条目
+        """
+        op = entry['op']
+        username = entry.get('username')
+        if op in ('put', 'delete') and old_created is not None:
+            self.by_created.remove(old_created, username)
+            self.by_name.remove(username, username)
+        if op == 'put':
+            record = entry['record']
+            if record.get('is_admin', False):
+                self.ranking.remove(username)
+            else:
+                self.ranking.set(username, record.get('health_score', 0))
+                self.by_created.add(record.get('created_at', ''), username)
+                self.by_name.add(username, username)
+        elif op == 'score':
+            if username in self.ranking:
+                self.ranking.set(username, self.users[username]['health_score'])
+        elif op == 'delete':
+            self.ranking.remove(username)
+        elif op in ('reset_scores', 'clear_data'):
+            self.ranking.clear()
+            for member in self.by_name.entries:
+                self.ranking.set(member[0], 0)
+
+    # ---- 单用户操作 ----
+
+    def get(self, username):
+        """获取用户完整记录（含密码哈希），不存在返回 None"""
+        return self.users.get(username)
+
+    def exists(self, username):
+        return username in self.users
+
+    def add_user(self, username, record):
+        """添加用户，用户名已存在时不修改并返回 False"""
+        with self._lock:
+            if username in self.users:
+                return False
+            self._apply('put', username, record=record)
+            return True
+
+    def add_score(self, username, delta):
+        """累加分数，返回 (原分数, 新分数)；用户不存在返回 None"""
+        with self._lock:
+            if username not in self.users:
+                return None
+            old_score = self.users[username].get('health_score', 0)
+            self._apply('score', username, delta=delta)
+            return old_score, self.users[username]['health_score']
+
+    def update_user(self, username, fields):
+        with self._lock:
+            if username not in self.users:
+                return False
+            self._apply('set', username, fields=fields)
+            return True
+
+    def delete_user(self, username):
+        with self._lock:
+            if username not in self.users:
+                return False
+            self._apply('delete', username)
+            return True
+
+    def reset_scores(self):
+        self._apply('reset_scores')
+
+    def clear_data(self):
+        self._apply('clear_data')
+
+    # ---- 查询 ----
+
+    def iter_users(self, updated_since=None):
+        """
+        遍历非管理员用户 (username, record)
+        :param updated_since: ISO 时间字符串，只返回在此之后修改过的用户
+        """
+        # 先复制用户名列表，遍历期间其它请求可以继续增删用户
+        for username in list(self.users):
+            data = self.users.get(username)
+            if data is None or data.get('is_admin', False):
+                continue
+            if updated_since and data.get('updated_at', data.get('created_at', '')) < updated_since:
+                continue
+            yield username, data
+
+    def page_users(self, sort='score', after=None, limit=50, min_score=None, max_score=None, wechat=None):
+        """
+        按排序返回游标之后的一页普通用户 [(username, record), ...]
+        :param after: 上一页最后一个用户的 sort_position，None 表示第一页
+        :param wechat: True 只返回已绑定微信的用户，False 只返回未绑定的
+        """
+        with self._lock:
+            if sort == 'score':
+                if after is not None:
+                    entries = self.ranking.iter_from(*after)
+                else:
+                    # 从最高分上限处开始，直接跳过分数更高的用户
+                    entries = self.ranking.iter_from(max_score)
+            elif sort in ('created_at', '-created_at'):
+                entries = ((member, key) for key, member in
+                           self.by_created.iter_from(after, reverse=sort.startswith('-')))
+            elif sort == 'username':
+                entries = ((member, key) for key, member in self.by_name.iter_from(after))
+            else:
+                raise ValueError(f'未知的排序方式: {sort}')
+
+            page = []
+            for username, value in entries:
+                if sort == 'score' and min_score is not None and value < min_score:
+                    break
+                record = self.users.get(username)
+                if record is None or not matches_filters(record, min_score, max_score, wechat):
+                    continue
+                page.append((username, record))
+                if len(page) >= limit:
+                    break
+            return page
+
+    def leaderboard(self, limit):
+        """健康分数前 limit 名 [(username, score), ...]"""
+        with self._lock:
+            return self.ranking.top(limit)
+
+    def rank(self, username):
+        """返回 (排名, 分数)，管理员或不存在的用户返回 None"""
+        with self._lock:
+            rank = self.ranking.rank(username)
+            if rank is None:
+                return None
+            return rank, self.ranking.score(username)
+
+    def count_ranked(self):
+        """参与排名的用户数"""
+        return len(self.ranking)
+
+    def wechat_users(self):
+        return [
+            {
+                'username': username,
+                'openid': data['wechat_openid'],
+                'wechat_info': data.get('wechat_info', {})
+            }
+            for username, data in self.iter_users()
+            if data.get('wechat_openid')
+        ]
+
+
+class JsonUserStorage(UserStorage):
+    """整体重写 users.json
+
+    默认通过共享的延迟写入器合并写出；writer 为 None 时每次修改同步重写。
+    """
+
+    def __init__(self, users_file, writer=write_behind):
+        super().__init__()
+        self.users_file = users_file
+        self.writer = writer
+        if writer is not None:
+            writer.register(users_file, self._snapshot)
+
+    def _snapshot(self):
+        with self._lock:
+            # 在锁内序列化后再解析，保证写出的是某一时刻的完整数据
+            return json.loads(json.dumps(self.users, ensure_ascii=False))
+
+    def _load_users(self):
+        if os.path.exists(self.users_file):
+            with open(self.users_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {}
+
+    def save(self):
+        if self.writer is not None:
+            self.writer.flush(self.users_file, force=True)
+            return
+        with open(self.users_file, 'w', encoding='utf-8') as f:
+            json.dump(self.users, f, ensure_ascii=False, indent=2)
+
+    def _persist(self, entry):
+        if self.writer is not None:
+            self.writer.mark_dirty(self.users_file)
+        else:
+            self.save()
+
+
+class JournalUserStorage(UserStorage):
+    """追加日志 + 后台快照"""
+
+    def __init__(self, users_file):
+        super().__init__()
+        self.journal = UserJournal(users_file)
+
+    def _load_users(self):
+        return self.journal.load()
+
+    def save(self):
+        self.journal.write_snapshot(self.users)
+
+    def close(self):
+        self.journal.close()
+
+    def _persist(self, entry):
+        payload = {k: v for k, v in entry.items() if k not in ('op', 'username')}
+        self.journal.append(entry['op'], entry.get('username'), **payload)
+
+
+class SQLiteUserStorage(UserStorage):
+    """SQLite 存储：修改在事务中提交，排行榜/统计等走索引查询"""
+
+    COLUMNS = ('username', 'password_hash', 'created_at', 'health_score', 'is_admin',
+               'wechat_openid', 'wechat_info', 'updated_at')
+    JSON_COLUMNS = ('wechat_info',)
+
+    def __init__(self, db_file):
+        super().__init__()
+        self.db_file = db_file
+        # 多个 worker 进程共用同一个数据库时，写锁等待时间放宽到 30 秒
+        self.conn = sqlite3.connect(db_file, check_same_thread=False, timeout=30.0)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self._create_schema()
+        self._data_version = self._read_data_version()
+
+    def _create_schema(self):
+        with self._lock, self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    username TEXT PRIMARY KEY,
+                    password_hash TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    health_score NUMERIC NOT NULL DEFAULT 0,
+                    is_admin INTEGER NOT NULL DEFAULT 0,
+                    wechat_openid TEXT,
+                    wechat_info TEXT NOT NULL DEFAULT '{}',
+                    updated_at TEXT NOT NULL DEFAULT ''
+                )
+            ''')
+            columns = {row[1] for row in self.conn.execute('PRAGMA table_info(users)')}
+            if 'updated_at' not in columns:
+                self.conn.execute("ALTER TABLE users ADD COLUMN updated_at TEXT NOT NULL DEFAULT ''")
+                self.conn.execute('UPDATE users SET updated_at = created_at')
+            # is_admin 放在复合索引前缀，排行榜和按注册时间列出普通用户都能直接走索引
+            self.conn.execute(
+                'CREATE INDEX IF NOT EXISTS idx_users_admin_score ON users (is_admin, health_score DESC, username)'
+            )
+            # 注册时间索引带上用户名，(created_at, username) 分页无需再排序
+            self.conn.execute('DROP INDEX IF EXISTS idx_users_admin_created')
+            self.conn.execute(
+                'CREATE INDEX IF NOT EXISTS idx_users_admin_created_name ON users (is_admin, created_at, username)'
+            )
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_users_wechat ON users (wechat_openid)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_users_admin_updated ON users (is_admin, updated_at)')
+
+    def load(self):
+        # 数据保留在数据库中，不整体加载到内存
+        return None
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def extract_series(self, shard_store):
+        # 数据库记录不含时序数据
+        return 0
+
+    def _read_data_version(self):
+        with self._lock:
+            return self.conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def changed_by_others(self):
+        # data_version 只在其它连接提交后变化，本连接自己的写入不影响
+        version = self._read_data_version()
+        changed = version != self._data_version
+        self._data_version = version
+        return changed
+
+    def _row_to_record(self, row):
+        record = dict(zip(self.COLUMNS[1:], row[1:]))
+        record['is_admin'] = bool(record['is_admin'])
+        for column in self.JSON_COLUMNS:
+            record[column] = json.loads(record[column])
+        return record
+
+    def _record_to_row(self, username, record):
+        return (
+            username,
+            record['password_hash'],
+            record.get('created_at', ''),
+            record.get('health_score', 0),
+            1 if record.get('is_admin', False) else 0,
+            record.get('wechat_openid'),
+            json.dumps(record.get('wechat_info', {}), ensure_ascii=False),
+            record.get('updated_at', record.get('created_at', ''))
+        )
+
+    def import_users(self, users):
+        """在一个事务中批量导入用户字典（同名用户覆盖，用于迁移），返回导入数量"""
+        rows = [self._record_to_row(username, record) for username, record in users.items()]
+        placeholders = ', '.join('?' * len(self.COLUMNS))
+        with self._lock, self.conn:
+            self.conn.executemany(
+                f'INSERT OR REPLACE INTO users ({", ".join(self.COLUMNS)}) VALUES ({placeholders})',
+                rows
+            )
+        return len(rows)
+
+    # ---- 单用户操作 ----
+
+    def get(self, username):
+        with self._lock:
+            row = self.conn.execute(
+                f'SELECT {", ".join(self.COLUMNS)} FROM users WHERE username = ?', (username,)
+            ).fetchone()
+        return self._row_to_record(row) if row else None
+
+    def exists(self, username):
+        with self._lock:
+            row = self.conn.execute('SELECT 1 FROM users WHERE username = ?', (username,)).fetchone()
+        return row is not None
+
+    def add_user(self, username, record):
+        # 不用 OR REPLACE：两个 worker 同时注册同名用户时，后写入的一方失败而不是覆盖前者的密码哈希
+        row = self._record_to_row(username, record)
+        try:
+            with self._lock, self.conn:
+                self.conn.execute(
+                    f'INSERT INTO users ({", ".join(self.COLUMNS)}) VALUES ({", ".join("?" * len(self.COLUMNS))})', row
+                )
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def add_score(self, username, delta):
+        with self._lock, self.conn:
+            # 先取得写锁再读原分数，其它进程不能在读和写之间修改
+            self.conn.execute('BEGIN IMMEDIATE')
+            row = self.conn.execute('SELECT health_score FROM users WHERE username = ?', (username,)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                'UPDATE users SET health_score = health_score + ?, updated_at = ? WHERE username = ?',
+                (delta, datetime.datetime.now().isoformat(), username)
+            )
+            new_row = self.conn.execute('SELECT health_score FROM users WHERE username = ?', (username,)).fetchone()
+        return row[0], new_row[0]
+
+    def update_user(self, username, fields):
+        columns = [column for column in fields if column in self.COLUMNS[1:]]
+        if not columns:
+            return self.exists(username)
+        values = [
+            json.dumps(fields[column], ensure_ascii=False) if column in self.JSON_COLUMNS else fields[column]
+            for column in columns
+        ]
+        if 'updated_at' not in columns:
+            columns.append('updated_at')
+            values.append(datetime.datetime.now().isoformat())
+        assignments = ', '.join(f'{column} = ?' for column in columns)
+        with self._lock, self.conn:
+            cursor = self.conn.execute(f'UPDATE users SET {assignments} WHERE username = ?', (*values, username))
+        return cursor.rowcount > 0
+
+    def delete_user(self, username):
+        with self._lock, self.conn:
+            cursor = self.conn.execute('DELETE FROM users WHERE username = ?', (username,))
+        return cursor.rowcount > 0
+
+    def reset_scores(self):
+        with self._lock, self.conn:
+            self.conn.execute(
+                'UPDATE users SET health_score = 0, updated_at = ? WHERE is_admin = 0',
+                (datetime.datetime.now().isoformat(),)
+            )
+
+    def clear_data(self):
+        # 时序数据保存在用户分片中，这里只需清零分数
+        self.reset_scores()
+
+    # ---- 查询 ----
+
+    def iter_users(self, updated_since=None, batch_size=1000):
+        # 按 (created_at, username) 或 (updated_at, username) 分批读取，避免一次把全部用户取进内存
+        order_column = 'updated_at' if updated_since else 'created_at'
+        order_index = self.COLUMNS.index(order_column)
+        last_key = (updated_since or '', '')
+        while True:
+            with self._lock:
+                rows = self.conn.execute(
+                    f'SELECT {", ".join(self.COLUMNS)} FROM users '
+                    f'WHERE is_admin = 0 AND ({order_column}, username) > (?, ?) '
+                    f'ORDER BY {order_column}, username LIMIT ?', (*last_key, batch_size)
+                ).fetchall()
+            for row in rows:
+                yield row[0], self._row_to_record(row)
+            if len(rows) < batch_size:
+                return
+            last_key = (rows[-1][order_index], rows[-1][0])
+
+    def page_users(self, sort='score', after=None, limit=50, min_score=None, max_score=None, wechat=None):
+        if sort not in SORT_KEYS:
+            raise ValueError(f'未知的排序方式: {sort}')
+        # 按用户名排序时沿主键索引扫描；is_admin 加一元 + 避免规划器改走 is_admin 前缀索引再整体排序
+        conditions, params = ['+is_admin = 0' if sort == 'username' else 'is_admin = 0'], []
+        if min_score is not None:
+            conditions.append('health_score >= ?')
+            params.append(min_score)
+        if max_score is not None:
+            conditions.append('health_score <= ?')
+            params.append(max_score)
+        if wechat is not None:
+            # 同样不让该条件走 idx_users_wechat，始终沿排序索引扫描，取满一页即可停止
+            conditions.append('+wechat_openid IS NOT NULL' if wechat else '+wechat_openid IS NULL')
+        if after is not None:
+            if sort == 'score':
+                # 第一个条件给出索引扫描的起点，第二个处理同分时的用户名顺序
+                conditions.append('health_score <= ? AND (health_score < ? OR username > ?)')
+                params.extend([after[0], after[0], after[1]])
+            elif sort == 'created_at':
+                conditions.append('(created_at, username) > (?, ?)')
+                params.extend(after)
+            elif sort == '-created_at':
+                conditions.append('(created_at, username) < (?, ?)')
+                params.extend(after)
+            else:
+                conditions.append('username > ?')
+                params.append(after[0])
+        order = {
+            'score': 'health_score DESC, username',
+            'created_at': 'created_at, username',
+            '-created_at': 'created_at DESC, username DESC',
+            'username': 'username'
+        }[sort]
+        with self._lock:
+            rows = self.conn.execute(
+                f'SELECT {", ".join(self.COLUMNS)} FROM users WHERE {" AND ".join(conditions)} '
+                f'ORDER BY {order} LIMIT ?', (*params, limit)
+            ).fetchall()
+        return [(row[0], self._row_to_record(row)) for row in rows]
+
+    def leaderboard(self, limit):
+        with self._lock:
+            rows = self.conn.execute(
+                'SELECT username, health_score FROM users WHERE is_admin = 0 '
+                'ORDER BY health_score DESC, username LIMIT ?', (limit,)
+            ).fetchall()
+        return [tuple(row) for row in rows]
+
+    def rank(self, username):
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT health_score FROM users WHERE username = ? AND is_admin = 0', (username,)
+            ).fetchone()
+            if row is None:
+                return None
+            score = row[0]
+            ahead = self.conn.execute(
+                'SELECT COUNT(*) FROM users WHERE is_admin = 0 '
+                'AND (health_score > ? OR (health_score = ? AND username < ?))', (score, score, username)
+            ).fetchone()[0]
+        return ahead + 1, score
+
+    def count_ranked(self):
+        with self._lock:
+            return self.conn.execute('SELECT COUNT(*) FROM users WHERE is_admin = 0').fetchone()[0]
+
+    def wechat_users(self):
+        with self._lock:
+            rows = self.conn.execute(
+                'SELECT username, wechat_openid, wechat_info FROM users '
+                'WHERE wechat_openid IS NOT NULL AND is_admin = 0'
+            ).fetchall()
+        return [
+            {'username': username, 'openid': openid, 'wechat_info': json.loads(wechat_info)}
+            for username, openid, wechat_info in rows
+        ]
+
+
+def create_storage(storage_mode, users_file):
+    """根据存储模式创建用户存储"""
+    if storage_mode == 'json':
+        return JsonUserStorage(users_file)
+    if storage_mode == 'journal':
+        return JournalUserStorage(users_file)
+    if storage_mode == 'sqlite':
+        return SQLiteUserStorage(os.path.splitext(users_file)[0] + '.db')
+    raise ValueError(f'未知的存储模式: {storage_mode}')
+
+
+def default_series_dir(users_file):
+    """用户分片目录：与用户数据文件同目录下的 user_shards"""
+    return os.path.join(os.path.dirname(os.path.abspath(users_file)), 'user_shards')
+
+
+def migrate_json_to_sqlite(users_file, db_file=None):
+    """把 users.json（含未合并的日志）导入 SQLite 数据库，返回导入数量"""
+    users = UserJournal(users_file).load()
+    split_embedded_series(users, UserShardStore(default_series_dir(users_file)))
+    storage = SQLiteUserStorage(db_file or os.path.splitext(users_file)[0] + '.db')
+    try:
+        return storage.import_users(users)
+    finally:
+        storage.close()
@@ -5,39 +5,75 @@ document.addEventListener('DOMContentLoaded', function() {
     document.getElementById('clear-data-btn').addEventListener('click', clearAllData);
     document.getElementById('reset-leaderboard-btn').addEventListener('click', resetLeaderboard);
     document.getElementById('export-data-btn').addEventListener('click', exportData);
+    document.getElementById('filter-apply-btn').addEventListener('click', () => loadUsersList());
+    document.getElementById('load-more-btn').addEventListener('click', () => loadUsersList(true));
 });
 
-async function loadUsersList() {
+let usersCursor = null;
+
+function buildUsersQuery() {
+    const params = new URLSearchParams({
+        limit: 50,
+        sort: document.getElementById('filter-sort').value
+    });
+    if (document.getElementById('filter-online').checked) params.set('online', '1');
+    const device = document.getElementById('filter-device').value;
+    if (device) params.set('device', device);
+    const wechat = document.getElementById('filter-wechat').value;
+    if (wechat) params.set('wechat', wechat);
+    const minScore = document.getElementById('filter-min-score').value;
+    if (minScore) params.set('min_score', minScore);
+    const maxScore = document.getElementById('filter-max-score').value;
+    if (maxScore) params.set('max_score', maxScore);
+    if (usersCursor) params.set('cursor', usersCursor);
+    return params.toString();
+}
+
+function renderUserRow(user) {
+    const statusIcon = user.is_online ? '🟢' : '🔴';
+    const statusText = user.is_online ? '在线' : '离线';
+    const lastActive = user.last_active ? 
+        new Date(user.last_active).toLocaleString('zh-CN') : '从未登录';
+    const wechatStatus = user.wechat_openid ? 
+        `🐈 ${user.wechat_nickname || '已绑定'}` : '未绑定';
+    
+    return `
+        <tr class="${user.is_online ? 'user-online' : 'user-offline'}">
+            <td>${user.username}</td>
+            <td><span class="status-indicator">${statusIcon} ${statusText}</span></td>
+            <td>${user.health_score}</td>
+            <td>${user.ip_address || 'N/A'}</td>
+            <td>${user.device_type}</td>
+            <td>${wechatStatus}</td>
+            <td><small>${lastActive}</small></td>
+            <td><button onclick="deleteUser('${user.username}')" class="btn-small btn-danger">删除</button></td>
+        </tr>
+    `;
+}
+
+// append 为 true 时按游标加载下一页并追加到表格末尾
+async function loadUsersList(append = false) {
     try {
-        const response = await fetch('/admin/users');
+        if (!append) usersCursor = null;
+        const response = await fetch('/admin/users?' + buildUsersQuery());
         const data = await response.json();
+        if (!response.ok) {
+            document.getElementById('users-list').innerHTML = `<p>${data.message || '加载用户列表失败'}</p>`;
+            return;
+        }
         
-        let html = '<table class="users-table"><tr><th>用户名</th><th>状态</th><th>健康分数</th><th>IP地址</th><th>设备</th><th>微信</th><th>最后活动</th><th>操作</th></tr>';
-        
-        data.users.forEach(user => {
-            const statusIcon = user.is_online ? '🟢' : '🔴';
-            const statusText = user.is_online ? '在线' : '离线';
-            const lastActive = user.last_active ? 
-                new Date(user.last_active).toLocaleString('zh-CN') : '从未登录';
-            const wechatStatus = user.wechat_openid ? 
-                `🐈 ${user.wechat_nickname || '已绑定'}` : '未绑定';
-            
-            html += `
-                <tr class="${user.is_online ? 'user-online' : 'user-offline'}">
-                    <td>${user.username}</td>
-                    <td><span class="status-indicator">${statusIcon} ${statusText}</span></td>
-                    <td>${user.health_score}</td>
-                    <td>${user.ip_address || 'N/A'}</td>
-                    <td>${user.device_type}</td>
-                    <td>${wechatStatus}</td>
-                    <td><small>${lastActive}</small></td>
-                    <td><button onclick="deleteUser('${user.username}')" class="btn-small btn-danger">删除</button></td>
-                </tr>
-            `;
-        });
+        const rows = data.users.map(renderUserRow).join('');
+        const table = document.querySelector('#users-list .users-table tbody');
+        if (append && table) {
+            table.insertAdjacentHTML('beforeend', rows);
+        } else {
+            document.getElementById('users-list').innerHTML =
+                '<table class="users-table"><tbody><tr><th>用户名</th><th>状态</th><th>健康分数</th><th>IP地址</th><th>设备</th><th>微信</th><th>最后活动</th><th>操作</th></tr>' +
+                rows + '</tbody></table>';
+        }
         
-        html += '</table>';
-        document.getElementById('users-list').innerHTML = html;
+        usersCursor = data.next_cursor;
+        document.getElementById('load-more-btn').style.display = usersCursor ? 'inline-block' : 'none';
     } catch (error) {
         document.getElementById('users-list').innerHTML = '<p>加载用户列表失败</p>';
     }
@@ -48,18 +84,13 @@ async function loadSystemStats() {
         const response = await fetch('/admin/stats');
         const data = await response.json();
         
-        // 计算在线用户数
-        const usersResponse = await fetch('/admin/users');
-        const usersData = await usersResponse.json();
-        const onlineCount = usersData.users.filter(user => user.is_online).length;
-        
         document.getElementById('total-users').textContent = data.total_users;
-        document.getElementById('online-users').textContent = onlineCount;
+        document.getElementById('online-users').textContent = data.online_users;
         document.getElementById('active-users').textContent = data.active_users;
         document.getElementById('avg-score').textContent = data.avg_score.toFixed(1);
         
         // 统计微信绑定用户
-        const wechatUsers = usersData.users.filter(user => user.wechat_openid).length;
+        const wechatUsers = data.wechat_users;
         const bindRate = data.total_users > 0 ? ((wechatUsers / data.total_users) * 100).toFixed(1) : 0;
         
         document.getElementById('wechat-users').textContent = wechatUsers;
@@ -120,20 +151,13 @@ async function deleteUser(username) {
 
 async function exportData() {
     try {
-        const response = await fetch('/admin/export');
-        const data = await response.json();
-        
-        const blob = new Blob([JSON.stringify(data, null, 2)], {type: 'application/json'});
-        const url = URL.createObjectURL(blob);
-        
+        // 直接下载服务端的流式导出，不在页面内存中拼接整个数据集
         const a = document.createElement('a');
-        a.href = url;
-        a.download = `users_data_${new Date().toISOString().split('T')[0]}.json`;
+        a.href = '/admin/export?format=ndjson&gzip=1';
+        a.download = `users_data_${new Date().toISOString().split('T')[0]}.ndjson.gz`;
         a.click();
         
-        URL.revokeObjectURL(url);
-        
-        document.getElementById('export-result').innerHTML = '<p style="color: green;">数据导出成功</p>';
+        document.getElementById('export-result').innerHTML = '<p style="color: green;">数据导出已开始</p>';
     } catch (error) {
         document.getElementById('export-result').innerHTML = '<p style="color: red;">导出失败</p>';
     }
@@ -387,7 +387,7 @@ async function loadSleepPattern() {
     if (!currentUser) return;
     
     try {
-        const response = await fetch('/sleep-pattern');
+        const response = await fetch(`/sleep-pattern?user=${encodeURIComponent(currentUser)}`);
         const data = await response.json();
         
         let patternText = '';
@@ -523,11 +523,11 @@ async function loadLeaderboard() {
         const response = await fetch('/leaderboard');
         const data = await response.json();
         
-        // 过滤有分数的用户
-        const filteredLeaderboard = data.leaderboard.filter(([name, score]) => score > 0);
+        // 过滤有分数或积分的用户，每项为 [用户名, 健康分数, 积分]
+        const filteredLeaderboard = data.leaderboard.filter(([name, score, points]) => score > 0 || points > 0);
         
         let html = '<div class="leaderboard-grid">';
-        filteredLeaderboard.forEach(([name, score], index) => {
+        filteredLeaderboard.forEach(([name, score, points], index) => {
             const rank = index + 1;
             const rankIcon = rank === 1 ? '🏆' : rank === 2 ? '🥈' : rank === 3 ? '🥉' : `✨${rank}`;
             const scoreColor = score >= 8 ? '#4CAF50' : score >= 6 ? '#FFC107' : '#FF5722';
@@ -538,6 +538,7 @@ async function loadLeaderboard() {
                     <div class="rank">${rankIcon}</div>
                     <div class="user-info">
                         <div class="username">${name}</div>
+                        <div class="points">${points} 积分</div>
                     </div>
                     <div class="score">
                         <span class="score-value">${score.toFixed(1)}</span>
@@ -0,0 +1,61 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+from datetime import date
+
+# Add the parent directory to Python path
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, parent_dir)
+
+# 导入前指定数据目录，应用的数据都写入临时目录
+data_dir = tempfile.mkdtemp()
+os.environ['DATA_DIR'] = data_dir
+from api import app as app_module
+
+def tearDownModule():
+    app_module.chat_search_service.close()
+    app_module.chat_service.close()
+    app_module.user_service.storage.close()
+    shutil.rmtree(data_dir, ignore_errors=True)
+
+class TestSleepPatternRoute(unittest.TestCase):
+    def setUp(self):
+        self.client = app_module.app.test_client()
+    
+    def test_pattern_and_trends(self):
+        app_module.user_service.sleep_series.put("alice", date.today().isoformat(),
+                                                 {'sleep_hours': 7.5, 'bedtime': "23:00", 'quality_score': 8.0})
+        response = self.client.get('/sleep-pattern?user=alice')
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertIn('is_sleep_time', data['pattern'])
+        self.assertEqual(data['trends']['avg_sleep_hours'], 7.5)
+        self.assertIsNone(self.client.get('/sleep-pattern').get_json()['trends'])
+        # 数据未变化时客户端缓存仍有效
+        revalidated = self.client.get('/sleep-pattern?user=alice', headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(revalidated.status_code, 304)
+
+class TestRankRoute(unittest.TestCase):
+    def setUp(self):
+        self.client = app_module.app.test_client()
+        app_module.ranking_service.set_weights({'points': 0.1})
+    
+    def tearDown(self):
+        app_module.ranking_service.set_weights({'points': 0.0})
+    
+    def test_rank_matches_leaderboard(self):
+        for name in ("carol", "dave"):
+            app_module.user_service.register_user(name, "pw")
+        app_module.user_service.add_health_score("carol", 5)
+        app_module.incentive_service.add_points("dave", 100)
+        leaderboard = [row[0] for row in self.client.get('/leaderboard').get_json()['leaderboard']]
+        self.assertLess(leaderboard.index("dave"), leaderboard.index("carol"))
+        for name in ("carol", "dave"):
+            rank = self.client.get(f'/user/{name}/rank').get_json()
+            self.assertEqual(rank['rank'], leaderboard.index(name) + 1)
+        self.assertEqual(self.client.get('/user/nobody/rank').status_code, 404)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,11 @@ import unittest
 import sys
 import os
 import json
+import shutil
+import tempfile
+import datetime
+import time
+import threading
 
 # Add the parent directory to Python path
 parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -10,6 +15,17 @@ sys.path.insert(0, parent_dir)
 from services.sleep_service import SleepService
 from services.behavior_service import BehaviorService
 from services.incentive_service import IncentiveService
+from services.user_service import UserService
+from services.user_storage import JsonUserStorage
+from utils.password_hasher import PasswordHasher
+from utils.write_behind import WriteBehindWriter
+from utils.points_ledger import PointsLedger
+from utils.shared_state import SharedState
+from services.chat_service import ChatService, ChatHub
+from services.achievement_engine import AchievementEngine
+from services.ranking_service import RankingService, parse_weights
+from services.chat_search_service import ChatSearchService
+from utils.moderation import ModerationFilter
 
 class TestSleepService(unittest.TestCase):
     def setUp(self):
@@ -41,6 +57,8 @@ class TestIncentiveService(unittest.TestCase):
         self.incentive_service = IncentiveService("test_data")
     
     def tearDown(self):
+        # 写出并注销缓存文件，避免后台线程在目录删除后重新创建
+        self.incentive_service.close()
         # 清理测试数据
         import shutil
         if os.path.exists("test_data"):
@@ -80,5 +98,965 @@ class TestIncentiveService(unittest.TestCase):
         self.assertIn("test_badge1", badges)
         self.assertIn("test_badge2", badges)
 
+class TestIncentiveServiceCache(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.writer = WriteBehindWriter(interval=60)
+        self.incentive_service = IncentiveService(self.work_dir, writer=self.writer)
+    
+    def tearDown(self):
+        self.writer.stop()
+        shutil.rmtree(self.work_dir)
+    
+    def test_reads_served_from_memory(self):
+        self.incentive_service.add_points("alice", 10, "测试")
+        self.incentive_service.update_habit("alice", "早睡", 100)
+        for _ in range(100):
+            self.assertEqual(self.incentive_service.get_user_points("alice"), 60)
+            self.assertEqual(self.incentive_service.get_user_badges("alice"), ["habit_master"])
+            self.assertTrue(self.incentive_service.get_user_habits("alice")["早睡"]['completed'])
+        self.assertEqual(self.incentive_service.points.load_count, 1)
+        # 修改在后台合并写出，尚未落盘
+        self.assertFalse(os.path.exists(self.incentive_service.points_file))
+        
+        self.incentive_service.flush()
+        with open(self.incentive_service.points_file, 'r', encoding='utf-8') as f:
+            self.assertEqual(json.load(f), {"alice": 60})
+        # 自己写出的文件不会触发重新加载
+        self.incentive_service.points.check_interval = 0
+        self.incentive_service.get_user_points("alice")
+        self.assertEqual(self.incentive_service.points.load_count, 1)
+    
+    def test_deleted_user_forgotten(self):
+        user_service = UserService(os.path.join(self.work_dir, 'users.json'), storage_mode='json',
+                                   hasher=PasswordHasher(method='pbkdf2:sha256:1000', workers=0))
+        user_service.listeners.append(self.incentive_service)
+        user_service.register_user("alice", "pw")
+        self.incentive_service.add_points("alice", 10, "测试")
+        self.incentive_service.add_points("bob", 5, "测试")
+        self.incentive_service.award_badge("alice", "early_bird")
+        
+        self.assertTrue(user_service.delete_user("alice"))
+        self.assertEqual(self.incentive_service.get_user_points("alice"), 0)
+        self.assertEqual(self.incentive_service.get_user_badges("alice"), [])
+        self.assertEqual(self.incentive_service.get_points_history("alice"), [])
+        self.assertEqual(self.incentive_service.get_user_points("bob"), 5)
+        self.incentive_service.ledger.close()
+        self.assertEqual(PointsLedger(self.incentive_service.ledger.base_dir).count("alice"), 0)
+    
+    def test_external_change_reloaded(self):
+        self.incentive_service.add_points("alice", 10)
+        self.incentive_service.flush()
+        with open(self.incentive_service.points_file, 'w', encoding='utf-8') as f:
+            json.dump({"alice": 99}, f)
+        os.utime(self.incentive_service.points_file, ns=(1, 1))
+        self.incentive_service.points.check_interval = 0
+        self.assertEqual(self.incentive_service.get_user_points("alice"), 99)
+    
+    def test_points_history(self):
+        for i in range(5):
+            self.incentive_service.add_points("alice", i + 1, f"第{i}次")
+        history = self.incentive_service.get_points_history("alice", 2)
+        self.assertEqual([entry['points'] for entry in history], [4, 5])
+        self.assertEqual(self.incentive_service.sum_points("alice"), 15)
+        self.assertEqual(self.incentive_service.sum_points("alice", end="2000-01-01"), 0)
+    
+    def test_legacy_history_migrated(self):
+        self.incentive_service.close()
+        legacy = [{"timestamp": "2024-01-02T00:00:00", "points": 10, "reason": "睡眠分析完成"},
+                  {"timestamp": "2024-01-01T00:00:00", "points": 5, "reason": "睡眠分析完成"}]
+        legacy_file = os.path.join(self.work_dir, 'points_history_bob.json')
+        with open(legacy_file, 'w', encoding='utf-8') as f:
+            json.dump(legacy, f)
+        service = IncentiveService(self.work_dir, writer=self.writer)
+        self.assertFalse(os.path.exists(legacy_file))
+        self.assertEqual([entry['points'] for entry in service.get_points_history("bob")], [5, 10])
+        self.assertEqual(service.sum_points("bob", "2024-01-02"), 10)
+        service.close()
+    
+    def test_weekly_analyzer_streak(self):
+        today = datetime.date.today()
+        for offset in range(6, 0, -1):
+            day = today - datetime.timedelta(days=offset)
+            self.incentive_service.ledger.append("alice", 10, "睡眠分析完成", f"{day.isoformat()}T22:00:00",
+                                                 "analyze_sleep")
+        self.assertEqual(self.incentive_service.check_achievements("alice", "analyze_sleep", {}), [])
+        self.assertTrue(self.incentive_service.record_activity("alice", "analyze_sleep"))
+        self.assertEqual(self.incentive_service.check_achievements("alice", "analyze_sleep", {}),
+                         ["weekly_analyzer"])
+        streaks = self.incentive_service.get_streaks("alice")
+        self.assertEqual(streaks["analyze_sleep"]["current"], 7)
+        # 行为只计入连续天数，不奖励积分；同一天重复提交不再写入账本
+        self.assertFalse(self.incentive_service.record_activity("alice", "analyze_sleep"))
+        self.assertEqual(self.incentive_service.get_user_points("alice"), 0)
+        self.assertEqual(self.incentive_service.ledger.count("alice"), 7)
+    
+    def test_concurrent_activity_recorded_once(self):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            self.incentive_service.record_activity("alice", "analyze_sleep"))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results.count(True), 1)
+        self.assertEqual(self.incentive_service.ledger.count("alice"), 1)
+        self.assertEqual(self.incentive_service.get_streaks("alice")["analyze_sleep"]["current"], 1)
+    
+    def test_unregistered_user_not_recorded(self):
+        self.incentive_service.user_exists = lambda user_id: user_id == "alice"
+        self.assertFalse(self.incentive_service.record_activity("mallory", "analyze_sleep"))
+        self.assertEqual(self.incentive_service.ledger.count("mallory"), 0)
+        self.assertEqual(self.incentive_service.check_achievements("mallory", "analyze_sleep", {}), [])
+        self.assertTrue(self.incentive_service.record_activity("alice", "analyze_sleep"))
+    
+    def test_bulk_award(self):
+        self.incentive_service.award_badge("bob", "early_bird")
+        results = self.incentive_service.bulk_award([
+            {"user_id": "alice", "points": 20, "reason": "活动奖励"},
+            {"user_id": "bob", "points": 5, "badge": "early_bird"},
+            {"user_id": "carol", "habit": "早睡", "progress": 100},
+            {"user_id": "alice", "points": "many"},
+            {"user_id": "dave"},
+            {"user_id": "alice", "points": -3, "reason": "扣除"},
+        ])
+        self.assertEqual([r['success'] for r in results], [True, True, True, False, False, True])
+        self.assertEqual(results[1]['badge_awarded'], False)
+        self.assertTrue(results[2]['habit_completed'])
+        self.assertEqual(results[2]['points'], 50)
+        self.assertEqual(results[5]['points'], 17)
+        self.assertIn('error', results[3])
+        
+        self.assertEqual(self.incentive_service.get_user_points("alice"), 17)
+        self.assertEqual(self.incentive_service.get_user_badges("carol"), ["habit_master"])
+        self.assertEqual(self.incentive_service.get_user_badges("bob"), ["early_bird"])
+        self.assertEqual([e['points'] for e in self.incentive_service.get_points_history("alice")], [20, -3])
+        self.assertEqual(self.incentive_service.get_points_history("carol")[0]['reason'], "完成习惯: 早睡")
+
+class TestAchievementEngine(unittest.TestCase):
+    def setUp(self):
+        self.fact_calls = []
+        
+        def streak(user_id, event, data):
+            self.fact_calls.append(event)
+            return 10
+        
+        rules = [
+            {'badge': 'weekly', 'event': 'analyze_sleep', 'when': [['streak', '>=', 7]]},
+            {'badge': 'monthly', 'event': 'analyze_sleep', 'when': [['streak', '>=', 30]]},
+            {'badge': 'healthy', 'event': ['analyze_behavior', 'analyze_sleep'],
+             'when': [['score', '>=', 90], ['streak', '>', 0]]},
+        ] + [{'badge': f'other{i}', 'event': f'other_event{i}', 'when': [['score', '>', i]]} for i in range(100)]
+        self.engine = AchievementEngine(rules, facts={'streak': streak})
+    
+    def test_dispatch(self):
+        self.assertEqual(self.engine.evaluate('alice', 'analyze_sleep', {'score': 95}), ['weekly', 'healthy'])
+        # 事实在一次评估中只计算一次
+        self.assertEqual(self.fact_calls, ['analyze_sleep'])
+        self.assertEqual(self.engine.evaluate('alice', 'analyze_sleep', {'score': 50}, owned=['weekly']), [])
+        self.assertEqual(self.engine.evaluate('alice', 'analyze_behavior', {}), [])
+        self.assertEqual(self.engine.evaluate('alice', 'unknown', {'score': 1000}), [])
+        
+        stats = self.engine.stats()
+        self.assertEqual(stats['analyze_sleep']['evaluations'], 2)
+        self.assertEqual(stats['analyze_sleep']['rules'], 3)
+        self.assertEqual(stats['analyze_sleep']['avg_rules_checked'], 2.5)
+        self.assertEqual(stats['unknown']['rules'], 0)
+    
+    def test_invalid_rule(self):
+        with self.assertRaises(ValueError):
+            AchievementEngine([{'badge': 'x', 'event': 'e', 'when': [['score', '=~', 1]]}])
+        with self.assertRaises(ValueError):
+            AchievementEngine([{'event': 'e', 'when': []}])
+    
+    def test_service_rules(self):
+        work_dir = tempfile.mkdtemp()
+        writer = WriteBehindWriter(interval=60)
+        try:
+            service = IncentiveService(work_dir, writer=writer, rules=[
+                {'badge': 'rich', 'event': 'habit_update', 'when': [['total_points', '>=', 100]]},
+                {'badge': 'habit_master', 'event': 'habit_update', 'when': [['completed', '==', True]]}
+            ])
+            service.add_points("alice", 60)
+            service.update_habit("alice", "早睡", 50)
+            self.assertEqual(service.get_user_badges("alice"), [])
+            service.update_habit("alice", "早睡", 100)
+            self.assertEqual(sorted(service.get_user_badges("alice")), ["habit_master", "rich"])
+            results = service.bulk_award([{"user_id": "bob", "habit": "早起", "progress": 100}])
+            self.assertEqual(service.get_user_badges("bob"), ["habit_master"])
+            self.assertEqual(results[0]['points'], 50)
+            service.close()
+        finally:
+            writer.stop()
+            shutil.rmtree(work_dir)
+
+class TestRankingService(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.writer = WriteBehindWriter(interval=60)
+        self.user_service = UserService(os.path.join(self.work_dir, 'users.json'), storage_mode='journal')
+        self.incentive_service = IncentiveService(os.path.join(self.work_dir, 'data'), writer=self.writer)
+        for name in ("admin", "alice", "bob"):
+            self.user_service.register_user(name, "pw")
+        self.user_service.add_health_score("alice", 8)
+        self.incentive_service.add_points("bob", 100)
+        self.ranking = RankingService(self.user_service, self.incentive_service,
+                                      weights=parse_weights("health=1,points=0.1"))
+    
+    def tearDown(self):
+        self.incentive_service.close()
+        self.writer.stop()
+        self.user_service.storage.close()
+        shutil.rmtree(self.work_dir)
+    
+    def test_incremental_updates(self):
+        self.assertEqual(self.ranking.top(), [("bob", 0, 100), ("alice", 8, 0)])
+        
+        self.user_service.add_health_score("alice", 5)
+        self.assertEqual(self.ranking.top(1), [("alice", 13, 0)])
+        self.incentive_service.add_points("alice", 10)
+        self.incentive_service.bulk_award([{"user_id": "bob", "points": 50}, {"user_id": "admin", "points": 999}])
+        self.assertEqual(self.ranking.top(), [("bob", 0, 150), ("alice", 13, 10)])
+        self.assertEqual(self.ranking.rank("alice")['score'], 14)
+        self.assertIsNone(self.ranking.rank("admin"))
+        
+        self.user_service.register_user("carol", "pw")
+        self.user_service.add_health_score("carol", 20)
+        self.assertEqual(self.ranking.rank("carol")['rank'], 1)
+        self.user_service.delete_user("carol")
+        self.assertIsNone(self.ranking.rank("carol"))
+        
+        self.user_service.reset_all_scores()
+        self.assertEqual(self.ranking.top(), [("bob", 0, 150), ("alice", 0, 10)])
+        
+        # 增量维护的结果与重建一致
+        expected = self.ranking.top()
+        self.ranking.rebuild()
+        self.assertEqual(self.ranking.top(), expected)
+    
+    def test_version_changes_with_ranking(self):
+        version = self.ranking.version()
+        self.user_service.add_health_score("admin", 5)
+        self.incentive_service.add_points("nobody", 10)  # 不参与排名的用户
+        self.assertEqual(self.ranking.version(), version)
+        self.user_service.add_health_score("alice", 1)
+        self.assertGreater(self.ranking.version(), version)
+        version = self.ranking.version()
+        self.ranking.set_weights({'points': 0.0})
+        self.assertGreater(self.ranking.version(), version)
+    
+    def test_updates_during_rebuild_kept(self):
+        iter_users = self.user_service.iter_users
+        
+        def iter_users_with_update(*args):
+            # 积分已经读取完，扫描用户期间 bob 又获得积分
+            self.incentive_service.add_points("bob", 7)
+            return iter_users(*args)
+        
+        self.user_service.iter_users = iter_users_with_update
+        self.ranking.rebuild()
+        self.assertEqual(self.ranking.rank("bob")['points'], 107)
+    
+    def test_single_background_rebuild(self):
+        started = []
+        self.ranking.rebuild = lambda: started.append(True)
+        self.ranking.rebuild_interval = 30
+        self.ranking._built_at = 0.0
+        for _ in range(5):
+            self.ranking.top()
+        time.sleep(0.1)
+        self.assertEqual(len(started), 1)
+    
+    def test_default_weights_share_storage_index(self):
+        ranking = RankingService(self.user_service, self.incentive_service)
+        self.assertIsNone(ranking.ranking)  # 直接读取用户存储的跳表
+        self.assertEqual(ranking.top(), [("alice", 8, 0), ("bob", 0, 100)])
+        self.user_service.add_health_score("bob", 10)
+        self.assertEqual(ranking.rank("bob"), {'username': "bob", 'rank': 1, 'score': 10, 'health_score': 10,
+                                               'points': 100, 'total': 2})
+        self.assertIsNone(ranking.rank("admin"))
+        ranking.set_weights({'points': 0.1})
+        self.assertIsNotNone(ranking.ranking)
+        self.assertEqual(ranking.rank("bob")['score'], 20)
+    
+    def test_weights(self):
+        self.ranking.set_weights({'points': 0.0})
+        self.assertEqual(self.ranking.top(), [("alice", 8, 0), ("bob", 0, 100)])
+        with self.assertRaises(ValueError):
+            parse_weights("karma=1")
+        self.assertIsNone(parse_weights(""))
+
+def check_pagination(test, user_service):
+    """按各种排序和条件逐页读取，结果应与全量排序后过滤一致"""
+    for i in range(23):
+        user_service.storage.add_user(f"user{i:02d}", {
+            'password_hash': 'x',
+            'created_at': f"2024-01-{i % 7 + 1:02d}T00:00:00",
+            'health_score': i % 5,
+            'is_admin': False,
+            'wechat_openid': f"openid{i}" if i % 3 == 0 else None,
+            'wechat_info': {}
+        })
+    everyone = {username: data for username, data in user_service.iter_users()}
+    expected_orders = {
+        'score': sorted(everyone, key=lambda u: (-everyone[u]['health_score'], u)),
+        'created_at': sorted(everyone, key=lambda u: (everyone[u]['created_at'], u)),
+        '-created_at': sorted(everyone, key=lambda u: (everyone[u]['created_at'], u), reverse=True),
+        'username': sorted(everyone)
+    }
+    candidates = {f"user{i:02d}" for i in range(0, 23, 2)}
+    for sort, order in expected_orders.items():
+        for filters in ({}, {'min_score': 1, 'max_score': 3}, {'wechat': True}, {'only': candidates}):
+            expected = [u for u in order
+                        if everyone[u]['health_score'] >= filters.get('min_score', 0)
+                        and everyone[u]['health_score'] <= filters.get('max_score', 99)
+                        and ('wechat' not in filters or bool(everyone[u]['wechat_openid']))
+                        and u in filters.get('only', everyone)]
+            seen, cursor = [], None
+            while True:
+                page, cursor = user_service.page_users(sort=sort, cursor=cursor, limit=4, **filters)
+                seen.extend(username for username, _ in page)
+                test.assertTrue(all('password_hash' not in data for _, data in page))
+                if cursor is None:
+                    break
+            test.assertEqual(seen, expected, (sort, filters))
+    with test.assertRaises(ValueError):
+        user_service.page_users(sort='password')
+    with test.assertRaises(ValueError):
+        user_service.page_users(cursor='not-a-cursor')
+
+class TestUserServiceJournal(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.users_file = os.path.join(self.work_dir, 'users.json')
+        self.user_service = UserService(self.users_file, storage_mode='journal')
+    
+    def tearDown(self):
+        self.user_service.storage.close()
+        shutil.rmtree(self.work_dir)
+    
+    def test_replay_journal(self):
+        self.user_service.register_user("alice", "pw")
+        self.user_service.register_user("bob", "pw")
+        self.user_service.add_health_score("alice", 8)
+        self.user_service.add_health_score("alice", 2)
+        self.user_service.bind_wechat("alice", "openid_1", {'nickname': 'A'})
+        self.user_service.delete_user("bob")
+        
+        # 未写快照，重启后应从日志恢复
+        self.assertFalse(os.path.exists(self.users_file))
+        reloaded = UserService(self.users_file, storage_mode='journal')
+        self.assertEqual(reloaded.get_user_info("alice")['health_score'], 10)
+        self.assertEqual(reloaded.get_user_info("alice")['wechat_openid'], "openid_1")
+        self.assertIsNone(reloaded.get_user_info("bob"))
+    
+    def test_leaderboard_index(self):
+        for name in ("admin", "alice", "bob", "carol"):
+            self.user_service.register_user(name, "pw")
+        self.user_service.add_health_score("admin", 100)
+        self.user_service.add_health_score("alice", 8)
+        self.user_service.add_health_score("bob", 9)
+        
+        self.assertEqual(self.user_service.get_leaderboard(2), [("bob", 9), ("alice", 8)])
+        rank_info = self.user_service.get_user_rank("alice")
+        self.assertEqual((rank_info['rank'], rank_info['total']), (2, 3))
+        
+        self.user_service.delete_user("bob")
+        self.assertEqual(self.user_service.get_user_rank("alice")['rank'], 1)
+        self.user_service.reset_all_scores()
+        self.assertEqual(self.user_service.get_leaderboard(), [("alice", 0), ("carol", 0)])
+        self.assertIsNone(self.user_service.get_user_rank("admin"))
+    
+    def test_concurrent_score_updates(self):
+        storage = self.user_service.storage
+        names = [f"user{i}" for i in range(20)]
+        for name in names:
+            storage.add_user(name, {'password_hash': 'x', 'created_at': '2024-01-01', 'health_score': 0})
+        
+        def worker():
+            for i in range(500):
+                storage.add_score(names[i % len(names)], 1)
+        
+        # 缩短线程切换间隔，让各线程的修改充分交错
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            threads = [threading.Thread(target=worker) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(interval)
+        
+        top = storage.leaderboard(100)
+        self.assertEqual(len(storage.ranking), len(names))
+        self.assertEqual(sorted(name for name, _ in top), sorted(names))
+        self.assertEqual({score for _, score in top}, {200})
+    
+    def test_json_snapshot_during_updates(self):
+        writer = WriteBehindWriter(interval=60)
+        users_file = os.path.join(self.work_dir, 'json_users.json')
+        storage = JsonUserStorage(users_file, writer=writer)
+        storage.load()
+        
+        def worker(prefix):
+            for i in range(300):
+                storage.add_user(f"{prefix}{i}", {'password_hash': 'x', 'created_at': '2024-01-01', 'health_score': 0})
+                storage.add_score(f"{prefix}{i}", 1)
+        
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            threads = [threading.Thread(target=worker, args=(prefix,)) for prefix in "abcd"]
+            for thread in threads:
+                thread.start()
+            # 写入器在修改进行中反复取快照，快照在存储的锁内复制，不会因字典变化而失败
+            while any(thread.is_alive() for thread in threads):
+                writer.flush(users_file, force=True)
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(interval)
+        writer.stop()
+        with open(users_file, 'r', encoding='utf-8') as f:
+            self.assertEqual(json.load(f), storage.users)
+    
+    def test_aggregates(self):
+        for name in ("admin", "alice", "bob", "carol"):
+            self.user_service.register_user(name, "pw")
+        self.user_service.add_health_score("admin", 100)
+        self.user_service.add_health_score("alice", 8)
+        self.user_service.add_health_score("bob", 25)
+        self.user_service.bind_wechat("bob", "openid_b", {})
+        
+        stats = self.user_service.get_system_stats()
+        self.assertEqual((stats['total_users'], stats['active_users'], stats['wechat_users']), (3, 2, 1))
+        self.assertAlmostEqual(stats['avg_score'], 11)
+        self.assertEqual(stats['score_histogram'], {0: 2, 20: 1})
+        self.assertEqual(sum(stats['registrations_per_day'].values()), 3)
+        
+        self.user_service.delete_user("bob")
+        stats = self.user_service.get_system_stats()
+        self.assertEqual((stats['total_users'], stats['active_users'], stats['wechat_users']), (2, 1, 0))
+        
+        self.user_service.reset_all_scores()
+        stats = self.user_service.get_system_stats()
+        self.assertEqual((stats['active_users'], stats['avg_score']), (0, 0))
+        self.assertEqual(stats['score_histogram'], {0: 2})
+        
+        # 重启后重新统计的结果应一致
+        self.user_service.add_health_score("carol", 3)
+        reloaded = UserService(self.users_file, storage_mode='journal')
+        self.assertEqual(reloaded.get_system_stats(), self.user_service.get_system_stats())
+    
+    def test_aggregates_exact_old_score(self):
+        self.user_service.register_user("alice", "pw")
+        self.user_service.add_health_score("alice", 120.0)
+        # 129.2 - 9.2 == 119.99999999999999，按原分数更新分段才不会落入 110
+        self.user_service.add_health_score("alice", 9.2)
+        self.assertEqual(self.user_service.get_system_stats()['score_histogram'], {120: 1})
+    
+    def test_series_sharded(self):
+        self.user_service.register_user("alice", "pw")
+        self.user_service.register_user("bob", "pw")
+        self.user_service.record_user_series("alice", 'sleep_data', '2024-01-01', {'sleep_hours': 8})
+        self.user_service.record_user_series("bob", 'sleep_data', '2024-01-01', {'sleep_hours': 6})
+        
+        self.assertNotIn('sleep_data', self.user_service.get_user_info("alice"))
+        self.assertEqual(self.user_service.get_user_series("alice", 'sleep_data'),
+                         {'2024-01-01': {'sleep_hours': 8}})
+        
+        self.user_service.delete_user("bob")
+        self.assertEqual(self.user_service.get_user_series("bob", 'sleep_data'), {})
+        self.user_service.clear_all_data()
+        self.assertEqual(self.user_service.get_user_series("alice", 'sleep_data'), {})
+    
+    def test_migrate_embedded_series(self):
+        self.user_service.storage.close()
+        with open(self.users_file, 'w', encoding='utf-8') as f:
+            json.dump({"alice": {
+                'password_hash': 'x', 'created_at': '', 'health_score': 3, 'is_admin': False,
+                'sleep_data': {'2024-01-01': {'sleep_hours': 7}}, 'behavior_data': {}
+            }}, f)
+        
+        self.user_service = UserService(self.users_file, storage_mode='journal')
+        self.assertEqual(self.user_service.get_user_series("alice", 'sleep_data'),
+                         {'2024-01-01': {'sleep_hours': 7}})
+        with open(self.users_file, 'r', encoding='utf-8') as f:
+            self.assertNotIn('sleep_data', json.load(f)["alice"])
+    
+    def test_compaction(self):
+        self.user_service.register_user("alice", "pw")
+        self.user_service.add_health_score("alice", 5)
+        self.user_service.storage.journal.compact(wait=True)
+        self.user_service.add_health_score("alice", 1)
+        
+        with open(self.users_file, 'r', encoding='utf-8') as f:
+            snapshot = json.load(f)
+        self.assertEqual(snapshot["alice"]['health_score'], 5)
+        
+        reloaded = UserService(self.users_file, storage_mode='journal')
+        self.assertEqual(reloaded.get_user_info("alice")['health_score'], 6)
+    
+    def test_export_updated_since(self):
+        for name in ("alice", "bob"):
+            self.user_service.register_user(name, "pw")
+        self.user_service.record_user_series("alice", 'sleep_data', '2024-01-01', {'sleep_hours': 8})
+        since = datetime.datetime.now().isoformat()
+        self.user_service.add_health_score("alice", 5)
+        
+        self.assertEqual([r['username'] for r in self.user_service.iter_export()], ["alice", "bob"])
+        exported = list(self.user_service.iter_export(since))
+        self.assertEqual(len(exported), 1)
+        self.assertEqual(exported[0]['health_score'], 5)
+        self.assertEqual(exported[0]['sleep_data'], {'2024-01-01': {'sleep_hours': 8}})
+        self.assertGreaterEqual(exported[0]['updated_at'], since)
+    
+    def test_pagination(self):
+        check_pagination(self, self.user_service)
+    
+    def test_truncated_tail_ignored(self):
+        self.user_service.register_user("alice", "pw")
+        self.user_service.add_health_score("alice", 3)
+        self.user_service.storage.close()
+        with open(self.user_service.storage.journal.journal_file, 'a', encoding='utf-8') as f:
+            f.write('{"op": "score", "username": "ali')
+        
+        reloaded = UserService(self.users_file, storage_mode='journal')
+        reloaded.add_health_score("alice", 1)
+        reloaded.storage.close()
+        reloaded = UserService(self.users_file, storage_mode='journal')
+        self.assertEqual(reloaded.get_user_info("alice")['health_score'], 4)
+
+class TestUserServicePasswordHashing(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.users_file = os.path.join(self.work_dir, 'users.json')
+    
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+    
+    def make_service(self, hasher):
+        return UserService(self.users_file, storage_mode='json', hasher=hasher)
+    
+    def test_rehash_on_login(self):
+        old_hasher = PasswordHasher(method='pbkdf2:sha256:1000', workers=0)
+        old_service = self.make_service(old_hasher)
+        old_service.register_user("alice", "pw")
+        old_service.save_users()
+        
+        new_hasher = PasswordHasher(method='pbkdf2:sha256:2000', workers=0)
+        user_service = self.make_service(new_hasher)
+        self.assertTrue(user_service.storage.get("alice")['password_hash'].startswith('pbkdf2:sha256:1000$'))
+        self.assertFalse(user_service.login_user("alice", "wrong")['success'])
+        self.assertTrue(user_service.login_user("alice", "pw")['success'])
+        self.assertTrue(user_service.storage.get("alice")['password_hash'].startswith('pbkdf2:sha256:2000$'))
+        self.assertTrue(user_service.login_user("alice", "pw")['success'])
+    
+    def test_reject_when_saturated(self):
+        hasher = PasswordHasher(method='pbkdf2:sha256:1000', workers=0, max_pending=1)
+        user_service = self.make_service(hasher)
+        user_service.register_user("alice", "pw")
+        
+        hasher._slots.acquire()
+        try:
+            result = user_service.login_user("alice", "pw")
+        finally:
+            hasher._slots.release()
+        self.assertTrue(result['busy'])
+        self.assertEqual(hasher.rejected_count, 1)
+        self.assertTrue(user_service.login_user("alice", "pw")['success'])
+    
+    def test_short_method_not_rehashed(self):
+        hasher = PasswordHasher(method='pbkdf2', workers=0)
+        self.assertFalse(hasher.needs_rehash(hasher.hash("pw")))
+        self.assertTrue(hasher.needs_rehash(PasswordHasher(method='pbkdf2:sha256:1000', workers=0).hash("pw")))
+    
+    def test_rehash_skipped_when_busy(self):
+        old_service = self.make_service(PasswordHasher(method='pbkdf2:sha256:1000', workers=0))
+        old_service.register_user("alice", "pw")
+        old_service.save_users()
+        
+        hasher = PasswordHasher(method='pbkdf2:sha256:2000', workers=0, max_pending=1)
+        user_service = self.make_service(hasher)
+        verify = hasher.verify
+        
+        def verify_then_fill(password_hash, password):
+            result = verify(password_hash, password)
+            hasher._slots.acquire()  # 校验完成后队列被其它请求占满
+            return result
+        
+        hasher.verify = verify_then_fill
+        try:
+            result = user_service.login_user("alice", "pw")
+        finally:
+            hasher._slots.release()
+        self.assertTrue(result['success'])
+        self.assertTrue(user_service.storage.get("alice")['password_hash'].startswith('pbkdf2:sha256:1000$'))
+    
+    def test_process_pool(self):
+        hasher = PasswordHasher(method='pbkdf2:sha256:1000', workers=2)
+        try:
+            password_hash = hasher.hash("pw")
+            self.assertTrue(hasher.verify(password_hash, "pw"))
+            self.assertFalse(hasher.verify(password_hash, "other"))
+        finally:
+            hasher.shutdown()
+    
+    def test_default_hasher_created_lazily(self):
+        from utils.password_hasher import get_password_hasher
+        self.assertIs(get_password_hasher(), get_password_hasher())
+        created = PasswordHasher(method='pbkdf2:sha256:1000')
+        # 创建时不启动进程池也不计算哈希，前缀在第一次比较时才算出
+        self.assertIsNone(created._executor)
+        self.assertIsNone(created._prefix)
+
+class TestUserServiceSQLite(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.users_file = os.path.join(self.work_dir, 'users.json')
+        self.user_service = UserService(self.users_file, storage_mode='sqlite')
+    
+    def tearDown(self):
+        self.user_service.storage.close()
+        shutil.rmtree(self.work_dir)
+    
+    def test_queries(self):
+        for name in ("admin", "alice", "bob", "carol"):
+            self.user_service.register_user(name, "pw")
+        self.user_service.add_health_score("admin", 100)
+        self.user_service.add_health_score("alice", 8)
+        self.user_service.add_health_score("bob", 9.5)
+        self.user_service.bind_wechat("bob", "openid_b", {'nickname': 'B'})
+        
+        self.assertTrue(self.user_service.login_user("alice", "pw")['success'])
+        self.assertEqual(self.user_service.get_leaderboard(2), [("bob", 9.5), ("alice", 8)])
+        self.assertEqual(self.user_service.storage.add_score("carol", 0.5), (0, 0.5))
+        self.assertIsNone(self.user_service.storage.add_score("nobody", 1))
+        self.assertEqual(self.user_service.get_wechat_users(),
+                         [{'username': "bob", 'openid': "openid_b", 'wechat_info': {'nickname': 'B'}}])
+        stats = self.user_service.get_system_stats()
+        self.assertEqual(stats['total_users'], 3)
+        self.assertEqual(stats['active_users'], 2)
+        
+        self.assertEqual(self.user_service.get_user_rank("alice")['rank'], 2)
+        self.assertIsNone(self.user_service.get_user_rank("admin"))
+        
+        self.assertTrue(self.user_service.delete_user("carol"))
+        self.assertFalse(self.user_service.delete_user("admin"))
+        self.assertEqual([name for name, _ in self.user_service.iter_users()], ["alice", "bob"])
+    
+    def test_updated_since(self):
+        for name in ("alice", "bob", "carol"):
+            self.user_service.register_user(name, "pw")
+        since = datetime.datetime.now().isoformat()
+        self.user_service.add_health_score("carol", 3)
+        self.user_service.bind_wechat("alice", "openid_a", {})
+        
+        self.assertEqual([name for name, _ in self.user_service.iter_users(since)], ["carol", "alice"])
+        self.assertEqual(len(list(self.user_service.iter_users())), 3)
+    
+    def test_pagination(self):
+        check_pagination(self, self.user_service)
+    
+    def test_stats_follow_other_workers(self):
+        self.user_service.register_user("alice", "pw")
+        other_worker = UserService(self.users_file, storage_mode='sqlite')
+        try:
+            other_worker.register_user("bob", "pw")
+            other_worker.add_health_score("bob", 4)
+        finally:
+            other_worker.storage.close()
+        
+        # 发现其它 worker 的修改后在后台重建
+        self.user_service.stats_interval = 0
+        self.user_service.get_system_stats()
+        thread = self.user_service._stats_thread
+        if thread is not None:
+            thread.join()
+        stats = self.user_service.get_system_stats()
+        self.assertEqual((stats['total_users'], stats['active_users']), (2, 1))
+        self.assertIsNone(self.user_service._stats_thread)
+    
+    def test_concurrent_register_does_not_overwrite(self):
+        self.user_service.register_user("alice", "first")
+        other_worker = UserService(self.users_file, storage_mode='sqlite')
+        try:
+            # 另一个 worker 在 alice 注册前做了存在性检查
+            other_worker.storage.exists = lambda username: False
+            result = other_worker.register_user("alice", "second")
+        finally:
+            other_worker.storage.close()
+        self.assertEqual(result, {'success': False, 'message': '用户已存在'})
+        self.assertTrue(self.user_service.login_user("alice", "first")['success'])
+        self.assertEqual(self.user_service.get_system_stats()['total_users'], 1)
+    
+    def test_migrate_from_json(self):
+        from services.user_storage import migrate_json_to_sqlite
+        json_service = UserService(os.path.join(self.work_dir, 'old.json'), storage_mode='journal')
+        json_service.register_user("alice", "pw")
+        json_service.add_health_score("alice", 7)
+        json_service.storage.close()
+        
+        db_file = os.path.join(self.work_dir, 'old.db')
+        self.assertEqual(migrate_json_to_sqlite(os.path.join(self.work_dir, 'old.json'), db_file), 1)
+        migrated = UserService(os.path.join(self.work_dir, 'old.json'), storage_mode='sqlite')
+        self.assertEqual(migrated.get_user_info("alice")['health_score'], 7)
+        self.assertTrue(migrated.login_user("alice", "pw")['success'])
+        migrated.storage.close()
+
+class TestChatService(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+    
+    def test_ids_monotonic_across_restarts(self):
+        service = ChatService(data_dir=self.work_dir, capacity=3)
+        sent = [service.add_message("alice", f"第{i}条") for i in range(5)]
+        self.assertEqual([m['id'] for m in sent], [1, 2, 3, 4, 5])
+        self.assertEqual([m['id'] for m in service.get_recent_messages()], [3, 4, 5])
+        self.assertEqual([m['id'] for m in service.get_messages_after(3)], [4, 5])
+        self.assertEqual(service.get_messages_after(5), [])
+        self.assertEqual([m['id'] for m in service.get_messages_after(2, limit=2)], [3, 4])
+        # 内存只保留 3 条，更早的消息从聊天记录中读取
+        self.assertEqual([m['id'] for m in service.get_messages_before(3, limit=5)], [1, 2])
+        service.close()
+        
+        restarted = ChatService(data_dir=self.work_dir, capacity=3)
+        self.assertEqual([m['message'] for m in restarted.get_recent_messages()], ["第2条", "第3条", "第4条"])
+        self.assertEqual(restarted.get_messages_after(5), [])
+        # 重启后从预留的上界继续分配，不会复用可能已分配过的 id
+        self.assertGreater(restarted.add_message("bob", "晚安")['id'], 5)
+        self.assertEqual([m['message'] for m in restarted.get_messages_after(5)], ["晚安"])
+        self.assertEqual(len(restarted.get_messages_before(10 ** 9, limit=100)), 6)
+        restarted.close()
+    
+    def test_versions(self):
+        service = ChatService(data_dir=self.work_dir)
+        messages, presence = service.message_version(), service.presence_version()
+        service.add_message("alice", "早", room="morning")
+        self.assertEqual(service.message_version(), messages)
+        self.assertGreater(service.message_version("morning"), 0)
+        self.assertGreater(service.presence_version(), presence)  # 新建了聊天室
+        presence = service.presence_version()
+        service.join_room("alice", room="morning")
+        self.assertGreater(service.presence_version(), presence)
+        presence = service.presence_version()
+        service.join_room("alice", room="morning")  # 心跳不改变在线状态
+        self.assertEqual(service.presence_version(), presence)
+        service.leave_room("alice", room="morning")
+        self.assertGreater(service.presence_version(), presence)
+        service.close()
+    
+    def test_moderation(self):
+        word_file = os.path.join(self.work_dir, 'words.txt')
+        with open(word_file, 'w', encoding='utf-8') as f:
+            f.write("熬夜\n")
+        service = ChatService(data_dir=self.work_dir, moderation=ModerationFilter(word_file))
+        self.assertEqual(service.add_message("alice", "今天又熬夜了")['message'], "今天又**了")
+        self.assertEqual(service.add_message("bob", "熬夜", room="night")['message'], "**")
+        self.assertEqual(service.get_recent_messages()[-1]['message'], "今天又**了")
+        service.close()
+    
+    def test_legacy_messages_file_migrated(self):
+        legacy = [{'id': i, 'username': 'alice', 'message': str(n), 'timestamp': '2024-01-01T00:00:00'}
+                  for n, i in enumerate([99, 100, 100, 1])]
+        messages_file = os.path.join(self.work_dir, 'chat_messages.json')
+        with open(messages_file, 'w', encoding='utf-8') as f:
+            json.dump(legacy, f)
+        service = ChatService(data_dir=self.work_dir)
+        self.assertFalse(os.path.exists(messages_file))
+        self.assertEqual([m['id'] for m in service.get_recent_messages()], [1, 2, 3, 4])
+        self.assertEqual(service.add_message("bob", "hi")['id'], 5)
+        self.assertEqual(service.room().log.segments()[0], '2024-01-01')
+        service.close()
+    
+    def test_push_to_subscribers(self):
+        service = ChatService(data_dir=self.work_dir)
+        subscriber = service.subscribe()
+        msg = service.add_message("alice", "晚安")
+        event_id, chunk = subscriber.get(timeout=1)
+        self.assertEqual(event_id, msg['id'])
+        self.assertIn('event: message', chunk)
+        self.assertIn('"晚安"', chunk)
+        service.join_room("bob")
+        self.assertIn('"count": 1', subscriber.get(timeout=1)[1])
+        self.assertIsNone(subscriber.get(timeout=0.01))
+        service.unsubscribe(subscriber)
+        self.assertEqual(service.room().hub.subscriber_count(), 0)
+        service.close()
+    
+    def test_presence_expires_without_heartbeat(self):
+        service = ChatService(data_dir=self.work_dir, presence_ttl=15)
+        now = [time.monotonic()]
+        service.room().online_users.clock = lambda: now[0]
+        subscriber = service.subscribe()
+        service.join_room("alice")
+        service.join_room("bob")
+        now[0] += 10
+        service.join_room("alice")
+        now[0] += 10
+        self.assertEqual(service.get_online_users(), ("alice",))
+        self.assertEqual([chunk.split('data: ')[1] for _, chunk in
+                          (subscriber.get(timeout=1) for _ in range(3))],
+                         ['{"count": 1}\n\n', '{"count": 2}\n\n', '{"count": 1}\n\n'])
+        service.unsubscribe(subscriber)
+        service.close()
+    
+    def test_room_lookup_and_limit(self):
+        service = ChatService(data_dir=self.work_dir, max_rooms=3)
+        with self.assertRaises(KeyError):
+            service.room("早起", create=False)
+        self.assertEqual(service.list_rooms(), ["lobby"])  # 查找不存在的聊天室不会新建
+        service.add_message("alice", "早", room="早起")
+        self.assertIs(service.room("早起", create=False), service.room("早起"))
+        service.room("午睡")
+        with self.assertRaises(ValueError):
+            service.room("夜猫")
+        service.close()
+        # 其它进程新建的聊天室可以直接查到
+        other = ChatService(data_dir=self.work_dir)
+        self.assertEqual([m['message'] for m in other.room("早起", create=False).get_recent_messages()], ["早"])
+        other.close()
+    
+    def test_rooms_isolated(self):
+        service = ChatService(data_dir=self.work_dir)
+        lobby_subscriber = service.subscribe()
+        first = service.add_message("alice", "大家好")
+        early = service.add_message("bob", "六点起床", room="早起")
+        self.assertEqual((first['id'], early['id']), (1, 1))
+        self.assertEqual([m['message'] for m in service.get_recent_messages(room="早起")], ["六点起床"])
+        self.assertEqual([m['message'] for m in service.get_recent_messages()], ["大家好"])
+        self.assertEqual(lobby_subscriber.get(timeout=1)[0], 1)
+        self.assertIsNone(lobby_subscriber.get(timeout=0.01))  # 其它聊天室的消息不推送
+        self.assertTrue(os.path.isdir(os.path.join(self.work_dir, 'chat_rooms', '早起', 'chat_log')))
+        with self.assertRaises(ValueError):
+            service.room("../etc")
+        
+        service.join_room("alice")
+        service.join_room("alice", room="早起")
+        service.join_room("bob", room="早起")
+        self.assertEqual(service.get_online_users(room="早起"), ("alice", "bob"))
+        self.assertEqual(service.get_online_count(None), 2)
+        service.leave_room("alice", room="早起")
+        self.assertEqual(service.get_online_count(None), 2)  # 仍在大厅
+        service.leave_room("alice")
+        self.assertEqual(service.get_online_users(None), ("bob",))
+        self.assertEqual(service.get_room_sizes(), {"lobby": 0, "早起": 1})
+        service.close()
+        
+        restarted = ChatService(data_dir=self.work_dir)
+        self.assertEqual(restarted.list_rooms(), ["lobby", "早起"])
+        self.assertGreater(restarted.add_message("carol", "我也早起", room="早起")["id"], 1)
+        restarted.close()
+    
+    def test_slow_subscriber_evicted(self):
+        hub = ChatHub(queue_size=2)
+        fast, slow = hub.subscribe(), hub.subscribe()
+        for i in range(3):
+            hub.publish('message', {'n': i}, i)
+            fast.get(timeout=1)
+        self.assertEqual(hub.subscriber_count(), 1)
+        self.assertEqual(hub.evicted_count, 1)
+        # 被移出的订阅者仍能取完已排队的事件，之后结束
+        self.assertEqual([slow.get(timeout=1)[0] for _ in range(2)], [0, 1])
+        self.assertIsNone(slow.get(timeout=1))
+        self.assertTrue(slow.closed)
+
+class TestChatSearchService(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+    
+    def test_history_and_live_messages(self):
+        service = ChatService(data_dir=self.work_dir)
+        service.add_message("alice", "今晚早点睡觉，明天早起跑步")
+        service.add_message("bob", "跑步前先早起喝水")
+        service.add_message("bob", "睡前别看手机", room="早起")
+        service.close()
+        
+        service = ChatService(data_dir=self.work_dir)
+        search = ChatSearchService(service)
+        service.add_message("carol", "早起跑步打卡 Day3", room="早起")
+        self.assertTrue(search.backfilled.wait(5))
+        
+        results = search.search("早起跑步")
+        self.assertEqual([(m['username'], m['room']) for m in results], [("carol", "早起"), ("alice", "lobby")])
+        # "跑步前先早起" 含有全部二元组但不含连续的关键词，核对正文后排除
+        self.assertEqual(len(search.search("早起跑步", limit=1)), 1)
+        self.assertEqual([m['username'] for m in search.search("早起 喝水")], ["bob"])
+        self.assertEqual([m['message'] for m in search.search("ｄａｙ3 手机")], [])
+        self.assertEqual([m['message'] for m in search.search("手机", room="早起")], ["睡前别看手机"])
+        self.assertEqual(search.stats(), {"lobby": 2, "早起": 2})
+        with self.assertRaises(ValueError):
+            search.search("睡")
+        service.close()
+
+class TestChatServiceShared(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        db_file = os.path.join(self.work_dir, 'shared.db')
+        self.states = [SharedState(db_file), SharedState(db_file)]
+        self.workers = [ChatService(state, data_dir=self.work_dir, poll_interval=0.05) for state in self.states]
+    
+    def tearDown(self):
+        for worker in self.workers:
+            worker.close()
+        for state in self.states:
+            state.close()
+        shutil.rmtree(self.work_dir)
+    
+    def test_messages_and_presence_shared(self):
+        first = self.workers[0].add_message("alice", "晚安")
+        second = self.workers[1].add_message("bob", "早睡")
+        self.assertGreater(second['id'], first['id'])
+        self.assertEqual([m['message'] for m in self.workers[0].get_recent_messages()], ["晚安", "早睡"])
+        self.assertEqual([m['message'] for m in self.workers[0].get_messages_after(first['id'])], ["早睡"])
+        # 两个 worker 追加到同一份聊天记录
+        self.assertEqual([m['id'] for m in self.workers[1].get_messages_before(10 ** 9)], [first['id'], second['id']])
+        
+        self.workers[0].join_room("alice")
+        self.workers[1].join_room("bob")
+        self.assertEqual(sorted(self.workers[1].get_online_users()), ["alice", "bob"])
+        self.workers[1].leave_room("alice")
+        self.assertEqual(self.workers[0].get_online_count(), 1)
+    
+    def test_rooms_shared(self):
+        self.workers[0].add_message("alice", "大家好")
+        self.workers[0].add_message("alice", "早起打卡", room="早起")
+        self.workers[1].join_room("bob", room="早起")
+        self.assertEqual([m['message'] for m in self.workers[1].get_recent_messages(room="早起")], ["早起打卡"])
+        self.assertEqual([m['message'] for m in self.workers[1].get_recent_messages()], ["大家好"])
+        self.assertEqual(self.workers[1].get_online_users(None), ["bob"])
+    
+    def test_push_across_workers(self):
+        subscriber = self.workers[0].subscribe()
+        time.sleep(0.1)  # 等待后台线程记下当前位置
+        msg = self.workers[1].add_message("bob", "早睡")
+        event_id, chunk = subscriber.get(timeout=2)
+        self.assertEqual(event_id, msg['id'])
+        self.assertIn('"早睡"', chunk)
+        self.workers[1].join_room("bob")
+        self.assertIn('"count": 1', subscriber.get(timeout=2)[1])
+        self.workers[0].unsubscribe(subscriber)
+    
+    def test_search_follows_shared_log(self):
+        self.workers[1].add_message("bob", "昨晚早起跑步")
+        search = ChatSearchService(self.workers[0], poll_interval=0.05)
+        self.workers[1].add_message("bob", "今天早起跑步")
+        self.workers[0].add_message("alice", "早起跑步打卡", room="早起")
+        self.assertTrue(search.backfilled.wait(5))
+        deadline = time.monotonic() + 5
+        while sum(search.stats().values()) < 3 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        # 其它 worker 写入的消息和启动后新建的聊天室都能搜到，且不重复
+        self.assertEqual([m['message'] for m in search.search("早起跑步")], ["早起跑步打卡", "今天早起跑步", "昨晚早起跑步"])
+        search.close()
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,653 @@
+import unittest
+import sys
+import os
+import random
+import time
+import json
+import shutil
+import tempfile
+import threading
+
+# Add the parent directory to Python path
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, parent_dir)
+
+from utils.ranked_index import RankedIndex, SortedIndex
+from utils.write_behind import WriteBehindWriter
+from utils.shared_state import SharedState
+from utils.points_ledger import PointsLedger
+from utils.streak_index import StreakIndex
+from utils.ring_buffer import RingBuffer
+from utils.chat_log import ChatLog
+from utils.presence import PresenceTracker
+from utils.chat_search import SearchIndex, normalize, tokenize
+from utils.conditional import ConditionalStats, make_etag
+from utils.moderation import AhoCorasick, ModerationFilter, fold_width
+from utils.user_shards import UserShardStore
+from utils.sleep_series import SleepSeriesStore, RECORD
+from utils.sleep_tracker import SleepTracker
+from datetime import date, datetime, timedelta
+
+class TestRankedIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = RankedIndex()
+    
+    def test_top_and_rank(self):
+        self.index.set("alice", 8)
+        self.index.set("bob", 9.5)
+        self.index.set("carol", 8)
+        
+        self.assertEqual(self.index.top(2), [("bob", 9.5), ("alice", 8)])
+        self.assertEqual(self.index.rank("bob"), 1)
+        self.assertEqual(self.index.rank("carol"), 3)
+        self.assertIsNone(self.index.rank("dave"))
+    
+    def test_matches_full_sort(self):
+        rng = random.Random(42)
+        scores = {}
+        for _ in range(3000):
+            member = f"user{rng.randrange(300)}"
+            action = rng.random()
+            if action < 0.1:
+                self.index.remove(member)
+                scores.pop(member, None)
+            else:
+                scores[member] = self.index.add(member, rng.randrange(20))
+        
+        expected = sorted(scores.items(), key=lambda x: (-x[1], x[0]))
+        self.assertEqual(len(self.index), len(expected))
+        self.assertEqual(self.index.top(len(expected)), expected)
+        for position, (member, _) in enumerate(expected, 1):
+            self.assertEqual(self.index.rank(member), position)
+    def test_iter_from(self):
+        for member, score in (("alice", 8), ("bob", 9.5), ("carol", 8), ("dave", 3)):
+            self.index.set(member, score)
+        self.assertEqual(list(self.index.iter_from()), self.index.top(10))
+        self.assertEqual(list(self.index.iter_from(8, "alice")), [("carol", 8), ("dave", 3)])
+        self.assertEqual([m for m, _ in self.index.iter_from(8)], ["alice", "carol", "dave"])
+
+class TestSortedIndex(unittest.TestCase):
+    def test_iter_from_both_directions(self):
+        index = SortedIndex([("2024-01-02", "b"), ("2024-01-01", "a")])
+        index.add("2024-01-03", "c")
+        index.add("2024-01-02", "a2")
+        index.remove("2024-01-01", "a")
+        entries = [("2024-01-02", "a2"), ("2024-01-02", "b"), ("2024-01-03", "c")]
+        self.assertEqual(list(index.iter_from()), entries)
+        self.assertEqual(list(index.iter_from(["2024-01-02", "a2"])), entries[1:])
+        self.assertEqual(list(index.iter_from(reverse=True)), entries[::-1])
+        self.assertEqual(list(index.iter_from(("2024-01-02", "b"), reverse=True)), entries[:1])
+
+class TestRingBuffer(unittest.TestCase):
+    def test_since_and_overwrite(self):
+        ring = RingBuffer(3)
+        for item in "abcde":
+            ring.append(item)
+        self.assertEqual(list(ring), ["c", "d", "e"])
+        self.assertEqual(ring.since(3), ["d", "e"])
+        self.assertEqual(ring.since(0), ["c", "d", "e"])
+        self.assertEqual(ring.since(5), [])
+        self.assertEqual(ring.since(0, limit=2), ["c", "d"])
+        self.assertEqual(ring.since(4, limit=2), ["e"])
+        self.assertEqual(ring.tail(2), ["d", "e"])
+    
+    def test_skipped_sequence(self):
+        ring = RingBuffer(3)
+        ring.append("a")
+        self.assertEqual(ring.append("b", seq=5), 5)
+        ring.skip_to(100)
+        self.assertEqual(ring.append("c"), 100)
+        self.assertEqual(ring.since(0), ["a", "b", "c"])
+        self.assertEqual(ring.since(1), ["b", "c"])
+        self.assertEqual(ring.since(50), ["c"])
+        self.assertEqual(ring.last_seq, 100)
+        with self.assertRaises(ValueError):
+            ring.append("d", seq=50)
+
+class TestChatLog(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+    
+    def message(self, message_id, day):
+        return {'id': message_id, 'username': 'alice', 'message': f'第{message_id}条', 'timestamp': f'{day}T22:00:00'}
+    
+    def test_daily_segments_and_reads(self):
+        log = ChatLog(self.work_dir, fsync_interval=0.05)
+        for message_id in range(1, 7):
+            log.append(self.message(message_id, '2024-01-0%d' % ((message_id + 1) // 2)))
+        self.assertEqual(log.segments(), ['2024-01-01', '2024-01-02', '2024-01-03'])
+        self.assertEqual([r['id'] for r in log.tail(3)], [4, 5, 6])
+        self.assertEqual([r['id'] for r in log.tail(100)], [1, 2, 3, 4, 5, 6])
+        self.assertEqual([r['id'] for r in log.before(5, 3)], [2, 3, 4])
+        self.assertEqual(log.before(1, 3), [])
+        time.sleep(0.2)
+        self.assertGreaterEqual(log.sync_count, 3)  # 两次轮转各一次，后台合并至少一次
+        log.close()
+    
+    def test_before_bisects_segments(self):
+        log = ChatLog(self.work_dir)
+        for message_id in range(1, 31):
+            log.append(self.message(message_id, (date(2024, 1, 1) + timedelta(days=(message_id - 1) // 3)).isoformat()))
+        self.assertEqual([r['id'] for r in log.before(8, 4)], [4, 5, 6, 7])
+        self.assertEqual([r['id'] for r in log.before(7, 2)], [5, 6])
+        self.assertEqual([r['id'] for r in log.before(100, 2)], [29, 30])
+        # 各段第一条 id 只读取一次
+        self.assertEqual(log._first_ids['2024-01-03'], 7)
+        log.close()
+    
+    def test_locations_and_scan(self):
+        log = ChatLog(self.work_dir)
+        locations = [log.append(self.message(i, day)) for i, day in
+                     enumerate(['2024-01-01', '2024-01-01', '2024-01-02'], 1)]
+        self.assertEqual([loc[0] for loc in locations], ['2024-01-01', '2024-01-01', '2024-01-02'])
+        self.assertEqual(log.read_at(*locations[1])['id'], 2)
+        until = log.snapshot()
+        log.append(self.message(4, '2024-01-02'))
+        self.assertEqual([(day, offset, r['id']) for day, offset, r in log.scan(until)],
+                         [loc + (i,) for i, loc in enumerate(locations, 1)])
+        self.assertEqual(len(list(log.scan())), 4)
+        log.close()
+    
+    def test_torn_tail_truncated(self):
+        log = ChatLog(self.work_dir)
+        log.append(self.message(1, '2024-01-01'))
+        log.close()
+        path = os.path.join(self.work_dir, '2024-01-01.jsonl')
+        with open(path, 'ab') as f:
+            f.write(b'{"id": 2, "username": "al')
+        log = ChatLog(self.work_dir)
+        log.append(self.message(3, '2024-01-01'))
+        self.assertEqual([r['id'] for r in log.tail(10)], [1, 3])
+        log.close()
+
+class TestPresenceTracker(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.changes = []
+        self.presence = PresenceTracker(ttl=15, clock=lambda: self.now, on_change=self.changes.append)
+    
+    def test_heartbeat_expiry(self):
+        self.presence.heartbeat("alice")
+        self.now += 10
+        self.presence.heartbeat("bob")
+        self.presence.heartbeat("alice")  # 心跳刷新过期时间
+        self.assertEqual(self.presence.count(), 2)
+        self.assertEqual(self.changes, [1, 2])
+        
+        self.now += 12
+        self.presence.heartbeat("bob")
+        self.now += 10
+        self.assertEqual(self.presence.count(), 1)
+        self.assertEqual(self.presence.users(), ("bob",))
+        self.assertEqual(self.presence.expired_count, 1)
+        self.now += 3600
+        self.assertEqual(self.presence.count(), 0)
+        self.assertEqual(self.changes, [1, 2, 1, 0])
+    
+    def test_leave_and_snapshot_reuse(self):
+        for name in ("carol", "alice", "bob"):
+            self.presence.heartbeat(name)
+        users = self.presence.users()
+        self.assertEqual(users, ("alice", "bob", "carol"))
+        self.presence.heartbeat("alice")
+        self.assertIs(self.presence.users(), users)
+        self.assertEqual(self.presence.version, 3)
+        self.presence.leave("bob")
+        self.presence.leave("bob")
+        self.assertEqual(self.presence.users(), ("alice", "carol"))
+        self.assertEqual(self.presence.version, 4)
+        self.assertEqual(self.changes, [1, 2, 3, 2])
+
+class TestSearchIndex(unittest.TestCase):
+    def test_tokenize(self):
+        self.assertEqual(tokenize(normalize("早起跑步 ＲＵＮ 5km")), {"早起", "起跑", "跑步", "run", "5km"})
+        self.assertEqual(tokenize(normalize("睡")), set())
+    
+    def test_candidates_newest_first(self):
+        index = SearchIndex()
+        for i, text in enumerate(["今晚早睡", "早起跑步", "早睡早起", "晚安"]):
+            index.add(text, '2024-01-01', i * 100, i + 1, 1700000000.0 + i)
+        self.assertEqual(list(index.candidates({"早起"})), [2, 1])
+        self.assertEqual(list(index.candidates({"早睡", "睡早"})), [2])
+        self.assertEqual(list(index.candidates({"早起", "晚安"})), [])
+        self.assertEqual(list(index.candidates({"不存在"})), [])
+        self.assertEqual(index.location(1), ('2024-01-01', 100, 2, 1700000001.0))
+
+class TestConditional(unittest.TestCase):
+    def test_make_etag(self):
+        self.assertEqual(make_etag('chat/online', b'room=a', 3), make_etag('chat/online', b'room=a', 3))
+        self.assertNotEqual(make_etag('chat/online', b'room=a', 3), make_etag('chat/online', b'room=a', 4))
+        self.assertNotEqual(make_etag('a', 'bc'), make_etag('ab', 'c'))
+        self.assertEqual(make_etag('a', epoch=b'x'), make_etag('a', epoch=b'x'))
+        self.assertNotEqual(make_etag('a', epoch=b'x'), make_etag('a'))
+    
+    def test_hit_ratio(self):
+        stats = ConditionalStats()
+        for not_modified in (False, True, True, True):
+            stats.record('leaderboard', not_modified)
+        stats.record('chat/online', False)
+        self.assertEqual(stats.snapshot(), {
+            'chat/online': {'requests': 1, 'not_modified': 0, 'hit_ratio': 0.0},
+            'leaderboard': {'requests': 4, 'not_modified': 3, 'hit_ratio': 0.75}
+        })
+
+class TestModeration(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.word_file = os.path.join(self.work_dir, 'words.txt')
+    
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+    
+    def test_automaton_spans(self):
+        automaton = AhoCorasick(["he", "she", "his", "hers", "坏蛋", "大坏蛋"])
+        self.assertEqual(automaton.spans("ushers"), [(1, 4), (2, 6)])
+        self.assertEqual(automaton.spans("你是大坏蛋吗"), [(2, 5)])
+        self.assertEqual(automaton.spans("晚安"), [])
+        self.assertEqual(fold_width("ＢａＤ　ｗｏｒｄ１"), "bad word1")
+    
+    def test_censor_and_reload(self):
+        with open(self.word_file, 'w', encoding='utf-8') as f:
+            f.write("# 注释\nBadWord\n熬夜\n")
+        moderation = ModerationFilter(self.word_file, check_interval=0)
+        self.assertEqual(moderation.censor("别熬夜了，ＢＡＤＷＯＲＤ!"), ("别**了，*******!", 2))
+        self.assertEqual(moderation.censor("晚安"), ("晚安", 0))
+        
+        with open(self.word_file, 'w', encoding='utf-8') as f:
+            f.write("晚安\n")
+        os.utime(self.word_file, ns=(0, 10 ** 9))  # 保证修改时间变化
+        moderation.censor("触发检查")
+        deadline = time.time() + 5
+        while moderation.reload_count < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(moderation.censor("晚安，别熬夜"), ("**，别熬夜", 1))
+        
+        os.remove(self.word_file)
+        self.assertEqual(moderation.reload(), 0)
+        self.assertEqual(moderation.censor("晚安"), ("晚安", 0))
+
+class TestUserShardStore(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+    
+    def test_append_and_compaction(self):
+        store = UserShardStore(self.work_dir)
+        store.replace("alice", 'behavior_data', {'2024-01-01': {'score': 1}})
+        snapshot = os.path.getsize(store._shard_path("alice"))
+        store.put("alice", 'behavior_data', '2024-01-02', {'score': 2})
+        store.put("alice", 'sleep_data', '2024-01-02', {'sleep_hours': 7})
+        # 每天的记录只追加到日志，快照不变
+        self.assertEqual(os.path.getsize(store._shard_path("alice")), snapshot)
+        with open(store._log_path("alice"), 'ab') as f:
+            f.write(b'{"kind": "behavior_da')
+        reloaded = UserShardStore(self.work_dir)
+        self.assertEqual(reloaded.get("alice", 'behavior_data'),
+                         {'2024-01-01': {'score': 1}, '2024-01-02': {'score': 2}})
+        self.assertEqual(reloaded.pop("alice", 'sleep_data'), {'2024-01-02': {'sleep_hours': 7}})
+        self.assertFalse(os.path.exists(store._log_path("alice")))
+        
+        for score in range(30):
+            reloaded.put("alice", 'behavior_data', '2024-01-03', {'score': score})
+        self.assertLess(os.path.getsize(reloaded._log_path("alice")), 1024)
+        self.assertEqual(UserShardStore(self.work_dir).read("alice"), {
+            'username': "alice",
+            'behavior_data': {'2024-01-01': {'score': 1}, '2024-01-02': {'score': 2}, '2024-01-03': {'score': 29}}
+        })
+        reloaded.delete("alice")
+        self.assertEqual(UserShardStore(self.work_dir).read("alice"), {'username': "alice"})
+    
+    def test_shared_sees_other_workers(self):
+        first = UserShardStore(self.work_dir, shared=True)
+        second = UserShardStore(self.work_dir, shared=True)
+        first.put("bob", 'behavior_data', '2024-01-01', {'score': 1})
+        self.assertEqual(second.get("bob", 'behavior_data'), {'2024-01-01': {'score': 1}})
+        for score in range(40):
+            second.put("bob", 'behavior_data', '2024-01-02', {'score': score})
+        self.assertEqual(first.get("bob", 'behavior_data')['2024-01-02'], {'score': 39})
+        # 共享时不合并，日志保留全部追加
+        self.assertFalse(os.path.exists(first._shard_path("bob")))
+        first.delete("bob")
+        self.assertEqual(second.get("bob", 'behavior_data'), {})
+
+class TestSleepSeriesStore(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+    
+    def entry(self, hours, bedtime="23:00", quality=8.0):
+        return {'sleep_hours': hours, 'bedtime': bedtime, 'quality_score': quality}
+    
+    def test_columns_and_reload(self):
+        store = SleepSeriesStore(self.work_dir)
+        store.put("alice", '2024-01-02', self.entry(7.5))
+        store.put("alice", '2024-01-03', self.entry(6, "01:30", 5.5))
+        store.put("alice", '2024-01-01', self.entry(8))             # 补录较早的日期
+        store.put("alice", '2024-01-02', {'sleep_hours': 9})        # 同一天覆盖，缺少的字段记为缺失
+        series = store.get("alice")
+        self.assertEqual(list(series.hours), [8, 9, 6])
+        self.assertEqual(series.window(date(2024, 1, 2).toordinal()), (1, 3))
+        expected = {
+            '2024-01-01': self.entry(8),
+            '2024-01-02': {'sleep_hours': 9},
+            '2024-01-03': self.entry(6, "01:30", 5.5)
+        }
+        self.assertEqual(series.to_dict(), expected)
+        self.assertEqual(list(series.to_dict(last=1)), ['2024-01-03'])
+        
+        # 末尾写到一半的记录在重新加载时截掉，之后的追加不受影响
+        path = store._path("alice")
+        with open(path, 'ab') as f:
+            f.write(b'\x01\x02\x03')
+        reloaded = SleepSeriesStore(self.work_dir)
+        self.assertEqual(reloaded.read("alice"), expected)
+        self.assertEqual(reloaded.get("alice").to_dict(), expected)
+        self.assertEqual(os.path.getsize(path), 4 * RECORD.size)
+        reloaded.put("alice", '2024-01-04', self.entry(7))
+        self.assertEqual(len(SleepSeriesStore(self.work_dir).get("alice")), 4)
+        
+        reloaded.delete("alice")
+        self.assertIsNone(reloaded.read("alice"))
+        self.assertEqual(len(reloaded.get("alice")), 0)
+    
+    def test_legacy_migration_and_compaction(self):
+        legacy = {"bob": {'2024-03-01': self.entry(7, "22:45", 9.0)}}
+        store = SleepSeriesStore(self.work_dir, legacy=legacy.get, drop_legacy=legacy.pop)
+        # 数据文件写入失败时旧数据保留
+        def fail(*args, **kwargs):
+            raise OSError('磁盘已满')
+        store._write = fail
+        with self.assertRaises(OSError):
+            store.get("bob")
+        self.assertIn("bob", legacy)
+        del store._write
+        self.assertEqual(store.get("bob").to_dict(), {'2024-03-01': self.entry(7, "22:45", 9.0)})
+        self.assertNotIn("bob", legacy)
+        self.assertEqual(SleepSeriesStore(self.work_dir).read("bob"), {'2024-03-01': self.entry(7, "22:45", 9.0)})
+        
+        for hours in range(40):
+            store.put("bob", '2024-03-02', self.entry(hours))
+        reloaded = SleepSeriesStore(self.work_dir)
+        self.assertEqual(reloaded.get("bob").to_dict()['2024-03-02'], self.entry(39))
+        self.assertEqual(os.path.getsize(store._path("bob")), 2 * RECORD.size)
+    
+    def test_shared_workers(self):
+        worker_a = SleepSeriesStore(self.work_dir, shared=True)
+        worker_b = SleepSeriesStore(self.work_dir, shared=True)
+        worker_a.put("alice", '2024-01-01', self.entry(7))
+        self.assertEqual(len(worker_b.get("alice")), 1)
+        worker_b.put("alice", '2024-01-02', self.entry(8))
+        worker_a.put("alice", '2024-01-03', self.entry(6))
+        self.assertEqual(list(worker_a.get("alice").hours), [7, 8, 6])
+        self.assertEqual(list(worker_b.get("alice").hours), [7, 8, 6])
+        self.assertEqual(len(worker_b.read("alice")), 3)
+        # 多进程时不压缩，重复的记录保留在文件中
+        for hours in range(40):
+            worker_a.put("alice", '2024-01-03', self.entry(hours))
+        self.assertEqual(worker_b.get("alice").to_dict()['2024-01-03'], self.entry(39))
+        self.assertEqual(os.path.getsize(worker_a._path("alice")), 43 * RECORD.size)
+        worker_b.delete("alice")
+        self.assertEqual(len(worker_a.get("alice")), 0)
+        worker_b.put("alice", '2024-02-01', self.entry(9))
+        self.assertEqual(list(worker_a.get("alice").hours), [9])
+        self.assertIsNone(SleepTracker(worker_a).pattern_version())
+    
+    def test_sleep_trends(self):
+        store = SleepSeriesStore(self.work_dir)
+        tracker = SleepTracker(store)
+        today = date.today()
+        store.put("alice", (today - timedelta(days=10)).isoformat(), self.entry(3, quality=1.0))
+        store.put("alice", (today - timedelta(days=2)).isoformat(), self.entry(7, quality=6.0))
+        store.put("alice", today.isoformat(), self.entry(8, quality=9.0))
+        self.assertEqual(tracker.get_sleep_trends("alice"),
+                         {'avg_sleep_hours': 7.5, 'avg_quality_score': 7.5, 'trend': "改善"})
+        self.assertIsNone(tracker.get_sleep_trends("bob"))
+        self.assertEqual(len(tracker.get_recent_records("alice", 2)), 2)
+        version = tracker.pattern_version()
+        store.put("bob", today.isoformat(), self.entry(8))
+        self.assertNotEqual(tracker.pattern_version(), version)
+
+class TestWriteBehindWriter(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.data_file = os.path.join(self.work_dir, 'data.json')
+        self.data = {}
+        self.writer = WriteBehindWriter(interval=0.05)
+        self.writer.register(self.data_file, lambda: self.data)
+    
+    def tearDown(self):
+        self.writer.stop()
+        shutil.rmtree(self.work_dir)
+    
+    def test_coalesce_writes(self):
+        for i in range(200):
+            self.data[f'key{i}'] = i
+            self.writer.mark_dirty(self.data_file)
+        self.assertFalse(os.path.exists(self.data_file))
+        
+        self.writer.stop()
+        self.assertEqual(self.writer.write_count, 1)
+        with open(self.data_file, 'r', encoding='utf-8') as f:
+            self.assertEqual(len(json.load(f)), 200)
+    
+    def test_background_flush(self):
+        self.data['a'] = 1
+        self.writer.mark_dirty(self.data_file)
+        for _ in range(100):
+            if os.path.exists(self.data_file):
+                break
+            time.sleep(0.01)
+        with open(self.data_file, 'r', encoding='utf-8') as f:
+            self.assertEqual(json.load(f), {'a': 1})
+        self.assertEqual(os.listdir(self.work_dir), ['data.json'])
+
+class TestSharedState(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.work_dir, 'shared.db')
+        # 两个实例模拟两个 worker 进程各自的连接
+        self.worker_a = SharedState(self.db_file)
+        self.worker_b = SharedState(self.db_file)
+    
+    def tearDown(self):
+        self.worker_a.close()
+        self.worker_b.close()
+        shutil.rmtree(self.work_dir)
+    
+    def test_epoch_shared(self):
+        self.assertEqual(self.worker_a.epoch(), self.worker_b.epoch())
+        self.assertEqual(len(self.worker_a.epoch()), 8)
+        self.assertEqual(list(self.worker_a.namespace('_meta')), ['epoch'])
+    
+    def test_namespace_visible_across_connections(self):
+        online_a = self.worker_a.namespace('online')
+        online_b = self.worker_b.namespace('online')
+        online_a['alice'] = {'since': 1}
+        online_a['bob'] = {'since': 2}
+        self.assertEqual(online_b['alice'], {'since': 1})
+        self.assertEqual(len(online_b), 2)
+        
+        del online_b['alice']
+        self.assertNotIn('alice', online_a)
+        self.assertEqual(online_a.items(), [('bob', {'since': 2})])
+        self.assertEqual(len(self.worker_a.namespace('other')), 0)
+    
+    def test_ttl(self):
+        binds = self.worker_a.namespace('binds', ttl=0.05)
+        binds['code'] = {'username': 'alice'}
+        self.assertIn('code', binds)
+        time.sleep(0.1)
+        self.assertNotIn('code', binds)
+        self.assertEqual(binds.purge_expired(), 1)
+    
+    def test_log_ids_and_trim(self):
+        ids = [self.worker_a.append('chat', {'n': i}, keep=5) if i % 2 else
+               self.worker_b.append('chat', {'n': i}, keep=5) for i in range(12)]
+        self.assertEqual(ids, sorted(ids))
+        tail = self.worker_b.tail('chat', 3)
+        self.assertEqual([record['n'] for _, record in tail], [9, 10, 11])
+        self.assertEqual(len(self.worker_a.tail('chat', 100)), 7)
+        self.assertEqual([record['n'] for _, record in self.worker_a.since('chat', ids[9], 100)], [10, 11])
+        self.assertEqual(self.worker_a.since('chat', ids[-1], 100), [])
+        self.assertEqual([record['n'] for _, record in self.worker_a.since('chat', ids[6], 2)], [7, 8])
+
+class TestPointsLedger(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.ledger = PointsLedger(self.work_dir, segment_size=200)
+    
+    def tearDown(self):
+        self.ledger.close()
+        shutil.rmtree(self.work_dir)
+    
+    def fill(self):
+        for day in range(1, 11):
+            for user in ('alice', 'bob'):
+                self.ledger.append(user, day, f"第{day}天", f"2024-01-{day:02d}T08:00:00")
+    
+    def test_last_and_sum(self):
+        self.fill()
+        self.assertGreater(len(self.ledger.segments), 1)
+        last = self.ledger.last('alice', 3)
+        self.assertEqual([entry['points'] for entry in last], [8, 9, 10])
+        self.assertEqual(last[-1]['reason'], "第10天")
+        self.assertEqual(self.ledger.sum('alice'), 55)
+        self.assertEqual(self.ledger.sum('alice', '2024-01-03', '2024-01-05'), 3 + 4)
+        self.assertEqual(self.ledger.sum('alice', start='2024-01-10'), 10)
+        self.assertEqual(self.ledger.sum('carol'), 0)
+        self.assertEqual(self.ledger.last('carol'), [])
+    
+    def test_reload_and_torn_tail(self):
+        self.fill()
+        self.ledger.close()
+        active = os.path.join(self.work_dir, f"{self.ledger.segments[-1]:08d}.jsonl")
+        with open(active, 'ab') as f:
+            f.write(b'{"user": "alice", "ts": "2024-01-11')
+        reopened = PointsLedger(self.work_dir, segment_size=200)
+        self.assertEqual(reopened.sum('alice'), 55)
+        reopened.append('alice', 1, timestamp="2024-01-11T08:00:00")
+        self.assertEqual(reopened.last('alice', 1)[0]['points'], 1)
+        reopened.close()
+        self.assertEqual(PointsLedger(self.work_dir).count('alice'), 11)
+    
+    def test_compact(self):
+        self.fill()
+        self.ledger.forget('bob')
+        written = self.ledger.compact(keep_since='2024-01-08')
+        # alice: 1 条结转 + 3 条保留
+        self.assertEqual(written, 4)
+        self.assertEqual(len(self.ledger.segments), 2)
+        self.assertEqual(self.ledger.sum('alice'), 55)
+        self.assertEqual(self.ledger.sum('alice', '2024-01-08'), 8 + 9 + 10)
+        self.assertEqual(self.ledger.last('alice', 4)[0]['points'], 28)
+        self.assertEqual(self.ledger.count('bob'), 0)
+        
+        self.ledger.append('bob', 5)
+        self.ledger.close()
+        reopened = PointsLedger(self.work_dir)
+        self.assertEqual(reopened.sum('alice'), 55)
+        self.assertEqual(reopened.sum('bob'), 5)
+        reopened.close()
+    
+    def test_compact_does_not_block_appends(self):
+        self.fill()
+        read = self.ledger._read
+        appended = threading.Event()
+        
+        def append():
+            self.ledger.append('alice', 100, timestamp="2024-01-11T08:00:00")
+            appended.set()
+        
+        def read_and_append(location, readers=None):
+            if readers is not None and not appended.is_set():
+                # 合并读取旧段时，其它线程的追加应能立即完成
+                threading.Thread(target=append).start()
+                appended.wait(timeout=5)
+            return read(location, readers)
+        
+        self.ledger._read = read_and_append
+        self.ledger.compact()
+        self.assertTrue(appended.is_set())
+        self.assertEqual(self.ledger.sum('alice'), 155)
+        self.assertEqual(self.ledger.last('alice', 2)[-1]['points'], 100)
+        self.ledger.close()
+        self.assertEqual(PointsLedger(self.work_dir).sum('alice'), 155)
+    
+    def test_auto_compact(self):
+        ledger = PointsLedger(os.path.join(self.work_dir, 'auto'), segment_size=200, auto_compact=2, keep_days=30)
+        old = (datetime.now() - timedelta(days=60)).isoformat()
+        for i in range(10):
+            ledger.append('alice', 1, timestamp=old)
+            ledger.append('bob', 2)
+            thread = ledger._compact_thread
+            if thread is not None:
+                thread.join()
+        self.assertGreater(ledger.compact_count, 0)
+        self.assertEqual((ledger.sum('alice'), ledger.sum('bob')), (10, 20))
+        self.assertLess(ledger.count('alice'), 10)
+        ledger.close()
+
+class TestStreakIndex(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.streaks = StreakIndex()
+        self.ledger = PointsLedger(self.work_dir, observers=[self.streaks])
+    
+    def tearDown(self):
+        self.ledger.close()
+        shutil.rmtree(self.work_dir)
+    
+    def record(self, user, day, action='analyze_sleep'):
+        self.ledger.append(user, 10, "睡眠分析完成", f"{day.isoformat()}T22:00:00", action)
+    
+    def test_current_and_longest(self):
+        today = date(2024, 3, 20)
+        for offset in (30, 29, 28, 27, 10, 2, 1, 1, 0):
+            self.record('alice', today - timedelta(days=offset))
+        self.ledger.append('alice', 50, "完成习惯: 早睡")
+        self.assertEqual(self.streaks.current_streak('alice', 'analyze_sleep', today), 3)
+        self.assertEqual(self.streaks.longest_streak('alice', 'analyze_sleep'), 4)
+        self.assertEqual(self.streaks.active_days('alice', 'analyze_sleep'), 8)
+        # 昨天有活动时连续天数仍然有效，前天之后就中断
+        self.assertEqual(self.streaks.current_streak('alice', 'analyze_sleep', today + timedelta(days=1)), 3)
+        self.assertEqual(self.streaks.current_streak('alice', 'analyze_sleep', today + timedelta(days=2)), 0)
+        self.assertEqual(self.streaks.current_streak('alice', 'analyze_behavior', today), 0)
+        
+        # 补记过去的日期把两段连起来
+        for offset in range(3, 10):
+            self.record('alice', today - timedelta(days=offset))
+        self.assertEqual(self.streaks.current_streak('alice', 'analyze_sleep', today), 11)
+        self.assertEqual(self.streaks.longest_streak('alice', 'analyze_sleep'), 11)
+    
+    def test_rebuilt_from_ledger_and_compaction(self):
+        start = date(2024, 1, 1)
+        for offset in list(range(0, 12)) + list(range(20, 25)):
+            self.record('alice', start + timedelta(days=offset))
+            self.record('bob', start + timedelta(days=offset), 'analyze_behavior')
+        expected = self.streaks.summary('alice', today=start + timedelta(days=24))
+        self.assertEqual(expected['analyze_sleep']['current'], 5)
+        self.assertEqual(expected['analyze_sleep']['longest'], 12)
+        
+        self.ledger.close()
+        rebuilt = StreakIndex()
+        self.ledger = PointsLedger(self.work_dir, observers=[rebuilt])
+        self.assertEqual(rebuilt.summary('alice', today=start + timedelta(days=24)), expected)
+        
+        # 结转后旧记录只剩日期区间，连续天数不变
+        self.ledger.compact(keep_since=(start + timedelta(days=22)).isoformat())
+        self.assertEqual(self.ledger.count('alice'), 1 + 3)
+        self.assertEqual(rebuilt.summary('alice', today=start + timedelta(days=24)), expected)
+        self.assertEqual(rebuilt.longest_streak('bob', 'analyze_behavior'), 12)
+        
+        self.ledger.forget('bob')
+        self.assertEqual(rebuilt.longest_streak('bob', 'analyze_behavior'), 0)
+
+if __name__ == '__main__':
+    unittest.main()
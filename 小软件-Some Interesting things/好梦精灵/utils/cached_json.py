@@ -0,0 +1,90 @@
+import json
+import os
+import threading
+import time
+from .write_behind import write_behind
+
+
+class CachedJsonFile:
+    """常驻内存的 JSON 文件
+
+    读取直接返回内存中的数据，修改后标记为脏，由延迟写入器合并写出。
+    每隔 check_interval 秒最多检查一次文件修改时间，发现被其它进程或手工改动时重新加载；
+    本对象自己写出的修改会记录新的修改时间，不会触发重新加载。
+    尚未写出的修改优先于磁盘上的外部改动。
+    """
+
+    def __init__(self, path, writer=write_behind, check_interval=1.0, indent=2):
+        """
+        :param path: 文件路径
+        :param writer: WriteBehindWriter 实例
+        :param check_interval: 检查文件修改时间的最小间隔（秒）
+        """
+        self.path = path
+        self.writer = writer
+        self.check_interval = check_interval
+        self.lock = threading.RLock()
+        self._data = None
+        self._mtime = None
+        self._checked_at = 0.0
+        self._dirty = False
+        self.load_count = 0
+        writer.register(path, self._snapshot, indent=indent, on_write=self._written)
+
+    def _stat(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _load(self):
+        mtime = self._stat()
+        data = {}
+        if mtime is not None:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        self._data = data
+        self._mtime = mtime
+        self.load_count += 1
+
+    def data(self):
+        """返回内存中的数据字典；修改时需持有 lock，修改后调用 mark_dirty"""
+        with self.lock:
+            now = time.monotonic()
+            if self._data is None:
+                self._load()
+                self._checked_at = now
+            elif not self._dirty and now - self._checked_at >= self.check_interval:
+                self._checked_at = now
+                if self._stat() != self._mtime:
+                    self._load()
+            return self._data
+
+    def replace(self, data):
+        """整体替换数据"""
+        with self.lock:
+            self._data = data
+            self.mark_dirty()
+
+    def mark_dirty(self):
+        with self.lock:
+            self._dirty = True
+        self.writer.mark_dirty(self.path)
+
+    def flush(self):
+        """立即写出未保存的修改"""
+        self.writer.flush(self.path)
+
+    def close(self):
+        """写出剩余修改并停止由写入器管理"""
+        self.writer.unregister(self.path)
+
+    def _snapshot(self):
+        with self.lock:
+            # 在锁内序列化后再解析，保证写出的是某一时刻的完整数据
+            return json.loads(json.dumps(self._data if self._data is not None else {}, ensure_ascii=False))
+
+    def _written(self, path):
+        with self.lock:
+            self._mtime = self._stat()
+            self._dirty = False
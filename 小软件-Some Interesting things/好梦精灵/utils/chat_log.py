@@ -0,0 +1,275 @@
+import bisect
+import json
+import os
+import threading
+import time
+from datetime import date
+
+SEGMENT_SUFFIX = '.jsonl'
+
+
+def _read_backwards(path, block_size=64 * 1024):
+    """从文件末尾向前按块读取，逐行返回（不含换行符）"""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        buffer = b''
+        while position > 0:
+            size = min(block_size, position)
+            position -= size
+            f.seek(position)
+            buffer = f.read(size) + buffer
+            lines = buffer.split(b'\n')
+            buffer = lines.pop(0)
+            for line in reversed(lines):
+                if line:
+                    yield line
+        if buffer:
+            yield buffer
+
+
+class ChatLog:
+    """聊天记录日志（按天分段追加写的 JSONL）
+
+    每条消息追加一行到消息日期对应的段文件（2024-01-01.jsonl），日期变化时轮转到新段，
+    旧段不再修改，全部历史都会保留。写入后立即交给操作系统，进程崩溃不会丢失；
+    fsync 由后台线程每 fsync_interval 秒合并做一次，机器掉电时最多丢失这段时间内的消息。
+    读取最近的消息时从最新的段末尾向前按块读取，耗时只与读取的条数有关，与历史总量无关；
+    向前翻阅时按各段第一条记录的 id 二分查找起始段，不用从最新段逐段读回去。
+    """
+
+    def __init__(self, base_dir, fsync_interval=1.0, repair=True):
+        """
+        :param base_dir: 段文件所在目录
+        :param fsync_interval: 两次 fsync 之间的最长秒数，0 表示每次追加后立即 fsync
+        :param repair: 启动时截掉最新段末尾写了一半的记录；多个进程同时追加时应关闭
+        """
+        self.base_dir = base_dir
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._active = None
+        self._active_day = None
+        self._dirty = False
+        self._syncer = None
+        self._first_ids = {}  # 段日期 -> 段内第一条记录的 id
+        self.append_count = 0
+        self.sync_count = 0
+        os.makedirs(base_dir, exist_ok=True)
+        if repair:
+            self._repair_tail()
+
+    def _segment_path(self, day):
+        return os.path.join(self.base_dir, f'{day}{SEGMENT_SUFFIX}')
+
+    def segments(self):
+        """按日期顺序返回全部段的日期"""
+        return sorted(name[:-len(SEGMENT_SUFFIX)] for name in os.listdir(self.base_dir)
+                      if name.endswith(SEGMENT_SUFFIX))
+
+    def _repair_tail(self):
+        """截掉最新段末尾进程中断时写了一半的记录"""
+        segments = self.segments()
+        if not segments:
+            return
+        path = self._segment_path(segments[-1])
+        with open(path, 'r+b') as f:
+            size = f.seek(0, os.SEEK_END)
+            position = size
+            while position > 0:
+                start = max(position - 4096, 0)
+                f.seek(start)
+                block = f.read(position - start)
+                newline = block.rfind(b'\n')
+                if newline >= 0:
+                    position = start + newline + 1
+                    break
+                position = start
+            if position < size:
+                f.truncate(position)
+
+    # ---- 写入 ----
+
+    def append(self, record):
+        """
+        追加一条记录，按 record['timestamp'] 的日期（缺省为今天）写入对应的段
+        记录的日期需非递减（按当前时间追加即满足）
+        :return: 记录的位置 (段日期, 行起始偏移)
+        """
+        timestamp = record.get('timestamp')
+        day = timestamp[:10] if timestamp else date.today().isoformat()
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        with self._lock:
+            if day != self._active_day:
+                self._rotate(day)
+            self._active.write(line)
+            self._active.flush()
+            # 追加模式下写入后文件位置在本行末尾，其它进程的追加不影响本进程的文件位置
+            location = (day, self._active.tell() - len(line))
+            self.append_count += 1
+            if not self.fsync_interval:
+                self._sync_locked()
+                return location
+            self._dirty = True
+            if self._syncer is None or not self._syncer.is_alive():
+                self._syncer = threading.Thread(target=self._sync_loop, daemon=True)
+                self._syncer.start()
+            return location
+
+    def _rotate(self, day):
+        if self._active is not None:
+            self._sync_locked()
+            self._active.close()
+        self._active = open(self._segment_path(day), 'ab')
+        self._active_day = day
+
+    def _sync_locked(self):
+        if self._active is not None:
+            os.fsync(self._active.fileno())
+            self.sync_count += 1
+        self._dirty = False
+
+    def _sync_loop(self):
+        """后台合并 fsync，空闲一个周期后退出"""
+        while True:
+            time.sleep(self.fsync_interval)
+            with self._lock:
+                if not self._dirty:
+                    self._syncer = None
+                    return
+                self._sync_locked()
+
+    def sync(self):
+        """立即 fsync 当前段"""
+        with self._lock:
+            if self._dirty:
+                self._sync_locked()
+
+    def close(self):
+        with self._lock:
+            if self._active is not None:
+                if self._dirty:
+                    self._sync_locked()
+                self._active.close()
+                self._active = None
+                self._active_day = None
+
+    # ---- 读取 ----
+
+    def _records_backwards(self, segments=None):
+        """
+        从最新的记录开始逐条向前返回
+        :param segments: 只读取这些段（按日期顺序），默认为全部段
+        """
+        if segments is None:
+            segments = self.segments()
+        for day in reversed(segments):
+            for line in _read_backwards(self._segment_path(day)):
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue  # 正在写入的半行
+
+    def snapshot(self):
+        """返回 (最新段日期, 该段当前大小)，没有记录时返回 None；用于限定 scan 的范围"""
+        segments = self.segments()
+        if not segments:
+            return None
+        return segments[-1], os.path.getsize(self._segment_path(segments[-1]))
+
+    def scan(self, until=None):
+        """
+        按时间顺序逐条返回 (段日期, 行起始偏移, 记录)
+        :param until: snapshot() 的返回值，只读到该位置为止
+        """
+        for day in self.segments():
+            if until is not None and day > until[0]:
+                break
+            limit = until[1] if until is not None and day == until[0] else None
+            offset = 0
+            with open(self._segment_path(day), 'rb') as f:
+                for line in f:
+                    if limit is not None and offset >= limit or not line.endswith(b'\n'):
+                        break
+                    try:
+                        yield day, offset, json.loads(line)
+                    except ValueError:
+                        pass
+                    offset += len(line)
+
+    def read_from(self, position=None):
+        """
+        读取 position 之后写入的完整记录，供多进程共用聊天记录时跟随其它进程的追加
+        :param position: snapshot() 或上次返回的位置 (段日期, 偏移)，None 表示从头读
+        :return: ([(段日期, 行起始偏移, 记录), ...], 下次读取的位置)；没有记录时位置为 None
+        """
+        records = []
+        segments = self.segments()
+        for index, day in enumerate(segments):
+            if position is not None and day < position[0]:
+                continue
+            offset = position[1] if position is not None and day == position[0] else 0
+            with open(self._segment_path(day), 'rb') as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        if index == len(segments) - 1:
+                            break  # 正在写入的半行，下次再读
+                        # 已轮转的段末尾的半行是写入进程中断留下的，不会再写完
+                    else:
+                        try:
+                            records.append((day, offset, json.loads(line)))
+                        except ValueError:
+                            pass
+                    offset += len(line)
+            position = (day, offset)
+        return records, position
+
+    def read_at(self, day, offset):
+        """读取 append/scan 返回的位置上的记录"""
+        with open(self._segment_path(day), 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+    def tail(self, count):
+        """按时间顺序返回最近 count 条记录"""
+        records = []
+        if count > 0:
+            for record in self._records_backwards():
+                records.append(record)
+                if len(records) >= count:
+                    break
+        records.reverse()
+        return records
+
+    def _first_id(self, day):
+        """段内第一条完整记录的 id，段中还没有完整记录时返回 None；段的开头不再变化，结果缓存"""
+        first_id = self._first_ids.get(day)
+        if first_id is None:
+            with open(self._segment_path(day), 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    try:
+                        first_id = json.loads(line).get('id', 0)
+                    except ValueError:
+                        continue
+                    break
+            if first_id is not None:
+                self._first_ids[day] = first_id
+        return first_id
+
+    def before(self, before_id, limit):
+        """按时间顺序返回 id 小于 before_id 的最近 limit 条记录，用于向前翻阅历史"""
+        records = []
+        if limit > 0:
+            # id 随段递增，第一条 id 不小于 before_id 的段整段跳过
+            segments = [(first_id, day) for day, first_id in
+                        ((day, self._first_id(day)) for day in self.segments()) if first_id is not None]
+            end = bisect.bisect_left([first_id for first_id, _ in segments], before_id)
+            for record in self._records_backwards([day for _, day in segments[:end]]):
+                if record.get('id', 0) < before_id:
+                    records.append(record)
+                    if len(records) >= limit:
+                        break
+        records.reverse()
+        return records
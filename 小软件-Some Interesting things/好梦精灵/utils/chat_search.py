@@ -0,0 +1,101 @@
+import re
+import unicodedata
+from array import array
+from bisect import bisect_left
+
+# 中日韩统一表意文字（含扩展 A 和兼容区）按字符二元组切分，字母数字按整词切分
+_TOKEN = re.compile(r'([㐀-䶿一-鿿豈-﫿]+)|([a-z0-9]+)')
+
+
+def normalize(text):
+    """全角转半角、统一大小写，索引和查询使用同一种形式"""
+    return unicodedata.normalize('NFKC', text).lower()
+
+
+def tokenize(text):
+    """
+    切分出索引词：连续汉字取相邻两字（单个汉字不成词），字母数字取整词
+    :param text: 已 normalize 的文本
+    """
+    tokens = set()
+    for match in _TOKEN.finditer(text):
+        han, word = match.groups()
+        if word:
+            tokens.add(word)
+        else:
+            tokens.update(han[i:i + 2] for i in range(len(han) - 1))
+    return tokens
+
+
+def _contains(postings, docno):
+    position = bisect_left(postings, docno)
+    return position < len(postings) and postings[position] == docno
+
+
+class SearchIndex:
+    """聊天记录的倒排索引
+
+    文档按加入顺序编号，同一索引中编号越大越新；每个词的倒排表是递增的文档号数组，
+    按新到旧查找时从最短的倒排表末尾向前遍历，用二分查找确认其余词是否也出现。
+    文档只记录在聊天记录中的位置（段日期、偏移）、消息 id 和时间，正文从聊天记录读取，
+    每条消息在内存中约占十几个索引词 × 4 字节加 26 字节的位置信息。
+    加入需由调用方串行进行；查询可与加入并发。
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.days = []           # 段日期表
+        self._day_index = {}
+        self.day_ids = array('H')
+        self.offsets = array('Q')
+        self.ids = array('Q')
+        self.times = array('d')  # 消息时间（Unix 时间戳），用于跨聊天室按时间合并结果
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, text, day, offset, message_id, timestamp):
+        """
+        加入一条消息，返回文档号
+        :param timestamp: 消息时间的 Unix 时间戳
+        """
+        docno = len(self.ids)
+        day_id = self._day_index.get(day)
+        if day_id is None:
+            day_id = self._day_index[day] = len(self.days)
+            self.days.append(day)
+        for token in tokenize(normalize(text)):
+            postings = self.postings.get(token)
+            if postings is None:
+                postings = self.postings[token] = array('I')
+            postings.append(docno)
+        self.day_ids.append(day_id)
+        self.offsets.append(offset)
+        self.times.append(timestamp)
+        # 最后写入 ids，len(self) 增加时该文档的其它信息已经就绪
+        self.ids.append(message_id)
+        return docno
+
+    def candidates(self, tokens):
+        """按新到旧返回包含全部 tokens 的文档号（可能因二元组不相邻而误中，需调用方核对正文）"""
+        lists = []
+        for token in tokens:
+            postings = self.postings.get(token)
+            if postings is None:
+                return
+            lists.append(postings)
+        if not lists:
+            return
+        lists.sort(key=len)
+        shortest, others = lists[0], lists[1:]
+        limit = len(self)
+        for position in range(len(shortest) - 1, -1, -1):
+            docno = shortest[position]
+            if docno >= limit:
+                continue  # 查询开始后才加入的文档
+            if all(_contains(postings, docno) for postings in others):
+                yield docno
+
+    def location(self, docno):
+        """返回 (段日期, 偏移, 消息 id, 时间戳)"""
+        return self.days[self.day_ids[docno]], self.offsets[docno], self.ids[docno], self.times[docno]
@@ -0,0 +1,47 @@
+import hashlib
+import os
+import threading
+
+# 进程启动时随机生成，计入每个 ETag：重启后从零计数的版本号不会与重启前发出的 ETag 混淆
+_EPOCH = os.urandom(8)
+
+
+def make_etag(*parts, epoch=None):
+    """
+    由数据版本等组成部分生成 ETag（不含引号），相同的组成部分得到相同的 ETag
+    :param epoch: 版本号所属的标识，默认为本进程的；版本号来自共享库时传入 SharedState.epoch()，
+                  各 worker 对相同的数据生成相同的 ETag
+    """
+    digest = hashlib.blake2b(_EPOCH if epoch is None else epoch, digest_size=12)
+    for part in parts:
+        digest.update(repr(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class ConditionalStats:
+    """按接口统计条件请求：总请求数和以 304 应答（客户端缓存仍有效）的次数"""
+
+    def __init__(self):
+        self._counts = {}  # 接口 -> [请求数, 304 次数]
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, not_modified):
+        with self._lock:
+            counts = self._counts.setdefault(endpoint, [0, 0])
+            counts[0] += 1
+            if not_modified:
+                counts[1] += 1
+
+    def snapshot(self):
+        """返回 {接口: {'requests', 'not_modified', 'hit_ratio'}}"""
+        with self._lock:
+            counts = {endpoint: tuple(c) for endpoint, c in self._counts.items()}
+        return {
+            endpoint: {
+                'requests': requests,
+                'not_modified': not_modified,
+                'hit_ratio': round(not_modified / requests, 4) if requests else 0.0
+            }
+            for endpoint, (requests, not_modified) in sorted(counts.items())
+        }
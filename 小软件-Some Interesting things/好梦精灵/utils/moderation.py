@@ -0,0 +1,184 @@
+import os
+import threading
+import time
+import unicodedata
+from collections import deque
+
+
+def _width_table():
+    """全角/半角字符映射到统一形式的转换表，每个字符只映射为一个字符，文本长度不变"""
+    table = {0x3000: ' '}  # 全角空格
+    for code in range(0xFF01, 0xFFEF):
+        folded = unicodedata.normalize('NFKC', chr(code))
+        if len(folded) == 1:
+            table[code] = folded  # 全角字母数字标点 -> 半角，半角片假名 -> 全角
+    for code in range(ord('A'), ord('Z') + 1):
+        table[code] = chr(code + 32)
+    for code, folded in list(table.items()):
+        if 'A' <= folded <= 'Z':
+            table[code] = folded.lower()
+    return table
+
+_WIDTH_TABLE = _width_table()
+
+
+def fold_width(text):
+    """统一全角/半角和英文字母大小写，结果与原文逐字符对应，可直接按位置替换原文"""
+    return text.translate(_WIDTH_TABLE)
+
+
+class AhoCorasick:
+    """多模式匹配自动机
+
+    由词表一次性建立：字典树 + 失败指针，每个节点记录以该节点结尾的最长词长度
+    （包括沿失败指针可达的后缀词）。扫描时每个字符只前进一步，耗时与文本长度成正比，
+    与词数无关。不在任何词中出现的字符直接回到根节点。
+    """
+
+    def __init__(self, words):
+        self.goto = [{}]
+        self.fail = [0]
+        self.length = [0]  # 以该节点结尾的最长词长度，0 表示没有词在此结束
+        for word in words:
+            self._insert(word)
+        self.alphabet = frozenset(ch for node in self.goto for ch in node)
+        self._link()
+
+    def _insert(self, word):
+        node = 0
+        for ch in word:
+            nxt = self.goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.length.append(0)
+            node = nxt
+        if word:
+            self.length[node] = max(self.length[node], len(word))
+
+    def _link(self):
+        """按层建立失败指针"""
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self.goto[node].items():
+                queue.append(child)
+                state = self.fail[node]
+                while state and ch not in self.goto[state]:
+                    state = self.fail[state]
+                self.fail[child] = self.goto[state].get(ch, 0)
+                self.length[child] = max(self.length[child], self.length[self.fail[child]])
+
+    def __len__(self):
+        return len(self.goto)
+
+    def spans(self, text):
+        """返回命中的 (起点, 终点) 列表，同一位置结尾的词只取最长的"""
+        goto, fail, length, alphabet = self.goto, self.fail, self.length, self.alphabet
+        state = 0
+        spans = []
+        for end, ch in enumerate(text, 1):
+            if ch not in alphabet:
+                state = 0
+                continue
+            while True:
+                nxt = goto[state].get(ch)
+                if nxt is not None:
+                    state = nxt
+                    break
+                if not state:
+                    break
+                state = fail[state]
+            if length[state]:
+                spans.append((end - length[state], end))
+        return spans
+
+
+def load_words(path):
+    """读取词表：每行一个词，忽略空行和 # 开头的注释，词按 fold_width 统一形式"""
+    words = set()
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            word = fold_width(line.strip())
+            if word and not word.startswith('#'):
+                words.add(word)
+    return words
+
+
+class ModerationFilter:
+    """聊天消息敏感词过滤
+
+    词表文件修改后自动重新加载：每隔 check_interval 秒检查一次文件修改时间，
+    变化时在后台线程建立新的自动机，建好后整体替换，过滤不会因重建而阻塞。
+    词表文件不存在时不过滤。
+    """
+
+    def __init__(self, word_file, mask='*', check_interval=5.0):
+        """
+        :param word_file: 词表文件路径
+        :param mask: 替换命中词中每个字符的字符
+        :param check_interval: 检查词表文件修改的间隔秒数，None 表示只在调用 reload 时重新加载
+        """
+        self.word_file = word_file
+        self.mask = mask
+        self.check_interval = check_interval
+        self.automaton = AhoCorasick(())
+        self.word_count = 0
+        self.reload_count = 0
+        self.hit_count = 0
+        self._mtime = None
+        self._checked_at = time.monotonic()
+        self._reloading = False
+        self._lock = threading.Lock()
+        self.reload()
+
+    def _file_mtime(self):
+        try:
+            return os.stat(self.word_file).st_mtime_ns
+        except OSError:
+            return None
+
+    def reload(self):
+        """重新读取词表并替换自动机，返回词数"""
+        with self._lock:
+            mtime = self._file_mtime()
+            words = load_words(self.word_file) if mtime is not None else ()
+            self.automaton = AhoCorasick(words)
+            self.word_count = len(words)
+            self._mtime = mtime
+            self.reload_count += 1
+            return self.word_count
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if self.check_interval is None or now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        if self._file_mtime() == self._mtime or self._reloading:
+            return
+        self._reloading = True
+
+        def rebuild():
+            try:
+                self.reload()
+            finally:
+                self._reloading = False
+
+        threading.Thread(target=rebuild, daemon=True).start()
+
+    def censor(self, text):
+        """
+        把命中的词替换为 mask
+        :return: (过滤后的文本, 命中次数)
+        """
+        self._maybe_reload()
+        spans = self.automaton.spans(fold_width(text))
+        if not spans:
+            return text, 0
+        self.hit_count += len(spans)
+        chars = list(text)
+        for start, end in spans:
+            chars[start:end] = self.mask * (end - start)
+        return ''.join(chars), len(spans)
@@ -0,0 +1,93 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class HasherBusy(Exception):
+    """哈希任务队列已满"""
+    pass
+
+
+class PasswordHasher:
+    """在独立进程池中计算密码哈希
+
+    PBKDF2 / scrypt 属于CPU密集型计算，放在请求线程中会拖慢其它接口。
+    排队中的任务数超过 max_pending 时立即抛出 HasherBusy，而不是让请求无限等待。
+    哈希算法和强度通过 method 配置（例如 'pbkdf2:sha256:600000'），
+    登录时发现旧哈希与当前配置不一致即可用 needs_rehash 判断并重新计算。
+    """
+
+    def __init__(self, method=None, workers=None, max_pending=None):
+        """
+        :param method: werkzeug 哈希方法，默认读取 PASSWORD_HASH_METHOD 环境变量
+        :param workers: 进程数，0 表示直接在调用线程中计算
+        :param max_pending: 允许同时排队/执行的任务数
+        """
+        self.method = method or os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+        self._prefix = None
+        if workers is None:
+            workers = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+        self.workers = workers
+        self.max_pending = max_pending or max(workers, 1) * 8
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self.rejected_count = 0
+
+    @property
+    def prefix(self):
+        """当前配置生成的哈希前缀，第一次用到时计算"""
+        # werkzeug 在哈希前缀中写入补全后的参数（'scrypt' -> 'scrypt:32768:8:1'），
+        # 按实际生成的哈希取前缀，简写的配置才不会让每次登录都判定为需要重新计算
+        if self._prefix is None:
+            self._prefix = generate_password_hash('', self.method).split('$', 1)[0]
+        return self._prefix
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            self.rejected_count += 1
+            raise HasherBusy()
+        try:
+            if self.workers == 0:
+                return func(*args)
+            return self._get_executor().submit(func, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        """计算密码哈希"""
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        """校验密码"""
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """哈希参数是否与当前配置不同"""
+        return password_hash.split('$', 1)[0] != self.prefix
+
+    def shutdown(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+_default_hasher = None
+_default_lock = threading.Lock()
+
+
+def get_password_hasher():
+    """获取全局共享的 PasswordHasher，第一次调用时才创建，导入本模块不会启动进程池或计算哈希"""
+    global _default_hasher
+    with _default_lock:
+        if _default_hasher is None:
+            _default_hasher = PasswordHasher()
+        return _default_hasher
@@ -0,0 +1,411 @@
+import bisect
+import json
+import os
+import threading
+from datetime import date, datetime, timedelta
+
+SEGMENT_SUFFIX = '.jsonl'
+
+
+def encode_days(ordinals):
+    """把日期序号集合编码成 [起始日期, 十六进制位图]，第 i 位表示起始日期后第 i 天"""
+    first = min(ordinals)
+    bits = 0
+    for day in ordinals:
+        bits |= 1 << (day - first)
+    return [date.fromordinal(first).isoformat(), format(bits, 'x')]
+
+
+def decode_days(encoded):
+    """encode_days 的逆过程，返回 (起始日期序号, 位图整数)"""
+    first, bits = encoded
+    return date.fromisoformat(first).toordinal(), int(bits, 16)
+
+
+class _UserIndex:
+    """单个用户在账本中的索引，三个列表按追加顺序一一对应"""
+
+    __slots__ = ('timestamps', 'totals', 'locations')
+
+    def __init__(self):
+        self.timestamps = []  # 记录时间（ISO 字符串）
+        self.totals = []      # 前缀和：totals[i] 为前 i+1 条记录的积分合计
+        self.locations = []   # (段序号, 行起始偏移)
+
+    def add(self, timestamp, points, location):
+        self.timestamps.append(timestamp)
+        self.totals.append((self.totals[-1] if self.totals else 0) + points)
+        self.locations.append(location)
+
+
+class PointsLedger:
+    """积分流水账本（分段追加写的 JSONL）
+
+    所有用户的积分变动追加到同一组段文件（00000001.jsonl、00000002.jsonl ...），
+    当前段超过 segment_size 字节后轮转到新段。内存中为每个用户保存记录的位置和
+    时间前缀和，"最近 N 条"只需按偏移读取 N 行，"时间段内积分合计"只需两次二分查找。
+    启动时扫描全部段重建索引；进程中断留下的半行会被截掉。
+    compact() 把已封存的段合并成一段，去掉被 forget() 的用户，并可把某个时间之前的
+    记录按用户合并成一条结转记录。合并期间只在开始和结束时短暂持有锁，不阻塞追加。
+    设置 auto_compact 后，上次合并以来封存的数据超过 auto_compact 个段且不少于已合并段的
+    大小时，在后台线程中合并，早于 keep_days 天的记录结转，启动时的重放量因此保持有界。
+    同一用户的记录时间需非递减（按当前时间追加即满足）。
+
+    记录可带 action 字段表示积分来自哪种行为；结转时这些记录的日期按行为编码成
+    日期位图保存在 days 字段中，供连续天数等派生索引重建。
+    observers 中的对象在加载和追加时依次收到每条记录（observe），
+    重新加载前会收到 reset()，可据此在内存中维护派生索引。
+    """
+
+    def __init__(self, base_dir, segment_size=4 * 1024 * 1024, fsync=False, observers=None,
+                 auto_compact=None, keep_days=None):
+        """
+        :param base_dir: 段文件所在目录
+        :param segment_size: 单个段文件的大小上限（字节）
+        :param fsync: 每次追加后是否 fsync
+        :param observers: 派生索引列表，需实现 reset() 和 observe(record)，在账本锁内调用
+        :param auto_compact: 自动合并的阈值（段数），None 表示只在调用 compact() 时合并
+        :param keep_days: 自动合并时保留明细的天数，更早的记录结转，None 表示全部保留
+        """
+        self.base_dir = base_dir
+        self.segment_size = segment_size
+        self.fsync = fsync
+        self.observers = list(observers or [])
+        self.auto_compact = auto_compact
+        self.keep_days = keep_days
+        self.users = {}
+        self.segments = []
+        self.compact_count = 0
+        self._lock = threading.RLock()
+        self._compact_lock = threading.Lock()
+        self._compact_thread = None
+        self._active = None
+        self._active_size = 0
+        self._readers = {}
+        self._base_size = 0     # 上次合并生成的段的大小
+        self._sealed_size = 0   # 之后封存的段的大小合计
+        os.makedirs(base_dir, exist_ok=True)
+        self.load()
+
+    def _segment_path(self, number):
+        return os.path.join(self.base_dir, f'{number:08d}{SEGMENT_SUFFIX}')
+
+    def load(self):
+        """扫描全部段文件重建索引"""
+        with self._lock:
+            self._close_files()
+            self._reset()
+            self.segments = sorted(
+                int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.base_dir)
+                if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit()
+            )
+            for number in list(self.segments):
+                self._scan(number)
+            if not self.segments:
+                self.segments = [1]
+            self._open_active()
+            self._base_size = self._sealed_size = 0
+            for number in self.segments[:-1]:
+                size = os.path.getsize(self._segment_path(number))
+                if number == self.segments[0] and self._is_compacted(number):
+                    self._base_size = size
+                else:
+                    self._sealed_size += size
+
+    def _is_compacted(self, number):
+        with open(self._segment_path(number), 'rb') as f:
+            return f.read(len(b'{"compacted_through"')) == b'{"compacted_through"'
+
+    def _scan(self, number):
+        path = self._segment_path(number)
+        offset = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    offset += len(line)
+                    continue
+                if 'compacted_through' in record:
+                    # 合并后的段包含之前所有段的有效记录，丢弃已建立的索引和残留的旧段
+                    self._drop_segments_before(number)
+                else:
+                    if record.get('forget'):
+                        self.users.pop(record['user'], None)
+                    else:
+                        self._index(record, (number, offset))
+                    self._notify(record)
+                offset += len(line)
+        if offset < os.path.getsize(path):
+            # 截掉进程中断时写了一半的记录
+            with open(path, 'r+b') as f:
+                f.truncate(offset)
+
+    def _reset(self):
+        self.users = {}
+        for observer in self.observers:
+            observer.reset()
+
+    def _notify(self, record):
+        for observer in self.observers:
+            observer.observe(record)
+
+    def _drop_segments_before(self, number):
+        self._reset()
+        for old in [n for n in self.segments if n < number]:
+            os.remove(self._segment_path(old))
+            self.segments.remove(old)
+
+    def _index(self, record, location):
+        index = self.users.get(record['user'])
+        if index is None:
+            index = self.users[record['user']] = _UserIndex()
+        index.add(record['ts'], record['points'], location)
+
+    def _open_active(self):
+        number = self.segments[-1]
+        path = self._segment_path(number)
+        self._active = open(path, 'ab')
+        self._active_size = self._active.tell()
+
+    def _rotate(self):
+        self._active.close()
+        self._sealed_size += self._active_size
+        self.segments.append(self.segments[-1] + 1)
+        self._open_active()
+        if (self.auto_compact and self._compact_thread is None and not self._compact_lock.locked()
+                and self._sealed_size >= max(self.auto_compact * self.segment_size, self._base_size)):
+            self._compact_thread = threading.Thread(target=self._auto_compact, daemon=True)
+            self._compact_thread.start()
+
+    def _auto_compact(self):
+        try:
+            keep_since = None
+            if self.keep_days is not None:
+                keep_since = (datetime.now() - timedelta(days=self.keep_days)).isoformat()
+            self.compact(keep_since)
+        finally:
+            self._compact_thread = None
+
+    def _write(self, line):
+        """在锁内写入一行或多行，返回起始位置"""
+        if self._active_size and self._active_size + len(line) > self.segment_size:
+            self._rotate()
+        location = (self.segments[-1], self._active_size)
+        self._active.write(line)
+        self._active.flush()
+        if self.fsync:
+            os.fsync(self._active.fileno())
+        self._active_size += len(line)
+        return location
+
+    def append(self, user_id, points, reason='', timestamp=None, action=None):
+        """
+        追加一条积分记录
+        :param user_id: 用户ID
+        :param points: 积分变动
+        :param reason: 原因
+        :param timestamp: ISO 格式时间，默认为当前时间
+        :param action: 产生积分的行为类型
+        :return: 写入的记录
+        """
+        record = self._record(user_id, points, reason, timestamp, action)
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        with self._lock:
+            self._index(record, self._write(line))
+            self._notify(record)
+        return record
+
+    def append_many(self, entries):
+        """
+        一次写入多条记录（一次 write 调用，整批写入同一段）
+        :param entries: [(user_id, points, reason, timestamp, action), ...]
+        :return: 写入的记录列表
+        """
+        records = [self._record(*entry) for entry in entries]
+        if not records:
+            return records
+        lines = [(json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8') for record in records]
+        with self._lock:
+            location = self._write(b''.join(lines))
+            number, offset = location
+            for record, line in zip(records, lines):
+                self._index(record, (number, offset))
+                self._notify(record)
+                offset += len(line)
+        return records
+
+    @staticmethod
+    def _record(user_id, points, reason='', timestamp=None, action=None):
+        record = {
+            'user': user_id,
+            'ts': timestamp or datetime.now().isoformat(),
+            'points': points,
+            'reason': reason
+        }
+        if action:
+            record['action'] = action
+        return record
+
+    def forget(self, user_id):
+        """删除用户的全部记录（索引立即移除，文件中的记录在合并时清除）"""
+        record = {'user': user_id, 'forget': True}
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        with self._lock:
+            if self.users.pop(user_id, None) is not None:
+                self._write(line)
+                self._notify(record)
+
+    def _read(self, location, readers=None):
+        """读取一条记录；readers 为合并时不持锁使用的另一组文件句柄"""
+        if readers is None:
+            readers = self._readers
+        number, offset = location
+        reader = readers.get(number)
+        if reader is None:
+            reader = readers[number] = open(self._segment_path(number), 'rb')
+        reader.seek(offset)
+        return json.loads(reader.readline())
+
+    def last(self, user_id, count=20):
+        """
+        获取用户最近的 count 条记录（按时间顺序）
+        :return: [{'timestamp', 'points', 'reason'}, ...]
+        """
+        with self._lock:
+            index = self.users.get(user_id)
+            if index is None or count <= 0:
+                return []
+            records = [self._read(location) for location in index.locations[-count:]]
+        return [self._entry(record) for record in records]
+
+    @staticmethod
+    def _entry(record):
+        entry = {'timestamp': record['ts'], 'points': record['points'], 'reason': record.get('reason', '')}
+        if 'action' in record:
+            entry['action'] = record['action']
+        return entry
+
+    def count(self, user_id):
+        """用户的记录条数"""
+        index = self.users.get(user_id)
+        return len(index.timestamps) if index else 0
+
+    def sum(self, user_id, start=None, end=None):
+        """
+        计算时间段 [start, end) 内的积分合计
+        :param start: 起始时间（ISO 格式，可只写日期），None 表示不限
+        :param end: 结束时间（不含），None 表示不限
+        """
+        with self._lock:
+            index = self.users.get(user_id)
+            if index is None:
+                return 0
+            lo = bisect.bisect_left(index.timestamps, start) if start else 0
+            hi = bisect.bisect_left(index.timestamps, end) if end else len(index.timestamps)
+            if hi <= lo:
+                return 0
+            return index.totals[hi - 1] - (index.totals[lo - 1] if lo else 0)
+
+    def compact(self, keep_since=None):
+        """
+        合并已封存的段
+        先在锁内把当前段封存并记下各用户当时的记录位置，然后不持锁读取旧段、写出仍有效的记录到新段，
+        最后在锁内替换旧段，并把合并期间新追加的记录接到新的索引之后。
+        :param keep_since: 早于该时间的记录按用户合并成一条结转记录（积分求和，
+                           各行为的日期编码成位图），None 表示全部保留
+        :return: 合并后的记录条数
+        """
+        with self._compact_lock:
+            with self._lock:
+                self._rotate()
+                sealed = self.segments[:-1]
+                target = sealed[-1]
+                # 合并期间同一用户对象可能继续追加记录，只记下当时的条数
+                snapshot = [(user_id, index, len(index.locations)) for user_id, index in self.users.items()]
+            tmp_path = self._segment_path(target) + '.compacting'
+            compacted = {}
+            readers = {}
+            try:
+                with open(tmp_path, 'wb') as out:
+                    header = {'compacted_through': target}
+                    offset = out.write((json.dumps(header) + '\n').encode('utf-8'))
+                    for user_id, index, length in snapshot:
+                        new_index = compacted[user_id] = _UserIndex()
+                        cut = bisect.bisect_left(index.timestamps, keep_since, 0, length) if keep_since else 0
+                        records = []
+                        if cut:
+                            carry = {
+                                'user': user_id,
+                                'ts': index.timestamps[cut - 1],
+                                'points': index.totals[cut - 1],
+                                'reason': '历史结转'
+                            }
+                            days = self._carry_days(index.locations[:cut], readers)
+                            if days:
+                                carry['days'] = days
+                            records.append(carry)
+                        records.extend(self._read(location, readers) for location in index.locations[cut:length])
+                        for record in records:
+                            line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+                            new_index.add(record['ts'], record['points'], (target, offset))
+                            offset += out.write(line)
+                    out.flush()
+                    os.fsync(out.fileno())
+            finally:
+                for reader in readers.values():
+                    reader.close()
+
+            with self._lock:
+                self._close_readers(sealed)
+                os.replace(tmp_path, self._segment_path(target))
+                # 合并段带有标记，即使删除旧段前中断，下次加载时也会丢弃旧段
+                for number in sealed[:-1]:
+                    os.remove(self._segment_path(number))
+                self.segments = [n for n in self.segments if n >= target]
+                for user_id, index, length in snapshot:
+                    if self.users.get(user_id) is not index:
+                        continue  # 合并期间被 forget，此后的记录（如有）都在新段中
+                    new_index = compacted[user_id]
+                    for i in range(length, len(index.locations)):
+                        points = index.totals[i] - (index.totals[i - 1] if i else 0)
+                        new_index.add(index.timestamps[i], points, index.locations[i])
+                    self.users[user_id] = new_index
+                self._base_size = os.path.getsize(self._segment_path(target))
+                self._sealed_size = sum(os.path.getsize(self._segment_path(n)) for n in self.segments[1:-1])
+                self.compact_count += 1
+                return sum(len(compacted[user_id].locations) for user_id, _, _ in snapshot)
+
+    def _carry_days(self, locations, readers):
+        """收集被结转记录中各行为的日期，编码成 {行为: [起始日期, 十六进制位图]}"""
+        days = {}
+        for location in locations:
+            record = self._read(location, readers)
+            if 'action' in record:
+                days.setdefault(record['action'], set()).add(date.fromisoformat(record['ts'][:10]).toordinal())
+            for action, encoded in record.get('days', {}).items():
+                ordinals = days.setdefault(action, set())
+                first, bits = decode_days(encoded)
+                while bits:
+                    low = bits & -bits
+                    ordinals.add(first + low.bit_length() - 1)
+                    bits ^= low
+        return {action: encode_days(ordinals) for action, ordinals in days.items()}
+
+    def _close_files(self):
+        if self._active is not None:
+            self._active.close()
+            self._active = None
+        self._close_readers(list(self._readers))
+
+    def _close_readers(self, numbers):
+        for number in numbers:
+            reader = self._readers.pop(number, None)
+            if reader is not None:
+                reader.close()
+
+    def close(self):
+        with self._lock:
+            self._close_files()
@@ -0,0 +1,127 @@
+import threading
+import time
+
+
+class PresenceTracker:
+    """基于心跳的在线状态，超过 ttl 秒没有心跳的用户视为离线
+
+    过期时间按 resolution 秒分桶（时间轮）：心跳只把用户从旧桶移到新桶，
+    过期检查按时间顺序处理已到期的桶，桶中的用户都已过期，不需要遍历全部在线用户。
+    在线人数随加入/离开/过期增量维护；成员每次变化 version 加一，
+    在线用户列表在 version 变化后才重新生成，两次变化之间的查询共用同一个元组。
+    """
+
+    def __init__(self, ttl=15.0, resolution=1.0, clock=time.monotonic, on_change=None):
+        """
+        :param ttl: 心跳超时秒数
+        :param resolution: 过期时间的精度（秒），实际过期可能晚最多一个 resolution
+        :param clock: 时间函数，测试时可替换
+        :param on_change: 在线人数变化时调用的函数，参数为当前人数
+        """
+        self.ttl = ttl
+        self.resolution = resolution
+        self.clock = clock
+        self.on_change = on_change
+        self._tick = {}      # 用户 -> 所在的桶
+        self._buckets = {}   # 桶 -> 用户集合
+        self._next_tick = self._tick_of(clock())
+        self._snapshot = ()
+        self._snapshot_version = 0
+        self.version = 0     # 成员变化次数，可用作在线列表的版本号
+        self._lock = threading.Lock()
+        self.expired_count = 0
+
+    def _tick_of(self, moment):
+        return int(moment // self.resolution)
+
+    def __len__(self):
+        return len(self._tick)
+
+    def __contains__(self, username):
+        return username in self._tick
+
+    def heartbeat(self, username):
+        """记录心跳（也用于加入），刷新过期时间"""
+        with self._lock:
+            now = self.clock()
+            changed = self._expire(now)
+            # 向上取整到桶边界，保证至少 ttl 秒后才过期
+            tick = self._tick_of(now + self.ttl) + 1
+            old = self._tick.get(username)
+            if old != tick:
+                if old is None:
+                    changed = True
+                    self.version += 1
+                else:
+                    self._discard(old, username)
+                self._tick[username] = tick
+                self._buckets.setdefault(tick, set()).add(username)
+            count = len(self._tick)
+        if changed:
+            self._changed(count)
+
+    def leave(self, username):
+        """主动离开"""
+        with self._lock:
+            tick = self._tick.pop(username, None)
+            if tick is not None:
+                self._discard(tick, username)
+                self.version += 1
+            count = len(self._tick)
+        if tick is not None:
+            self._changed(count)
+
+    def _discard(self, tick, username):
+        bucket = self._buckets.get(tick)
+        if bucket is not None:
+            bucket.discard(username)
+            if not bucket:
+                del self._buckets[tick]
+
+    def _expire(self, now):
+        """处理所有已到期的桶，返回是否有用户过期"""
+        current = self._tick_of(now)
+        expired = False
+        if current - self._next_tick > len(self._buckets):
+            # 长时间没有检查时直接找出到期的桶，而不是逐个时间片推进
+            due = sorted(tick for tick in self._buckets if tick <= current)
+        else:
+            due = [tick for tick in range(self._next_tick, current + 1) if tick in self._buckets]
+        for tick in due:
+            for username in self._buckets.pop(tick):
+                del self._tick[username]
+                self.expired_count += 1
+                expired = True
+        self._next_tick = max(self._next_tick, current + 1)
+        if expired:
+            self.version += 1
+        return expired
+
+    def _changed(self, count):
+        if self.on_change is not None:
+            self.on_change(count)
+
+    def expire(self):
+        """清理已过期的用户，返回在线人数"""
+        now = self.clock()
+        if self._tick_of(now) < self._next_tick:
+            return len(self._tick)  # 当前时间片已处理过，不需要加锁
+        with self._lock:
+            changed = self._expire(now)
+            count = len(self._tick)
+        if changed:
+            self._changed(count)
+        return count
+
+    def count(self):
+        """在线人数"""
+        return self.expire()
+
+    def users(self):
+        """在线用户元组，成员未变化时返回同一个对象"""
+        self.expire()
+        with self._lock:
+            if self._snapshot_version != self.version:
+                self._snapshot = tuple(sorted(self._tick))
+                self._snapshot_version = self.version
+            return self._snapshot
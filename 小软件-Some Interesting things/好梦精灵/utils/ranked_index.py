@@ -0,0 +1,214 @@
+import bisect
+import random
+
+MAX_LEVEL = 32
+LEVEL_P = 0.25
+
+
+class _Node:
+    __slots__ = ('key', 'forward', 'span')
+
+    def __init__(self, key, level):
+        self.key = key
+        self.forward = [None] * level
+        # span[i]：沿第 i 层前进到 forward[i] 会跨过多少个节点，用于计算排名
+        self.span = [0] * level
+
+
+class RankedIndex:
+    """按分数降序排列的可索引跳表
+
+    插入、删除、更新分数和查询排名均为 O(log n)，取前 k 名为 O(k)。
+    分数相同时按成员名升序排列。
+    """
+
+    def __init__(self, items=None):
+        self.clear()
+        if items:
+            for member, score in items:
+                self.set(member, score)
+
+    def clear(self):
+        self.head = _Node(None, MAX_LEVEL)
+        self.level = 1
+        self.length = 0
+        self.scores = {}
+
+    def __len__(self):
+        return self.length
+
+    def __contains__(self, member):
+        return member in self.scores
+
+    def score(self, member):
+        return self.scores.get(member)
+
+    def set(self, member, score):
+        """插入成员或更新其分数"""
+        old_score = self.scores.get(member)
+        if old_score is not None:
+            if old_score == score:
+                return
+            self._delete((-old_score, member))
+        self._insert((-score, member))
+        self.scores[member] = score
+
+    def add(self, member, delta):
+        """累加分数，返回新分数"""
+        score = self.scores.get(member, 0) + delta
+        self.set(member, score)
+        return score
+
+    def remove(self, member):
+        old_score = self.scores.pop(member, None)
+        if old_score is None:
+            return False
+        self._delete((-old_score, member))
+        return True
+
+    def rank(self, member):
+        """返回成员排名（从1开始），不存在返回 None"""
+        score = self.scores.get(member)
+        if score is None:
+            return None
+
+        key = (-score, member)
+        rank = 0
+        x = self.head
+        for i in range(self.level - 1, -1, -1):
+            while x.forward[i] is not None and x.forward[i].key <= key:
+                rank += x.span[i]
+                x = x.forward[i]
+            if x.key == key:
+                return rank
+        return None
+
+    def top(self, k):
+        """返回前 k 名 [(member, score), ...]"""
+        result = []
+        x = self.head.forward[0]
+        while x is not None and len(result) < k:
+            result.append((x.key[1], -x.key[0]))
+            x = x.forward[0]
+        return result
+
+    def iter_from(self, score=None, member=''):
+        """
+        按排名顺序遍历 (member, score)
+        :param score: 与 member 一起指定起点，只返回排在 (score, member) 之后的成员；None 表示从第一名开始
+        """
+        x = self.head
+        if score is not None:
+            key = (-score, member)
+            for i in range(self.level - 1, -1, -1):
+                while x.forward[i] is not None and x.forward[i].key <= key:
+                    x = x.forward[i]
+        x = x.forward[0]
+        while x is not None:
+            yield x.key[1], -x.key[0]
+            x = x.forward[0]
+
+    def _random_level(self):
+        level = 1
+        while level < MAX_LEVEL and random.random() < LEVEL_P:
+            level += 1
+        return level
+
+    def _insert(self, key):
+        update = [None] * MAX_LEVEL
+        rank = [0] * MAX_LEVEL
+        x = self.head
+        for i in range(self.level - 1, -1, -1):
+            rank[i] = 0 if i == self.level - 1 else rank[i + 1]
+            while x.forward[i] is not None and x.forward[i].key < key:
+                rank[i] += x.span[i]
+                x = x.forward[i]
+            update[i] = x
+
+        level = self._random_level()
+        if level > self.level:
+            for i in range(self.level, level):
+                rank[i] = 0
+                update[i] = self.head
+                self.head.span[i] = self.length
+            self.level = level
+
+        node = _Node(key, level)
+        for i in range(level):
+            node.forward[i] = update[i].forward[i]
+            update[i].forward[i] = node
+            node.span[i] = update[i].span[i] - (rank[0] - rank[i])
+            update[i].span[i] = rank[0] - rank[i] + 1
+
+        for i in range(level, self.level):
+            update[i].span[i] += 1
+        self.length += 1
+
+    def _delete(self, key):
+        update = [None] * MAX_LEVEL
+        x = self.head
+        for i in range(self.level - 1, -1, -1):
+            while x.forward[i] is not None and x.forward[i].key < key:
+                x = x.forward[i]
+            update[i] = x
+
+        x = x.forward[0]
+        if x is None or x.key != key:
+            return
+
+        for i in range(self.level):
+            if update[i].forward[i] is x:
+                update[i].span[i] += x.span[i] - 1
+                update[i].forward[i] = x.forward[i]
+            else:
+                update[i].span[i] -= 1
+
+        while self.level > 1 and self.head.forward[self.level - 1] is None:
+            self.level -= 1
+        self.length -= 1
+
+
+class SortedIndex:
+    """按 (key, member) 升序排列的有序列表
+
+    用于注册时间、用户名等次要排序：查找起点 O(log n)，插入删除需要移动列表元素，
+    在几十万条数据下仍只是一次内存拷贝。
+    """
+
+    def __init__(self, items=None):
+        self.entries = sorted(items or [])
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        self.entries = []
+
+    def add(self, key, member):
+        bisect.insort(self.entries, (key, member))
+
+    def remove(self, key, member):
+        index = bisect.bisect_left(self.entries, (key, member))
+        if index < len(self.entries) and self.entries[index] == (key, member):
+            del self.entries[index]
+
+    def iter_from(self, after=None, reverse=False):
+        """
+        遍历 (key, member)
+        :param after: 只返回排在该 (key, member) 之后的条目（reverse 时为之前）
+        :param reverse: 降序遍历
+        """
+        entries = self.entries
+        if reverse:
+            index = len(entries) if after is None else bisect.bisect_left(entries, tuple(after))
+            while True:
+                # 遍历期间列表可能被修改，每次都重新约束下标
+                index = min(index, len(entries)) - 1
+                if index < 0:
+                    return
+                yield entries[index]
+        else:
+            index = 0 if after is None else bisect.bisect_right(entries, tuple(after))
+            while index < len(entries):
+                yield entries[index]
+                index += 1
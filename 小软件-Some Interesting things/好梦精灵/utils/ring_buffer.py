@@ -0,0 +1,77 @@
+class RingBuffer:
+    """按递增序号存取的固定容量环形缓冲区
+
+    元素与其序号按写入顺序存放在固定数量的槽位中，写满后新元素覆盖最旧的元素。
+    序号单调递增但允许跳跃（如重启后从预留的序号继续），
+    取某个序号之后的增量时二分查找起点，只复制新元素，不用遍历整个缓冲区。
+    """
+
+    def __init__(self, capacity, next_seq=1):
+        """
+        :param capacity: 最多保存的元素数
+        :param next_seq: 下一个元素的序号
+        """
+        if capacity <= 0:
+            raise ValueError('capacity 必须大于 0')
+        self.capacity = capacity
+        self.slots = [None] * capacity
+        self.start = 0  # 最旧元素所在槽位
+        self.count = 0
+        self.next_seq = next_seq
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return iter(self.tail(self.count))
+
+    @property
+    def last_seq(self):
+        """最后一个元素的序号，尚无元素时为 next_seq - 1"""
+        return self.next_seq - 1
+
+    def _entry(self, index):
+        return self.slots[(self.start + index) % self.capacity]
+
+    def append(self, item, seq=None):
+        """
+        追加元素
+        :param seq: 指定序号（不能小于 next_seq），默认为 next_seq
+        :return: 元素的序号
+        """
+        if seq is None:
+            seq = self.next_seq
+        self.skip_to(seq)
+        if self.count < self.capacity:
+            self.slots[(self.start + self.count) % self.capacity] = (seq, item)
+            self.count += 1
+        else:
+            self.slots[self.start] = (seq, item)
+            self.start = (self.start + 1) % self.capacity
+        self.next_seq = seq + 1
+        return seq
+
+    def skip_to(self, seq):
+        """跳过 seq 之前尚未使用的序号，下一个元素的序号为 seq"""
+        if seq < self.next_seq:
+            raise ValueError('序号必须递增')
+        self.next_seq = seq
+
+    def since(self, after, limit=None):
+        """
+        返回序号大于 after 的元素（按序号顺序）
+        :param limit: 最多返回最早的 limit 个，调用方以最后一个的序号继续向后取
+        """
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            if self._entry(mid)[0] <= after:
+                low = mid + 1
+            else:
+                high = mid
+        high = self.count if limit is None else min(self.count, low + limit)
+        return [self._entry(index)[1] for index in range(low, high)]
+
+    def tail(self, count):
+        """最新的 count 个元素"""
+        return [self._entry(index)[1] for index in range(max(self.count - count, 0), self.count)]
@@ -0,0 +1,170 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import MutableMapping
+
+# 未过期的条件，参数为当前时间
+_ALIVE = '(expires_at IS NULL OR expires_at > ?)'
+
+
+class SharedState:
+    """多进程共享状态（SQLite WAL）
+
+    gunicorn 等多 worker 部署时，每个进程各自的内存字典会互相看不到修改。
+    这里把需要共享的状态放进同一个 SQLite 数据库：WAL 模式下读不阻塞写，
+    每个线程使用独立连接，fork 之后在子进程中自动重新连接。
+    提供两种结构：按命名空间划分的键值表（可设置过期时间），以及按频道追加的日志。
+    """
+
+    def __init__(self, db_file, timeout=30.0):
+        """
+        :param db_file: 数据库文件路径
+        :param timeout: 等待写锁的秒数
+        """
+        self.db_file = db_file
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(os.path.abspath(self.db_file))
+            os.makedirs(directory, exist_ok=True)
+            # isolation_level=None：每条语句自动提交，其它进程立即可见
+            conn = sqlite3.connect(self.db_file, timeout=self.timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS kv (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL,
+                    PRIMARY KEY (namespace, key)
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS log (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    channel TEXT NOT NULL,
+                    payload TEXT NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_log_channel ON log (channel, id)')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def namespace(self, name, ttl=None):
+        """返回某个命名空间的字典视图"""
+        return SharedDict(self, name, ttl)
+
+    def epoch(self):
+        """
+        本共享库的随机标识（bytes），第一次调用时生成并写入库中，各进程读到的相同；
+        库文件重建后改变，可与库中的版本号一起生成 ETag，避免重建后从头计数的版本号被误认
+        """
+        epoch = getattr(self, '_epoch', None)
+        if epoch is None:
+            conn = self._conn()
+            conn.execute("INSERT OR IGNORE INTO kv (namespace, key, value) VALUES ('_meta', 'epoch', ?)",
+                         (json.dumps(os.urandom(8).hex()),))
+            row = conn.execute("SELECT value FROM kv WHERE namespace = '_meta' AND key = 'epoch'").fetchone()
+            epoch = self._epoch = bytes.fromhex(json.loads(row[0]))
+        return epoch
+
+    # ---- 追加日志 ----
+
+    def append(self, channel, record, keep=None):
+        """
+        追加一条记录，返回自增 id（跨进程单调递增）
+        :param keep: 只保留该频道最近的 keep 条记录
+        """
+        conn = self._conn()
+        cursor = conn.execute('INSERT INTO log (channel, payload) VALUES (?, ?)',
+                              (channel, json.dumps(record, ensure_ascii=False)))
+        record_id = cursor.lastrowid
+        if keep and record_id % keep == 0:
+            # 每追加 keep 条清理一次，避免每次写入都做删除
+            conn.execute('DELETE FROM log WHERE channel = ? AND id <= ?', (channel, record_id - keep))
+        return record_id
+
+    def tail(self, channel, limit):
+        """按时间顺序返回频道最近 limit 条记录 [(id, record), ...]"""
+        rows = self._conn().execute(
+            'SELECT id, payload FROM log WHERE channel = ? ORDER BY id DESC LIMIT ?', (channel, limit)
+        ).fetchall()
+        return [(record_id, json.loads(payload)) for record_id, payload in reversed(rows)]
+
+    def since(self, channel, after, limit):
+        """按时间顺序返回 id 大于 after 的记录，最多最早的 limit 条 [(id, record), ...]"""
+        rows = self._conn().execute(
+            'SELECT id, payload FROM log WHERE channel = ? AND id > ? ORDER BY id LIMIT ?', (channel, after, limit)
+        ).fetchall()
+        return [(record_id, json.loads(payload)) for record_id, payload in rows]
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class SharedDict(MutableMapping):
+    """SharedState 中一个命名空间的字典视图，值需可 JSON 序列化
+
+    读取返回的是副本，修改嵌套的值后需要重新赋值才能写回。
+    """
+
+    def __init__(self, state, name, ttl=None):
+        self.state = state
+        self.name = name
+        self.ttl = ttl
+
+    def __getitem__(self, key):
+        row = self.state._conn().execute(
+            f'SELECT value FROM kv WHERE namespace = ? AND key = ? AND {_ALIVE}', (self.name, key, time.time())
+        ).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return json.loads(row[0])
+
+    def __setitem__(self, key, value):
+        expires_at = time.time() + self.ttl if self.ttl else None
+        self.state._conn().execute(
+            'INSERT OR REPLACE INTO kv (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)',
+            (self.name, key, json.dumps(value, ensure_ascii=False), expires_at)
+        )
+
+    def __delitem__(self, key):
+        cursor = self.state._conn().execute('DELETE FROM kv WHERE namespace = ? AND key = ?', (self.name, key))
+        if cursor.rowcount == 0:
+            raise KeyError(key)
+
+    def __iter__(self):
+        rows = self.state._conn().execute(
+            f'SELECT key FROM kv WHERE namespace = ? AND {_ALIVE} ORDER BY key', (self.name, time.time())
+        ).fetchall()
+        return iter([row[0] for row in rows])
+
+    def __len__(self):
+        return self.state._conn().execute(
+            f'SELECT COUNT(*) FROM kv WHERE namespace = ? AND {_ALIVE}', (self.name, time.time())
+        ).fetchone()[0]
+
+    def items(self):
+        """一次查询取出全部键值对"""
+        rows = self.state._conn().execute(
+            f'SELECT key, value FROM kv WHERE namespace = ? AND {_ALIVE} ORDER BY key', (self.name, time.time())
+        ).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def purge_expired(self):
+        """删除已过期的键，返回删除数量"""
+        cursor = self.state._conn().execute(
+            'DELETE FROM kv WHERE namespace = ? AND expires_at IS NOT NULL AND expires_at <= ?',
+            (self.name, time.time())
+        )
+        return cursor.rowcount
@@ -3,8 +3,11 @@ import time
 import base64
 
 class SimpleQRGenerator:
-    def __init__(self):
-        self.pending_binds = {}
+    def __init__(self, pending_binds=None):
+        """
+        :param pending_binds: 保存待确认绑定的字典，多个请求/进程共用同一个才能查到状态
+        """
+        self.pending_binds = pending_binds if pending_binds is not None else {}
     
     def generate_bind_qr(self, username):
         """生成简单的绑定二维码（文本形式）"""
@@ -70,5 +73,6 @@ class SimpleQRGenerator:
         bind_info['status'] = 'confirmed'
         bind_info['openid'] = openid
         bind_info['wechat_info'] = wechat_info
+        self.pending_binds[bind_code] = bind_info  # 共享字典读取的是副本，需要写回
         
         return True
\ No newline at end of file
@@ -0,0 +1,299 @@
+import datetime
+import hashlib
+import math
+import operator
+import os
+import struct
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+# 磁盘记录：日期序数、睡眠时长、入睡时间（当天分钟数）、睡眠质量，每条 22 字节
+RECORD = struct.Struct('<IdHd')
+NO_BEDTIME = 0xFFFF  # 缺少入睡时间
+NO_VALUE = float('nan')  # 缺少睡眠时长或质量
+
+
+def parse_bedtime(text):
+    """把 "HH:MM" 转为当天的分钟数，格式不对时返回 None"""
+    try:
+        hour, minute = str(text).split(':')[:2]
+        minutes = int(hour) * 60 + int(minute)
+    except (TypeError, ValueError):
+        return None
+    return minutes if 0 <= minutes < 24 * 60 else None
+
+
+def format_bedtime(minutes):
+    return f'{minutes // 60:02d}:{minutes % 60:02d}'
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return NO_VALUE
+
+
+class SleepSeries:
+    """一个用户按日期排序的睡眠记录，按列存放：日期、时长、入睡时间、质量各一个数组"""
+
+    def __init__(self):
+        self.days = array('I')       # date.toordinal()
+        self.hours = array('d')
+        self.bedtimes = array('H')   # 当天分钟数，NO_BEDTIME 表示缺失
+        self.quality = array('d')
+
+    def __len__(self):
+        return len(self.days)
+
+    def put(self, day, hours, bedtime, quality):
+        """写入一天的记录，同一天已有记录时覆盖"""
+        position = len(self.days)
+        if position and self.days[-1] >= day:
+            position = bisect_left(self.days, day)
+            if position < len(self.days) and self.days[position] == day:
+                self.hours[position] = hours
+                self.bedtimes[position] = bedtime
+                self.quality[position] = quality
+                return
+        self.days.insert(position, day)
+        self.hours.insert(position, hours)
+        self.bedtimes.insert(position, bedtime)
+        self.quality.insert(position, quality)
+
+    def window(self, start, end=None):
+        """返回日期序数在 [start, end) 内的记录下标范围 (lo, hi)"""
+        lo = bisect_left(self.days, start)
+        hi = len(self.days) if end is None else bisect_left(self.days, end, lo)
+        return lo, hi
+
+    def entry(self, position):
+        """第 position 条记录，格式与旧版 sleep_data 相同，缺失的字段不出现"""
+        entry = {}
+        if not math.isnan(self.hours[position]):
+            entry['sleep_hours'] = self.hours[position]
+        if self.bedtimes[position] != NO_BEDTIME:
+            entry['bedtime'] = format_bedtime(self.bedtimes[position])
+        if not math.isnan(self.quality[position]):
+            entry['quality_score'] = self.quality[position]
+        return entry
+
+    def to_dict(self, last=None):
+        """
+        返回 {日期: 记录}，按日期升序
+        :param last: 只返回最近的 last 条
+        """
+        start = 0 if last is None else max(len(self.days) - last, 0)
+        return {datetime.date.fromordinal(self.days[i]).isoformat(): self.entry(i)
+                for i in range(start, len(self.days))}
+
+    @classmethod
+    def from_bytes(cls, data):
+        """由磁盘记录建立，返回 (序列, 记录条数)；同一天的多条记录以后写入的为准"""
+        series = cls()
+        count = len(data) // RECORD.size
+        values = struct.unpack('<' + RECORD.format.lstrip('<') * count, data)
+        days = values[0::4]
+        if all(map(operator.lt, days, days[1:])):
+            # 通常按日期顺序追加，各列直接整体转换为数组
+            series.days = array('I', days)
+            series.hours = array('d', values[1::4])
+            series.bedtimes = array('H', values[2::4])
+            series.quality = array('d', values[3::4])
+        else:
+            for row in RECORD.iter_unpack(data):
+                series.put(*row)
+        return series, count
+
+    def to_bytes(self):
+        return b''.join(RECORD.pack(*row) for row in zip(self.days, self.hours, self.bedtimes, self.quality))
+
+
+class SleepSeriesStore:
+    """按用户存储的睡眠时序数据
+
+    每个用户一个定长记录的追加文件（按用户名哈希前两位分目录），每晚的记录只追加 22 字节，
+    不重写历史；同一天重复写入也只是追加，读取时以最后一条为准，重复过多时在加载时压缩。
+    用户的数据在第一次访问时才读入内存并按列存放，最近访问的用户保存在有限大小的缓存中。
+    多进程共用目录（shared=True）时不压缩，缓存的序列在文件变长后只读入新增的记录。
+    """
+
+    def __init__(self, base_dir, cache_size=1024, legacy=None, drop_legacy=None, shared=False):
+        """
+        :param base_dir: 数据目录
+        :param cache_size: 内存中保留的用户数
+        :param legacy: 用户还没有数据文件时调用的函数，参数为用户名，返回旧格式的
+                       {日期: {'sleep_hours', 'bedtime', 'quality_score'}} 或 None，用于按需迁移旧数据
+        :param drop_legacy: 迁移的数据写入数据文件后调用的函数，参数为用户名，用于删除旧数据
+        :param shared: 是否有其它进程同时读写该目录
+        """
+        self.base_dir = base_dir
+        self.cache_size = cache_size
+        self.legacy = legacy
+        self.drop_legacy = drop_legacy
+        self.shared = shared
+        self.write_count = 0  # 本进程写入和删除的次数，单进程时可用作版本号
+        self._cache = OrderedDict()  # 用户名 -> [序列, 已读取的文件长度, 文件 inode]
+        self._lock = threading.RLock()
+
+    def _path(self, username):
+        digest = hashlib.sha1(username.encode('utf-8')).hexdigest()
+        return os.path.join(self.base_dir, digest[:2], digest + '.bin')
+
+    def _read_file(self, path):
+        """
+        读取数据文件，返回 [序列, 已读取的长度, inode]；文件不存在时返回 None
+        写到一半的末尾记录不读取，单进程时直接截掉
+        """
+        try:
+            with open(path, 'rb' if self.shared else 'r+b') as f:
+                data = f.read()
+                torn = len(data) % RECORD.size
+                if torn:
+                    data = data[:-torn]
+                    if not self.shared:
+                        f.truncate(len(data))
+                inode = os.fstat(f.fileno()).st_ino
+        except FileNotFoundError:
+            return None
+        series, count = SleepSeries.from_bytes(data)
+        size = len(data)
+        # 多进程时替换文件会丢掉其它进程同时追加的记录，不压缩
+        if not self.shared and count > 2 * len(series) + 16:
+            inode = self._write(path, series)
+            size = len(series) * RECORD.size
+        return [series, size, inode]
+
+    def _write(self, path, series, replace=True):
+        """
+        写入完整的数据文件并 fsync，返回新文件的 inode
+        :param replace: 为 False 时只在文件不存在时创建，已存在则抛出 FileExistsError
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_file = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_file, 'wb') as f:
+            f.write(series.to_bytes())
+            f.flush()
+            os.fsync(f.fileno())
+            inode = os.fstat(f.fileno()).st_ino
+        if replace:
+            os.replace(tmp_file, path)
+        else:
+            try:
+                os.link(tmp_file, path)
+            finally:
+                os.remove(tmp_file)
+        return inode
+
+    def _migrate(self, username, path):
+        """用户还没有数据文件时从旧数据建立；先写好数据文件再删除旧数据，中途崩溃不会丢失记录"""
+        legacy = self.legacy(username) if self.legacy is not None else None
+        if not legacy:
+            return [SleepSeries(), 0, None]
+        series = SleepSeries()
+        for date, entry in legacy.items():
+            series.put(*self._row(date, entry))
+        try:
+            inode = self._write(path, series, replace=False)
+        except FileExistsError:
+            # 其它进程已经迁移过或写入了新记录
+            return self._read_file(path) or [SleepSeries(), 0, None]
+        if self.drop_legacy is not None:
+            self.drop_legacy(username)
+        return [series, len(series) * RECORD.size, inode]
+
+    def _refresh(self, username, cached):
+        """其它进程追加过记录时读入新增部分；文件被删除或替换过时重新读取"""
+        path = self._path(username)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            if cached[2] is not None:
+                cached[:] = [SleepSeries(), 0, None]
+            return
+        if stat.st_ino != cached[2] or stat.st_size < cached[1]:
+            cached[:] = self._read_file(path) or [SleepSeries(), 0, None]
+        elif stat.st_size - cached[1] >= RECORD.size:
+            with open(path, 'rb') as f:
+                f.seek(cached[1])
+                data = f.read(stat.st_size - cached[1])
+            data = data[:len(data) - len(data) % RECORD.size]
+            for row in RECORD.iter_unpack(data):
+                cached[0].put(*row)
+            cached[1] += len(data)
+
+    def _load(self, username):
+        cached = self._cache.get(username)
+        if cached is not None:
+            self._cache.move_to_end(username)
+            if self.shared:
+                self._refresh(username, cached)
+            return cached[0]
+        path = self._path(username)
+        cached = self._read_file(path)
+        if cached is None:
+            cached = self._migrate(username, path)
+        self._cache[username] = cached
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return cached[0]
+
+    @staticmethod
+    def _row(date, entry):
+        day = datetime.date.fromisoformat(date).toordinal()
+        bedtime = parse_bedtime(entry.get('bedtime'))
+        return (day, _number(entry.get('sleep_hours')), NO_BEDTIME if bedtime is None else bedtime,
+                _number(entry.get('quality_score')))
+
+    def get(self, username):
+        """取得用户的睡眠序列（只读，不要修改返回的对象）"""
+        with self._lock:
+            return self._load(username)
+
+    def put(self, username, date, entry):
+        """
+        写入用户某天的记录，同一天覆盖
+        :param date: 'YYYY-MM-DD'
+        :param entry: {'sleep_hours', 'bedtime', 'quality_score'}，缺少的字段记为缺失
+        """
+        row = self._row(date, entry)
+        with self._lock:
+            series = self._load(username)
+            cached = self._cache[username]
+            path = self._path(username)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'ab') as f:
+                f.write(RECORD.pack(*row))
+            self.write_count += 1
+            if self.shared:
+                # 其它进程可能刚在前面追加过，按文件内容读入，连同本条一起
+                self._refresh(username, cached)
+                return
+            series.put(*row)
+            cached[1] += RECORD.size
+
+    def read(self, username):
+        """读取用户全部记录 {日期: 记录} 但不放入缓存，供导出等一次性遍历使用；没有数据文件时返回 None"""
+        with self._lock:
+            cached = self._cache.get(username) if not self.shared else None
+            series = cached[0] if cached is not None else None
+        if series is None:
+            try:
+                with open(self._path(username), 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                return None
+            series, _ = SleepSeries.from_bytes(data[:len(data) - len(data) % RECORD.size])
+        return series.to_dict()
+
+    def delete(self, username):
+        """删除用户的全部睡眠记录"""
+        with self._lock:
+            self._cache.pop(username, None)
+            try:
+                os.remove(self._path(username))
+            except FileNotFoundError:
+                pass
+            self.write_count += 1
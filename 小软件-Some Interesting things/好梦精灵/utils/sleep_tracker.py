@@ -1,35 +1,35 @@
 import datetime
-import json
-import os
-from .system_info import SystemInfo
+import math
+from .android_system import CrossPlatformSystem
 
 class SleepTracker:
-    def __init__(self):
-        self.data_file = 'sleep_data.json'
-        self.sleep_data = self.load_data()
+    def __init__(self, series=None):
+        """
+        :param series: 按用户存储睡眠记录的 SleepSeriesStore（通常为 UserService.sleep_series），
+                       为 None 时没有睡眠趋势
+        """
+        self.series = series
     
-    def load_data(self):
-        """加载睡眠数据"""
-        if os.path.exists(self.data_file):
-            with open(self.data_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return {}
-    
-    def save_data(self):
-        """保存睡眠数据"""
-        with open(self.data_file, 'w', encoding='utf-8') as f:
-            json.dump(self.sleep_data, f, ensure_ascii=False, indent=2)
+    def pattern_version(self):
+        """
+        睡眠模式检测结果的版本号：detect_sleep_pattern / get_sleep_trends 的结果
+        只随睡眠数据、当前日期和小时变化；多进程部署时其它进程的写入不计入本进程的计数，返回 None
+        """
+        if self.series is not None and self.series.shared:
+            return None
+        write_count = self.series.write_count if self.series is not None else 0
+        return write_count, datetime.datetime.now().strftime('%Y-%m-%d %H')
     
     def detect_sleep_pattern(self):
         """检测睡眠模式"""
-        sys_info = SystemInfo.get_system_info()
+        sys_info = CrossPlatformSystem.get_system_info()
         current_hour = datetime.datetime.now().hour
         
         # 检测是否为睡眠时间（22:00-06:00）
         is_sleep_time = current_hour >= 22 or current_hour <= 6
         
         # 检测屏幕活动
-        screen_active = sys_info['screen_time_hours'] > 0.1  # 最近有屏幕活动
+        screen_active = sys_info.get('screen_time_hours', 0) > 0.1  # 最近有屏幕活动
         
         return {
             'is_sleep_time': is_sleep_time,
@@ -79,15 +79,6 @@ class SleepTracker:
         else:
             suggestions.append("睡眠质量良好，请继续保持")
         
-        # 记录睡眠数据
-        today = datetime.datetime.now().strftime('%Y-%m-%d')
-        self.sleep_data[today] = {
-            'sleep_hours': sleep_hours,
-            'bedtime': bedtime,
-            'quality_score': quality_score
-        }
-        self.save_data()
-        
         return {
             'quality_score': quality_score,
             'suggestions': suggestions,
@@ -104,22 +95,27 @@ class SleepTracker:
         else:
             return "需改善"
     
-    def get_sleep_trends(self, days=7):
-        """获取睡眠趋势"""
-        recent_data = []
-        for i in range(days):
-            date = (datetime.datetime.now() - datetime.timedelta(days=i)).strftime('%Y-%m-%d')
-            if date in self.sleep_data:
-                recent_data.append(self.sleep_data[date])
-        
-        if not recent_data:
+    def get_recent_records(self, username, count=7):
+        """用户最近 count 条睡眠记录 {日期: 记录}，供图表使用"""
+        if self.series is None:
+            return {}
+        return self.series.get(username).to_dict(last=count)
+    
+    def get_sleep_trends(self, username, days=7):
+        """获取用户最近 days 天（含今天）的睡眠趋势，没有记录时返回 None"""
+        if self.series is None:
+            return None
+        series = self.series.get(username)
+        today = datetime.date.today().toordinal()
+        lo, hi = series.window(today - days + 1, today + 1)
+        hours = [h for h in series.hours[lo:hi] if not math.isnan(h)]
+        quality = [q for q in series.quality[lo:hi] if not math.isnan(q)]
+        if not hours or not quality:
             return None
-            
-        avg_hours = sum(d['sleep_hours'] for d in recent_data) / len(recent_data)
-        avg_quality = sum(d['quality_score'] for d in recent_data) / len(recent_data)
         
         return {
-            'avg_sleep_hours': round(avg_hours, 1),
-            'avg_quality_score': round(avg_quality, 1),
-            'trend': "改善" if len(recent_data) > 1 and recent_data[0]['quality_score'] > recent_data[-1]['quality_score'] else "稳定"
+            'avg_sleep_hours': round(sum(hours) / len(hours), 1),
+            'avg_quality_score': round(sum(quality) / len(quality), 1),
+            # 最近一天与最早一天的质量比较
+            'trend': "改善" if len(quality) > 1 and quality[-1] > quality[0] else "稳定"
         }
\ No newline at end of file
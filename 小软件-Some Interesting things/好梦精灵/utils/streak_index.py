@@ -0,0 +1,143 @@
+from datetime import date
+from .points_ledger import decode_days
+
+
+class _Streak:
+    """某个用户某种行为的活跃日期位图，第 i 位表示 first + i 这一天有活动"""
+
+    __slots__ = ('first', 'last', 'bits', 'current', 'longest')
+
+    def __init__(self, day):
+        self.first = day
+        self.last = day
+        self.bits = 0
+        self.current = 0   # 截至 last 的连续天数
+        self.longest = 0
+
+    def mark(self, start, end):
+        """标记 [start, end] 区间内的日期（日期序号）"""
+        if start < self.first:
+            self.bits <<= self.first - start
+            self.first = start
+        empty = not self.bits
+        run_start = self.last - self.current + 1
+        self.bits |= ((1 << (end - start + 1)) - 1) << (start - self.first)
+        if empty or start > self.last + 1:
+            # 第一次活动，或与之前的活动之间有空档，重新计数
+            self.current = end - start + 1
+        elif start >= run_start and end <= self.last:
+            # 当前连续区间内的日期（如同一天多次分析），没有变化
+            return
+        elif start >= run_start:
+            # 按时间顺序延续当前的连续区间（最常见的情况）
+            self.current += end - self.last
+        else:
+            # 补记过去的日期，可能连接起已有的区间，重新计算
+            self.last = max(self.last, end)
+            self._recompute()
+            return
+        self.last = end
+        self.longest = max(self.longest, self.current)
+
+    def merge(self, first, bits):
+        """合并一张从 first 开始的日期位图"""
+        if first < self.first:
+            self.bits <<= self.first - first
+            self.first = first
+        self.bits |= bits << (first - self.first)
+        self.last = max(self.last, self.first + self.bits.bit_length() - 1)
+        self._recompute()
+
+    def _recompute(self):
+        top = self.last - self.first
+        gaps = ~self.bits & ((1 << (top + 1)) - 1)
+        self.current = top + 1 - gaps.bit_length() if gaps else top + 1
+        # 每次与右移一位的自身相与，最长的连续 1 缩短一位
+        bits, longest = self.bits, 0
+        while bits:
+            bits &= bits >> 1
+            longest += 1
+        self.longest = longest
+
+
+class StreakIndex:
+    """连续活跃天数索引
+
+    作为 PointsLedger 的观察者，从带 action 的积分记录（以及结转记录中的日期位图）
+    为每个用户、每种行为维护一张按天的位图，并随写入更新当前连续天数和最长连续天数，
+    查询都是 O(1)。索引只在内存中，启动时随账本加载重建。
+    写入由账本在其锁内调用，读取不加锁。
+    """
+
+    def __init__(self):
+        self.users = {}
+
+    def reset(self):
+        self.users = {}
+
+    def observe(self, record):
+        """接收一条账本记录"""
+        user_id = record['user']
+        if record.get('forget'):
+            self.users.pop(user_id, None)
+            return
+        action = record.get('action')
+        if action:
+            day = date.fromisoformat(record['ts'][:10]).toordinal()
+            self.mark(user_id, action, day, day)
+        for action, encoded in record.get('days', {}).items():
+            first, bits = decode_days(encoded)
+            self._streak(user_id, action, first).merge(first, bits)
+
+    def _streak(self, user_id, action, day):
+        actions = self.users.get(user_id)
+        if actions is None:
+            actions = self.users[user_id] = {}
+        streak = actions.get(action)
+        if streak is None:
+            streak = actions[action] = _Streak(day)
+        return streak
+
+    def mark(self, user_id, action, start, end):
+        """标记用户在 [start, end]（日期序号）内每天都有该行为"""
+        self._streak(user_id, action, start).mark(start, end)
+
+    def _get(self, user_id, action):
+        return self.users.get(user_id, {}).get(action)
+
+    def current_streak(self, user_id, action, today=None):
+        """
+        当前连续天数：最后一次活动在今天或昨天时有效，否则为 0
+        :param today: 日期，默认为今天
+        """
+        streak = self._get(user_id, action)
+        if streak is None:
+            return 0
+        today = (today or date.today()).toordinal()
+        return streak.current if streak.last >= today - 1 else 0
+
+    def longest_streak(self, user_id, action):
+        """历史最长连续天数"""
+        streak = self._get(user_id, action)
+        return streak.longest if streak else 0
+
+    def last_active(self, user_id, action):
+        """最后一次活动的日期序号，没有活动时返回 None"""
+        streak = self._get(user_id, action)
+        return streak.last if streak else None
+
+    def active_days(self, user_id, action):
+        """有活动的总天数"""
+        streak = self._get(user_id, action)
+        return bin(streak.bits).count('1') if streak else 0
+
+    def summary(self, user_id, today=None):
+        """返回用户各行为的 {行为: {'current', 'longest', 'last_active'}}"""
+        return {
+            action: {
+                'current': self.current_streak(user_id, action, today),
+                'longest': streak.longest,
+                'last_active': date.fromordinal(streak.last).isoformat()
+            }
+            for action, streak in self.users.get(user_id, {}).items()
+        }
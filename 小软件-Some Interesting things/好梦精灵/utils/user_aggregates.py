@@ -0,0 +1,99 @@
+import threading
+from collections import Counter
+
+
+class UserAggregates:
+    """普通用户统计的增量维护
+
+    UserService 在每次修改时更新计数和累加和，/admin/stats 直接读取，无需遍历用户。
+    change_count 记录增量修改的次数，后台重建期间据此判断是否有修改未计入新的统计。
+    """
+
+    def __init__(self, bucket_width=10):
+        self.bucket_width = bucket_width
+        self._lock = threading.Lock()
+        self.change_count = 0
+        self.clear()
+
+    def clear(self):
+        self.total_users = 0
+        self.active_users = 0
+        self.score_sum = 0
+        self.wechat_users = 0
+        self.score_histogram = Counter()
+        self.registrations_per_day = Counter()
+
+    def rebuild(self, users):
+        """根据 (username, record) 序列重新统计"""
+        with self._lock:
+            self.clear()
+        for _, record in users:
+            self.add_user(record)
+
+    def _bucket(self, score):
+        return int(score // self.bucket_width * self.bucket_width)
+
+    def _add_score(self, score, sign):
+        self.change_count += 1
+        self.score_sum += sign * score
+        if score > 0:
+            self.active_users += sign
+        bucket = self._bucket(score)
+        self.score_histogram[bucket] += sign
+        if self.score_histogram[bucket] == 0:
+            del self.score_histogram[bucket]
+
+    def add_user(self, record):
+        if record.get('is_admin', False):
+            return
+        with self._lock:
+            self.total_users += 1
+            self._add_score(record.get('health_score', 0), 1)
+            if record.get('wechat_openid'):
+                self.wechat_users += 1
+            day = record.get('created_at', '')[:10]
+            if day:
+                self.registrations_per_day[day] += 1
+
+    def remove_user(self, record):
+        if record.get('is_admin', False):
+            return
+        with self._lock:
+            self.total_users -= 1
+            self._add_score(record.get('health_score', 0), -1)
+            if record.get('wechat_openid'):
+                self.wechat_users -= 1
+            day = record.get('created_at', '')[:10]
+            if day:
+                self.registrations_per_day[day] -= 1
+                if self.registrations_per_day[day] <= 0:
+                    del self.registrations_per_day[day]
+
+    def change_score(self, old_score, new_score):
+        with self._lock:
+            self._add_score(old_score, -1)
+            self._add_score(new_score, 1)
+
+    def change_wechat(self, old_openid, new_openid):
+        with self._lock:
+            self.change_count += 1
+            self.wechat_users += bool(new_openid) - bool(old_openid)
+
+    def reset_scores(self):
+        """所有普通用户分数清零"""
+        with self._lock:
+            self.change_count += 1
+            self.active_users = 0
+            self.score_sum = 0
+            self.score_histogram = Counter({0: self.total_users}) if self.total_users else Counter()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'total_users': self.total_users,
+                'active_users': self.active_users,
+                'avg_score': self.score_sum / max(self.total_users, 1),
+                'wechat_users': self.wechat_users,
+                'score_histogram': dict(sorted(self.score_histogram.items())),
+                'registrations_per_day': dict(sorted(self.registrations_per_day.items()))
+            }
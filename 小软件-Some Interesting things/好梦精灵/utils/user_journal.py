@@ -0,0 +1,178 @@
+import json
+import os
+import threading
+
+
+def apply_entry(users, entry):
+    """将一条日志记录应用到用户字典"""
+    op = entry.get('op')
+    username = entry.get('username')
+    updated_at = entry.get('at')
+
+    if op == 'put':
+        users[username] = entry['record']
+    elif op == 'score':
+        if username in users:
+            users[username]['health_score'] = users[username].get('health_score', 0) + entry['delta']
+            if updated_at:
+                users[username]['updated_at'] = updated_at
+    elif op == 'set':
+        if username in users:
+            users[username].update(entry['fields'])
+            if updated_at:
+                users[username]['updated_at'] = updated_at
+    elif op == 'delete':
+        users.pop(username, None)
+    elif op in ('reset_scores', 'clear_data'):
+        for data in users.values():
+            if not data.get('is_admin', False):
+                data['health_score'] = 0
+                if updated_at:
+                    data['updated_at'] = updated_at
+                if op == 'clear_data':
+                    # 时序数据保存在用户分片中，由分片存储负责清除
+                    data.pop('sleep_data', None)
+                    data.pop('behavior_data', None)
+
+
+class UserJournal:
+    """用户数据追加日志 + 快照
+
+    每次修改只向日志文件追加一行JSON，日志条数达到阈值后在后台线程中
+    将旧快照与日志合并为新快照。启动时读取快照并重放日志尾部。
+    """
+
+    def __init__(self, snapshot_file, compact_threshold=10000, fsync=False):
+        self.snapshot_file = snapshot_file
+        self.journal_file = snapshot_file + '.journal'
+        self.compacting_file = snapshot_file + '.journal.compacting'
+        self.compact_threshold = compact_threshold
+        self.fsync = fsync
+        self.entry_count = 0
+        self._lock = threading.Lock()
+        self._compact_thread = None
+        self._journal = None
+
+    def load(self):
+        """读取快照并重放日志"""
+        # 上次合并未完成时，先把被轮转出去的旧日志合并进快照
+        if os.path.exists(self.compacting_file):
+            self._run_compaction()
+
+        users = self._read_snapshot(self.snapshot_file)
+        self.entry_count = self._replay(self.journal_file, users)
+        return users
+
+    def append(self, op, username=None, **payload):
+        """追加一条修改记录"""
+        entry = {'op': op}
+        if username is not None:
+            entry['username'] = username
+        entry.update(payload)
+        line = json.dumps(entry, ensure_ascii=False) + '\n'
+
+        with self._lock:
+            if self._journal is None:
+                self._journal = open(self.journal_file, 'a', encoding='utf-8')
+            self._journal.write(line)
+            self._journal.flush()
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+            self.entry_count += 1
+            should_compact = self.entry_count >= self.compact_threshold
+
+        if should_compact:
+            self.compact()
+
+    def compact(self, wait=False):
+        """在后台线程中把快照和日志合并为新快照"""
+        with self._lock:
+            if self._compact_thread is not None and self._compact_thread.is_alive():
+                thread = self._compact_thread
+            elif not os.path.exists(self.journal_file) or os.path.exists(self.compacting_file):
+                thread = None
+            else:
+                # 轮转日志：之后的修改写入新的日志文件
+                if self._journal is not None:
+                    self._journal.close()
+                    self._journal = None
+                os.replace(self.journal_file, self.compacting_file)
+                self.entry_count = 0
+                thread = threading.Thread(target=self._run_compaction, daemon=True)
+                self._compact_thread = thread
+                thread.start()
+
+        if wait and thread is not None:
+            thread.join()
+
+    def write_snapshot(self, users):
+        """直接用当前内存数据写出快照并清空日志"""
+        with self._lock:
+            if self._compact_thread is not None and self._compact_thread.is_alive():
+                self._compact_thread.join()
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            self._write_snapshot(users)
+            for path in (self.journal_file, self.compacting_file):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.entry_count = 0
+
+    def close(self):
+        """关闭日志文件"""
+        with self._lock:
+            thread = self._compact_thread
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+        if thread is not None:
+            thread.join()
+
+    def _run_compaction(self):
+        """合并线程：旧快照 + 轮转日志 -> 新快照"""
+        users = self._read_snapshot(self.snapshot_file)
+        self._replay(self.compacting_file, users)
+        self._write_snapshot(users)
+        os.remove(self.compacting_file)
+
+    def _write_snapshot(self, users):
+        """原子写入快照文件"""
+        tmp_file = self.snapshot_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(users, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.snapshot_file)
+
+    def _read_snapshot(self, path):
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {}
+
+    def _replay(self, path, users):
+        """重放日志，返回有效记录条数"""
+        if not os.path.exists(path):
+            return 0
+
+        count = 0
+        valid_size = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                # 崩溃时最后一行可能只写了一半
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    entry = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    break
+                apply_entry(users, entry)
+                count += 1
+                valid_size += len(line)
+
+        # 截掉不完整的尾部，避免后续追加的记录与其拼接
+        if valid_size < os.path.getsize(path):
+            with open(path, 'r+b') as f:
+                f.truncate(valid_size)
+        return count
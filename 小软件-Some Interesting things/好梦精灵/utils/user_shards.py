@@ -0,0 +1,211 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+SERIES_KINDS = ('sleep_data', 'behavior_data')
+
+
+def _apply_record(shard, record):
+    """把一条追加记录应用到分片：带 key 的写入单条记录，否则整体替换（data 为 None 表示删除）"""
+    kind = record['kind']
+    if 'key' in record:
+        shard.setdefault(kind, {})[record['key']] = record['entry']
+    elif record.get('data') is None:
+        shard.pop(kind, None)
+    else:
+        shard[kind] = record['data']
+
+
+class UserShardStore:
+    """按用户分片存储的时序数据（sleep_data / behavior_data）
+
+    每个用户一个快照文件加一个追加日志，按用户名哈希前两位分目录。每天的记录只向日志追加一行，
+    不重写历史；日志行数超过分片记录数的两倍时合并进快照。读取时在快照上重放日志，
+    只在图表或导出需要时读取，最近访问的分片保存在有限大小的缓存中。
+    多进程共用目录（shared=True）时不合并日志，缓存的分片在日志变长后只重放新增部分。
+    """
+
+    def __init__(self, base_dir, cache_size=256, shared=False):
+        """
+        :param base_dir: 数据目录
+        :param cache_size: 内存中保留的分片数
+        :param shared: 是否有其它进程同时读写该目录
+        """
+        self.base_dir = base_dir
+        self.cache_size = cache_size
+        self.shared = shared
+        self._cache = OrderedDict()  # 用户名 -> [分片, 日志记录数, 已读取的日志长度]
+        self._lock = threading.RLock()
+
+    def _shard_path(self, username):
+        digest = hashlib.sha1(username.encode('utf-8')).hexdigest()
+        return os.path.join(self.base_dir, digest[:2], digest + '.json')
+
+    def _log_path(self, username):
+        return os.path.splitext(self._shard_path(username))[0] + '.log'
+
+    def _replay(self, shard, log_path, offset=0):
+        """
+        从 offset 起重放日志；写到一半的末尾行不重放，单进程时直接截掉
+        :return: (重放的记录数, 新的日志长度)
+        """
+        try:
+            with open(log_path, 'r+b') as f:
+                f.seek(offset)
+                data = f.read()
+                end = data.rfind(b'\n') + 1
+                if end < len(data) and not self.shared:
+                    f.truncate(offset + end)
+        except FileNotFoundError:
+            return 0, 0
+        count = 0
+        for line in data[:end].splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            _apply_record(shard, record)
+            count += record.get('weight', 1)
+        return count, offset + end
+
+    def _read(self, username):
+        """读取快照并重放日志，返回 [分片, 日志记录数, 日志长度]"""
+        path = self._shard_path(username)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                shard = json.load(f)
+        else:
+            shard = {'username': username}
+        count, size = self._replay(shard, self._log_path(username))
+        return [shard, count, size]
+
+    def _load(self, username):
+        """读取用户分片（带缓存）"""
+        cached = self._cache.get(username)
+        if cached is not None:
+            self._cache.move_to_end(username)
+            if self.shared:
+                self._refresh(username, cached)
+            return cached[0]
+
+        cached = self._read(username)
+        self._cache[username] = cached
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return cached[0]
+
+    def _refresh(self, username, cached):
+        """其它进程追加过日志时重放新增部分；日志变短说明分片已被删除，重新读取"""
+        try:
+            size = os.path.getsize(self._log_path(username))
+        except FileNotFoundError:
+            size = 0
+        if size > cached[2]:
+            count, cached[2] = self._replay(cached[0], self._log_path(username), cached[2])
+            cached[1] += count
+        elif size < cached[2]:
+            cached[:] = self._read(username)
+
+    def _append(self, username, record):
+        """追加一条记录并应用到缓存中的分片"""
+        shard = self._load(username)
+        cached = self._cache[username]
+        path = self._log_path(username)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        with open(path, 'ab') as f:
+            f.write(line)
+        if self.shared:
+            # 其它进程可能刚在前面追加过，按文件内容重放，连同本条一起读入
+            self._refresh(username, cached)
+            return
+        _apply_record(shard, record)
+        cached[1] += record.get('weight', 1)
+        cached[2] += len(line)
+        if cached[1] > 2 * self._entry_count(shard) + 16:
+            self._compact(username, cached)
+
+    @staticmethod
+    def _entry_count(shard):
+        return sum(len(shard[kind]) for kind in SERIES_KINDS if isinstance(shard.get(kind), dict))
+
+    def _compact(self, username, cached):
+        """把分片写成新快照并删除日志；两步之间崩溃时日志会在新快照上再重放一遍，结果不变"""
+        path = self._shard_path(username)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_file = path + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(cached[0], ensure_ascii=False))
+        os.replace(tmp_file, path)
+        try:
+            os.remove(self._log_path(username))
+        except FileNotFoundError:
+            pass
+        cached[1] = cached[2] = 0
+
+    def get(self, username, kind):
+        """获取用户某类时序数据 {日期: 记录}"""
+        with self._lock:
+            return dict(self._load(username).get(kind, {}))
+
+    def read(self, username):
+        """读取用户完整分片但不放入缓存，供导出等一次性遍历使用"""
+        with self._lock:
+            cached = self._cache.get(username)
+            if cached is not None:
+                if self.shared:
+                    self._refresh(username, cached)
+                return dict(cached[0])
+            return self._read(username)[0]
+
+    def put(self, username, kind, key, entry):
+        """写入一条记录（同一日期覆盖），只追加到日志"""
+        with self._lock:
+            self._append(username, {'kind': kind, 'key': key, 'entry': entry})
+
+    def replace(self, username, kind, data):
+        """整体替换用户某类时序数据"""
+        with self._lock:
+            self._replace(username, {'kind': kind, 'data': data, 'weight': len(data)})
+
+    def pop(self, username, kind):
+        """取出并删除用户某类时序数据，没有时返回 None"""
+        with self._lock:
+            data = self._load(username).get(kind)
+            if data is not None:
+                self._replace(username, {'kind': kind, 'data': None})
+            return data
+
+    def _replace(self, username, record):
+        # 单进程时整体替换直接写成新快照，不经过日志
+        if self.shared:
+            self._append(username, record)
+            return
+        _apply_record(self._load(username), record)
+        self._compact(username, self._cache[username])
+
+    def delete(self, username):
+        """删除用户分片"""
+        with self._lock:
+            self._cache.pop(username, None)
+            for path in (self._shard_path(username), self._log_path(username)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+
+def split_embedded_series(users, shard_store):
+    """把用户记录中内嵌的时序数据移入分片，返回被修改的用户数"""
+    moved = 0
+    for username, record in users.items():
+        if not any(kind in record for kind in SERIES_KINDS):
+            continue
+        for kind in SERIES_KINDS:
+            data = record.pop(kind, None)
+            if data:
+                shard_store.replace(username, kind, data)
+        moved += 1
+    return moved
@@ -1,12 +1,29 @@
 import datetime
 import json
 import os
+import threading
+from collections import OrderedDict, defaultdict
 from flask import request
+from .write_behind import write_behind
 
 class UserTracker:
-    def __init__(self):
+    def __init__(self, sessions=None):
+        """
+        :param sessions: 共享的会话字典（如 SharedState 命名空间），为 None 时使用 user_sessions.json
+        """
         self.sessions_file = 'user_sessions.json'
-        self.sessions = self.load_sessions()
+        self.shared = sessions is not None
+        self._lock = threading.Lock()
+        # 本进程会话的索引：按最后活动时间排列的用户名，以及设备类型到用户名集合
+        self.activity = OrderedDict()
+        self.by_device = defaultdict(set)
+        if self.shared:
+            self.sessions = sessions
+        else:
+            self.sessions = self.load_sessions()
+            # 会话整条替换而不原地修改，浅拷贝即是某一时刻的完整数据
+            write_behind.register(self.sessions_file, lambda: dict(self.sessions))
+            self._rebuild_indexes()
     
     def load_sessions(self):
         """加载用户会话数据"""
@@ -16,9 +33,29 @@ class UserTracker:
         return {}
     
     def save_sessions(self):
-        """保存用户会话数据"""
-        with open(self.sessions_file, 'w', encoding='utf-8') as f:
-            json.dump(self.sessions, f, ensure_ascii=False, indent=2)
+        """保存用户会话数据（由后台线程合并写入）"""
+        if not self.shared:
+            write_behind.mark_dirty(self.sessions_file)
+    
+    def _rebuild_indexes(self):
+        with self._lock:
+            items = sorted(self.sessions.items(), key=lambda item: item[1]['last_active'])
+            self.activity = OrderedDict((username, session['last_active']) for username, session in items)
+            self.by_device = defaultdict(set)
+            for username, session in items:
+                self.by_device[self.get_device_type(session.get('user_agent'))].add(username)
+    
+    def _index_session(self, username, old_session, session):
+        """会话变化后更新索引，session 为 None 表示删除"""
+        if self.shared:
+            return
+        with self._lock:
+            self.activity.pop(username, None)
+            if old_session is not None:
+                self.by_device[self.get_device_type(old_session.get('user_agent'))].discard(username)
+            if session is not None:
+                self.activity[username] = session['last_active']
+                self.by_device[self.get_device_type(session.get('user_agent'))].add(username)
     
     def update_user_session(self, username):
         """更新用户会话信息"""
@@ -26,12 +63,15 @@ class UserTracker:
         ip_address = self.get_client_ip()
         user_agent = request.headers.get('User-Agent', '')
         
-        self.sessions[username] = {
+        old_session = self.sessions.get(username)
+        session = {
             'last_active': now,
             'ip_address': ip_address,
             'user_agent': user_agent,
-            'login_time': self.sessions.get(username, {}).get('login_time', now)
+            'login_time': (old_session or {}).get('login_time', now)
         }
+        self.sessions[username] = session
+        self._index_session(username, old_session, session)
         self.save_sessions()
     
     def get_client_ip(self):
@@ -45,16 +85,20 @@ class UserTracker:
     
     def is_user_online(self, username, timeout_minutes=30):
         """检查用户是否在线"""
-        if username not in self.sessions:
+        session = self.sessions.get(username)
+        if session is None:
             return False
-        
-        last_active = datetime.datetime.fromisoformat(self.sessions[username]['last_active'])
+        return self._is_active(session, timeout_minutes)
+    
+    def _is_active(self, session, timeout_minutes=30):
+        last_active = datetime.datetime.fromisoformat(session['last_active'])
         now = datetime.datetime.now()
         return (now - last_active).total_seconds() < (timeout_minutes * 60)
     
     def get_user_status(self, username):
         """获取用户状态信息"""
-        if username not in self.sessions:
+        session = self.sessions.get(username)
+        if session is None:
             return {
                 'is_online': False,
                 'last_active': None,
@@ -63,9 +107,11 @@ class UserTracker:
                 'login_time': None
             }
         
-        session = self.sessions[username]
+        return self._session_status(session)
+    
+    def _session_status(self, session):
         return {
-            'is_online': self.is_user_online(username),
+            'is_online': self._is_active(session),
             'last_active': session['last_active'],
             'ip_address': session['ip_address'],
             'user_agent': session['user_agent'],
@@ -92,11 +138,48 @@ class UserTracker:
         else:
             return 'Other'
     
+    def online_usernames(self, timeout_minutes=30):
+        """最近 timeout_minutes 分钟内活跃的用户名，最近活跃的在前"""
+        cutoff = (datetime.datetime.now() - datetime.timedelta(minutes=timeout_minutes)).isoformat()
+        if self.shared:
+            return [username for username, session in self.sessions.items() if session['last_active'] >= cutoff]
+        result = []
+        with self._lock:
+            # 从最近活跃的一端开始，遇到超时的会话即可停止
+            for username in reversed(self.activity):
+                if self.activity[username] < cutoff:
+                    break
+                result.append(username)
+        return result
+    
+    def find_usernames(self, online=False, device=None, timeout_minutes=30):
+        """
+        按会话条件查找用户名
+        :param online: 只要在线用户
+        :param device: 设备类型，如 Android / iOS / Windows
+        :return: 用户名集合；没有任何条件时返回 None，表示不限制
+        """
+        if not online and not device:
+            return None
+        if self.shared:
+            # 共享会话保存在数据库中，只包含近期活跃过的用户，直接按条件扫描
+            return {
+                username for username, session in self.sessions.items()
+                if (not online or self._is_active(session, timeout_minutes))
+                and (not device or self.get_device_type(session.get('user_agent')) == device)
+            }
+        candidates = set(self.online_usernames(timeout_minutes)) if online else None
+        if device:
+            with self._lock:
+                devices = set(self.by_device.get(device, ()))
+            candidates = devices if candidates is None else candidates & devices
+        return candidates
+    
     def get_all_user_status(self):
         """获取所有用户状态"""
         result = {}
-        for username in self.sessions:
-            result[username] = self.get_user_status(username)
+        for username, session in self.sessions.items():
+            result[username] = self._session_status(session)
         return result
     
     def cleanup_old_sessions(self, days=7):
@@ -104,13 +187,13 @@ class UserTracker:
         cutoff = datetime.datetime.now() - datetime.timedelta(days=days)
         
         to_remove = []
-        for username, session in self.sessions.items():
+        for username, session in list(self.sessions.items()):
             last_active = datetime.datetime.fromisoformat(session['last_active'])
             if last_active < cutoff:
                 to_remove.append(username)
         
         for username in to_remove:
-            del self.sessions[username]
+            self._index_session(username, self.sessions.pop(username), None)
         
         if to_remove:
             self.save_sessions()
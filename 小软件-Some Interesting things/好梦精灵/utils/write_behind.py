@@ -0,0 +1,126 @@
+import atexit
+import json
+import os
+import threading
+import time
+
+
+class WriteBehindWriter:
+    """JSON 文件延迟合并写入
+
+    请求线程只把文件标记为脏，后台线程在最多 interval 秒后把所有脏文件写出一次，
+    同一间隔内的多次修改合并为一次整体写入。写入采用临时文件 + rename 保证原子性，
+    进程退出时自动写出剩余数据，因此异常崩溃时最多丢失 interval 秒内的修改。
+    """
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self._stores = {}
+        self._dirty = set()
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+        self.mark_count = 0
+        self.write_count = 0
+        atexit.register(self.stop)
+
+    def register(self, path, get_data, indent=2, on_write=None):
+        """
+        注册一个由本写入器负责的文件
+        :param path: 文件路径
+        :param get_data: 返回待写出数据的函数，需返回某一时刻的完整快照（在数据的锁内复制），
+                         写入器在自己的线程中序列化，不持有数据的锁
+        :param indent: JSON 缩进
+        :param on_write: 文件写出后调用的函数，参数为文件路径
+        """
+        with self._cond:
+            self._stores[path] = (get_data, indent, on_write)
+
+    def unregister(self, path):
+        """写出剩余修改后不再负责该文件"""
+        self.flush(path)
+        with self._cond:
+            self._stores.pop(path, None)
+            self._dirty.discard(path)
+
+    def mark_dirty(self, path):
+        """标记文件需要写出"""
+        with self._cond:
+            self.mark_count += 1
+            self._dirty.add(path)
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def flush(self, path=None, force=False):
+        """
+        立即写出脏文件
+        :param path: 只写出指定文件，默认全部
+        :param force: 即使未标记为脏也写出
+        """
+        with self._cond:
+            if path is None:
+                paths = set(self._dirty)
+                self._dirty.clear()
+            else:
+                paths = {path} if (force or path in self._dirty) else set()
+                self._dirty.discard(path)
+
+        for item in paths:
+            if item in self._stores:
+                self._write(item)
+
+    def stop(self):
+        """停止后台线程并写出剩余数据"""
+        with self._cond:
+            self._stopping = True
+            thread = self._thread
+            self._cond.notify()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._dirty and not self._stopping:
+                    self._cond.wait()
+                if self._stopping:
+                    return
+                # 等待一个间隔，合并这段时间内的所有修改；stop 会提前唤醒
+                deadline = time.monotonic() + self.interval
+                while not self._stopping:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            self.flush()
+
+    def _write(self, path):
+        store = self._stores.get(path)
+        if store is None:
+            # 已被 unregister
+            return
+        get_data, indent, on_write = store
+        # get_data 负责在数据所有者的锁内取得一致的快照
+        content = json.dumps(get_data(), ensure_ascii=False, indent=indent)
+
+        with self._write_lock:
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+            tmp_file = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, path)
+            self.write_count += 1
+        if on_write is not None:
+            on_write(path)
+
+
+# 创建全局写入器供各存储共享
+write_behind = WriteBehindWriter(float(os.environ.get('WRITE_BEHIND_INTERVAL', '1.0')))